@@ -1,4 +1,8 @@
 import mysql.connector as mysql
+from mysql.connector import pooling
+from datetime import datetime
+import sqlite3
+import re
 
 
 class DbConnector:
@@ -12,16 +16,20 @@ class DbConnector:
     DATABASE = "testdb" // Database name, if you just want to connect to MySQL server, leave it empty
     USER = "testuser" // This is the user you created and added privileges for
     PASSWORD = "test123" // The password you set for said user
+    ALLOW_LOCAL_INFILE = True // Optional, allows LOAD DATA LOCAL INFILE (the server needs local_infile=ON)
     """
 
     def __init__(self,
                  HOST="localhost",
                  DATABASE="database",
                  USER="TEST_USER",
-                 PASSWORD="test123"):
+                 PASSWORD="test123",
+                 ALLOW_LOCAL_INFILE=False,
+                 PORT=3306):
         # Connect to the database
         try:
-            self.db_connection = mysql.connect(host=HOST, database=DATABASE, user=USER, password=PASSWORD, port=3306)
+            self.db_connection = mysql.connect(host=HOST, database=DATABASE, user=USER, password=PASSWORD, port=PORT,
+                                               allow_local_infile=ALLOW_LOCAL_INFILE)
         except Exception as e:
             print("ERROR: Failed to connect to db:", e)
 
@@ -42,3 +50,255 @@ class DbConnector:
         self.db_connection.close()
         print("\n-----------------------------------------------")
         print("Connection to %s is closed" % self.db_connection.get_server_info())
+
+
+class DbConnectionPool:
+    """
+    A pool of connections to the MySQL server, so that queries can run on several connections concurrently.
+    Takes the same connection arguments as DbConnector, and SIZE, the number of connections (at most 32)
+    """
+
+    def __init__(self,
+                 SIZE=4,
+                 HOST="localhost",
+                 DATABASE="database",
+                 USER="TEST_USER",
+                 PASSWORD="test123",
+                 PORT=3306):
+        self.pool = pooling.MySQLConnectionPool(pool_name="tdt4225", pool_size=SIZE, host=HOST, database=DATABASE,
+                                                user=USER, password=PASSWORD, port=PORT)
+
+    def get_connector(self):
+        """Borrows a connection from the pool. Raises PoolError if all of them are in use
+
+        Returns:
+            PooledDbConnector: the connection
+        """
+        return PooledDbConnector(self.pool.get_connection())
+
+
+class PooledDbConnector:
+    """
+    A connection borrowed from a DbConnectionPool, used like a DbConnector.
+    close_connection returns the connection to the pool instead of closing it
+    """
+
+    def __init__(self, db_connection):
+        self.db_connection = db_connection
+        self.cursor = self.db_connection.cursor()
+
+    def close_connection(self):
+        self.cursor.close()
+        self.db_connection.close()
+
+
+class SqliteDbConnector:
+    """
+    An embedded SQLite database, used like a DbConnector without a MySQL server. The queries of Part1 and Part2
+    are written for MySQL, so the cursor translates them to SQLite, see SqliteCursor.
+    The database is opened in WAL mode, so that readers do not block the writer.
+
+    Example:
+    PATH = "database.sqlite" // The database file, created if it does not exist. ":memory:" for a temporary database
+    """
+
+    def __init__(self, PATH="database.sqlite"):
+        self.path = PATH
+        # Several processes may insert into the same file, each waits up to the timeout for the others to commit.
+        # The cursor is used by the prefetching thread of Part2._stream_arrays, one thread at a time
+        self.db_connection = sqlite3.connect(PATH, timeout=60, detect_types=sqlite3.PARSE_DECLTYPES,
+                                             check_same_thread=False)
+        self.db_connection.execute("PRAGMA journal_mode = WAL")
+        # Every commit is still atomic in WAL mode, but only flushed to disk at checkpoints
+        self.db_connection.execute("PRAGMA synchronous = NORMAL")
+        self.db_connection.execute("PRAGMA foreign_keys = ON")
+        _create_sqlite_functions(self.db_connection)
+        self.cursor = SqliteCursor(self.db_connection.cursor())
+
+        print("Connected to: SQLite", sqlite3.sqlite_version)
+        print("You are connected to the database:", PATH)
+        print("-----------------------------------------------\n")
+
+    def close_connection(self):
+        # close the cursor
+        self.cursor.close()
+        # close the DB connection
+        self.db_connection.close()
+        print("\n-----------------------------------------------")
+        print("Connection to %s is closed" % self.path)
+
+
+# Stored as text in the format MySQL returns them, which the date functions of SQLite understand
+sqlite3.register_adapter(datetime, lambda date_time: date_time.isoformat(" "))
+sqlite3.register_converter("DATETIME", lambda value: datetime.fromisoformat(value.decode()))
+
+TIMESTAMPDIFF_UNITS = {"SECOND": 1, "MINUTE": 60, "HOUR": 60 * 60, "DAY": 24 * 60 * 60}
+
+
+def _create_sqlite_functions(db_connection):
+    """Creates the MySQL functions used by the queries, and views with the part of information_schema they read
+    """
+    db_connection.create_function("DATEDIFF", 2, _datediff, deterministic=True)
+    db_connection.create_function("TIMEDIFF", 2, _timediff, deterministic=True)
+    db_connection.create_function("TIMESTAMPDIFF", 3, _timestampdiff, deterministic=True)
+    db_connection.execute("""
+    CREATE TEMP VIEW IF NOT EXISTS information_schema_columns AS
+    SELECT 'main' AS table_schema, tables.name AS table_name, columns.name AS column_name
+    FROM sqlite_master AS tables, pragma_table_info(tables.name) AS columns
+    WHERE tables.type = 'table'
+    """)
+    db_connection.execute("""
+    CREATE TEMP VIEW IF NOT EXISTS information_schema_statistics AS
+    SELECT 'main' AS table_schema, tables.name AS table_name, indexes.name AS index_name
+    FROM sqlite_master AS tables, pragma_index_list(tables.name) AS indexes
+    WHERE tables.type = 'table'
+    """)
+    # SQLite has no partitioned tables, every table is a single unnamed partition like in MySQL
+    db_connection.execute("""
+    CREATE TEMP VIEW IF NOT EXISTS information_schema_partitions AS
+    SELECT 'main' AS table_schema, name AS table_name, NULL AS partition_name
+    FROM sqlite_master
+    WHERE type = 'table'
+    """)
+
+
+def _parse_date_time(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _datediff(end, start):
+    """MySQL DATEDIFF, the number of dates from start to end
+    """
+    if end is None or start is None:
+        return None
+    return (_parse_date_time(end).date() - _parse_date_time(start).date()).days
+
+
+def _timediff(end, start):
+    """MySQL TIMEDIFF, the time from start to end as [-]HH:MM:SS
+    """
+    if end is None or start is None:
+        return None
+    seconds = int((_parse_date_time(end) - _parse_date_time(start)).total_seconds())
+    sign = "-" if seconds < 0 else ""
+    hours, rest = divmod(abs(seconds), 60 * 60)
+    return f"{sign}{hours:02d}:{rest // 60:02d}:{rest % 60:02d}"
+
+
+def _timestampdiff(unit, start, end):
+    """MySQL TIMESTAMPDIFF for units up to days, the whole units from start to end
+    """
+    if start is None or end is None:
+        return None
+    seconds = int((_parse_date_time(end) - _parse_date_time(start)).total_seconds())
+    # Truncated towards zero, like MySQL
+    return int(seconds / TIMESTAMPDIFF_UNITS[unit])
+
+
+class SqliteCursor:
+    """
+    Wraps an SQLite cursor, and translates the MySQL dialect of the queries to SQLite before running them:
+    placeholders, AUTO_INCREMENT, upserts, index definitions, SHOW TABLES, foreign_key_checks and
+    information_schema. Each query is translated once. The MySQL functions DATEDIFF, TIMEDIFF and
+    TIMESTAMPDIFF are created on the connection. SQLite cannot add a foreign key to an existing table,
+    so ALTER TABLE ... ADD FOREIGN KEY is left out. UPDATE ... JOIN has no translation and raises ValueError
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.translations = {}
+
+    @property
+    def column_names(self):
+        return tuple(column[0] for column in self.cursor.description or ())
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def execute(self, query, params=None):
+        for statement in self._translate(query):
+            self.cursor.execute(statement, params if params is not None else ())
+
+    def executemany(self, query, seq_params):
+        *statements, last = self._translate(query)
+        for statement in statements:
+            self.cursor.execute(statement)
+        self.cursor.executemany(last, seq_params)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size=1):
+        return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+    def _translate(self, query):
+        """
+        Returns:
+            list[string]: the SQLite statements doing what the MySQL query does
+        """
+        if query not in self.translations:
+            self.translations[query] = _translate_query(query)
+        return self.translations[query]
+
+
+def _translate_query(query):
+    query = query.strip().rstrip(";")
+    query = re.sub(r"%\((\w+)\)s", r":\1", query)
+    query = query.replace("%s", "?")
+    if sqlite3.sqlite_version_info >= (3, 38, 0):
+        # Seconds since 1970 of a column, computed by SQLite instead of a Python function call per row
+        query = re.sub(r"TIMESTAMPDIFF\(\s*SECOND\s*,\s*'1970-01-01'\s*,\s*([\w.]+)\s*\)", r"unixepoch(\1)", query)
+    query = re.sub(r"TIMESTAMPDIFF\(\s*(\w+)\s*,", r"TIMESTAMPDIFF('\1',", query)
+    query = re.sub(r"information_schema\.(\w+)", r"information_schema_\1", query)
+    query = query.replace("DATABASE()", "'main'")
+
+    if re.fullmatch(r"SHOW TABLES", query, re.IGNORECASE):
+        return ["SELECT name AS Tables FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"]
+
+    if re.match(r"UPDATE \w+\s+(?:(?:INNER|LEFT|CROSS) )?JOIN\b", query):
+        # SQLite only updates a joined table with UPDATE ... FROM, which has to be written by hand
+        raise ValueError("SQLite does not support UPDATE ... JOIN, the query is not translated from MySQL")
+
+    match = re.fullmatch(r"SET foreign_key_checks\s*=\s*(\d)", query, re.IGNORECASE)
+    if match:
+        return [f"PRAGMA foreign_keys = {'ON' if match.group(1) == '1' else 'OFF'}"]
+
+    match = re.search(r"ON DUPLICATE KEY UPDATE(.*)$", query, re.DOTALL)
+    if match:
+        # The new values of a row are called excluded in an SQLite upsert
+        assignments = re.sub(r"VALUES\((\w+)\)", r"excluded.\1", match.group(1))
+        query = query[:match.start()] + "ON CONFLICT DO UPDATE SET" + assignments
+
+    match = re.match(r"CREATE TABLE (?:IF NOT EXISTS )?(\w+)", query)
+    if match:
+        # Only an INTEGER PRIMARY KEY is assigned automatically
+        query = re.sub(r"\bINT AUTO_INCREMENT PRIMARY KEY", "INTEGER PRIMARY KEY", query)
+        indexes = re.findall(r",\s*INDEX (\w+) (\([^)]*\))", query)
+        query = re.sub(r",\s*INDEX \w+ \([^)]*\)", "", query)
+        return [query] + [f"CREATE INDEX IF NOT EXISTS {name} ON {match.group(1)} {columns}"
+                          for name, columns in indexes]
+
+    match = re.match(r"ALTER TABLE (\w+)\s+(.*)$", query, re.DOTALL)
+    if match:
+        table, statements = match.group(1), []
+        for clause in re.split(r",\s*(?=ADD |DROP )", match.group(2)):
+            clause = clause.strip()
+            index = re.fullmatch(r"ADD INDEX (\w+) (\([^)]*\))", clause)
+            if index:
+                statements.append(f"CREATE INDEX IF NOT EXISTS {index.group(1)} ON {table} {index.group(2)}")
+            elif clause.startswith("DROP INDEX "):
+                statements.append(f"DROP INDEX IF EXISTS {clause[len('DROP INDEX '):]}")
+            elif clause.startswith("ADD COLUMN "):
+                # Columns are always added last
+                column = re.sub(r" AFTER \w+$", "", clause)
+                statements.append(f"ALTER TABLE {table} {column}")
+        return statements
+
+    return [query]
@@ -0,0 +1,52 @@
+from haversine import haversine_vector
+import numpy as np
+
+# Altitude of track points without a valid altitude
+INVALID_ALTITUDE = -777
+FEET_TO_METERS = 0.3048
+
+
+def summarize_activity(lats, lons, altitudes, date_times):
+    """Computes the per-activity facts the analytical tasks need, so that they do not have to
+    be recomputed from the track points on every run
+
+    Args:
+        lats (np.ndarray): latitude of each track point, in recorded order
+        lons (np.ndarray): longitude of each track point
+        altitudes (np.ndarray): altitude of each track point, in feet
+        date_times (np.ndarray): time of each track point, as datetime64[s]
+
+    Returns:
+        dict: bounding box, number of track points, total distance in km between consecutive
+        track points, altitude gained in meters (ignoring invalid altitudes), largest time difference
+        between consecutive track points in seconds, and the first and last date time
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    altitudes = np.asarray(altitudes, dtype=np.int64)
+    date_times = np.asarray(date_times, dtype="datetime64[s]")
+    seconds = date_times.astype(np.int64)
+
+    if len(lats) > 1:
+        locations = np.column_stack((lats, lons))
+        total_distance = float(haversine_vector(locations[:-1], locations[1:]).sum())
+        max_time_gap = int(np.abs(np.diff(seconds)).max())
+    else:
+        total_distance = 0.0
+        max_time_gap = 0
+
+    # Invalid altitudes are left out, so the gain is measured between the remaining consecutive points
+    valid_altitudes = altitudes[altitudes != INVALID_ALTITUDE]
+    altitude_steps = np.diff(valid_altitudes)
+    altitude_gain = float(altitude_steps[altitude_steps > 0].sum() * FEET_TO_METERS)
+
+    return {"min_lat": float(lats.min()),
+            "max_lat": float(lats.max()),
+            "min_lon": float(lons.min()),
+            "max_lon": float(lons.max()),
+            "point_count": len(lats),
+            "total_distance": total_distance,
+            "altitude_gain": altitude_gain,
+            "max_time_gap": max_time_gap,
+            "start_date_time": date_times[0].item(),
+            "end_date_time": date_times[-1].item()}
@@ -1,18 +1,63 @@
-from DbConnector import DbConnector
+from DbConnector import DbConnector, SqliteDbConnector
+from label_index import LabelIndex
+from activity_summary import summarize_activity
 from tabulate import tabulate
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
+from itertools import islice
+from datetime import datetime
+import tempfile
+import hashlib
+import io
 import os
+import numpy as np
+
+# One track_point partition per year when partitioned by date_time. Geolife was recorded from 2000 to 2012,
+# earlier and later track points go to the first and last partition
+TRACK_POINT_PARTITION_YEARS = range(2000, 2013)
 
 class Part1:
 
-    def __init__(self):
-        self.connection = DbConnector()
+    def __init__(self, batch_size=50000, load_data_infile=False, label_overlap=False, sqlite_path=None, port=3306):
+        """
+        Args:
+            batch_size (int): number of track points written and committed together during insertion
+            load_data_infile (bool): write track points with LOAD DATA LOCAL INFILE from a staging file,
+                instead of multi-row INSERTs
+            label_overlap (bool): label activities without an exactly matching label
+                with the label overlapping them the most
+            sqlite_path (string): insert into an embedded SQLite database in this file instead of
+                the MySQL server, see SqliteDbConnector
+            port (int): the port of the MySQL server
+        """
+        if sqlite_path:
+            self.connection = SqliteDbConnector(PATH=sqlite_path)
+        else:
+            self.connection = DbConnector(ALLOW_LOCAL_INFILE=load_data_infile, PORT=port)
         self.db_connection = self.connection.db_connection
         self.cursor = self.connection.cursor
+        self.batch_size = batch_size
+        # SQLite has no LOAD DATA, its executemany inserts the rows without a round trip each anyway
+        self.load_data_infile = load_data_infile and not sqlite_path
+        self.label_overlap = label_overlap
+        self.sqlite_path = sqlite_path
+        self.port = port
+        # Activities, their summaries and track points, and manifest entries that are not yet written,
+        # see _flush_pending
+        self.pending_deletes = []
+        self.pending_activities = []
+        self.pending_summaries = []
+        self.pending_track_points = []
+        self.pending_manifest = []
     
     def reset_database(self):
         """
         Resets the database by dropping all tables
         """
+        query = "DROP TABLE IF EXISTS ingest_manifest"
+        self.cursor.execute(query)
+        query = "DROP TABLE IF EXISTS activity_summary"
+        self.cursor.execute(query)
         query = "DROP TABLE IF EXISTS track_point"
         self.cursor.execute(query)
         query = "DROP TABLE IF EXISTS activity"
@@ -59,158 +104,685 @@ class Part1:
         self.cursor.execute(query)
         self.db_connection.commit()
         
-    def create_table_track_point(self):
+    def create_table_activity_summary(self):
         """
-        Creates the track_point table if it does not exist
+        Creates the activity_summary table if it does not exist. It holds facts about the track points
+        of each activity, computed once during insertion, which the analytical tasks read instead of
+        scanning the track_point table
+        """
+        query = """
+                CREATE TABLE IF NOT EXISTS activity_summary (
+                    activity_id INT NOT NULL PRIMARY KEY,
+                    min_lat DOUBLE NOT NULL,
+                    max_lat DOUBLE NOT NULL,
+                    min_lon DOUBLE NOT NULL,
+                    max_lon DOUBLE NOT NULL,
+                    point_count INT NOT NULL,
+                    total_distance DOUBLE NOT NULL,
+                    altitude_gain DOUBLE NOT NULL,
+                    max_time_gap INT NOT NULL,
+                    start_date_time DATETIME NOT NULL,
+                    end_date_time DATETIME NOT NULL,
+                    FOREIGN KEY (activity_id) REFERENCES activity(id) ON DELETE CASCADE
+                );
+                """
+        self.cursor.execute(query)
+        self.db_connection.commit()
+        
+    def create_missing_activity_summaries(self):
+        """
+        Computes the summaries of activities inserted before the activity_summary table existed,
+        as the incremental insertion skips their unchanged files
         """
         query = """
+                SELECT activity.id
+                FROM activity
+                LEFT JOIN activity_summary
+                ON activity.id = activity_summary.activity_id
+                WHERE activity_summary.activity_id IS NULL
+                """
+        self.cursor.execute(query)
+        activity_ids = [row[0] for row in self.cursor.fetchall()]
+        print(f"Summarizing {len(activity_ids)} activities without a summary")
+        
+        track_points_query = """
+                SELECT lat, lon, altitude, date_time
+                FROM track_point
+                WHERE activity_id = %s
+                ORDER BY seq
+                """
+        for activity_id in activity_ids:
+            self.cursor.execute(track_points_query, (activity_id,))
+            track_points = self.cursor.fetchall()
+            if track_points:
+                self.pending_summaries.append(self._summarize_track_points(activity_id, track_points))
+            if len(self.pending_summaries) >= self.batch_size:
+                self._flush_pending()
+        self._flush_pending()
+        
+    def create_table_track_point(self, indexes=True, partitioning=None, partitions=16):
+        """
+        Creates the track_point table if it does not exist
+
+        Args:
+            indexes (bool): create the indexes and foreign key now. When bulk loading,
+                pass False and call create_track_point_indexes after the load instead
+            partitioning (string): partition the table by "date_time", one partition per year, or by a hash
+                of "activity_id". Queries with a constant range of date_time, like Part2.task10 with a year,
+                then only read the partitions of those years, and queries listing the activity ids, like the
+                track point cache, only the partitions of those activities. Queries reading every track point,
+                like task8, task9 and task11, read every partition. Partitions can be dropped with
+                drop_track_point_partitions. MySQL does not allow foreign keys on a partitioned table,
+                so the table has none
+            partitions (int): number of partitions when partitioned by activity_id
+        """
+        if partitioning and self.sqlite_path:
+            raise ValueError("SQLite does not support partitioned tables")
+        
+        foreign_key = """,
+                    INDEX track_point_activity_seq (activity_id, seq),
+                    INDEX track_point_activity_date_time (activity_id, date_time)""" if indexes else ""
+        if indexes and not partitioning:
+            foreign_key += """,
+                    FOREIGN KEY (activity_id) REFERENCES activity(id) ON DELETE CASCADE"""
+        # Every unique key of a partitioned table has to include the partitioning column
+        primary_key = f""",
+                    PRIMARY KEY (id, {partitioning})""" if partitioning else " PRIMARY KEY"
+        # seq is the position of the track point within its activity, so that the track points
+        # of an activity can be read in recorded order from the (activity_id, seq) index
+        query = f"""
                 CREATE TABLE IF NOT EXISTS track_point (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
+                    id INT AUTO_INCREMENT{"" if partitioning else primary_key},
                     activity_id INT NOT NULL,
+                    seq INT NOT NULL,
                     lat DOUBLE NOT NULL,
                     lon DOUBLE NOT NULL,
                     altitude INT NOT NULL,
                     date_days DOUBLE NOT NULL,
-                    date_time DATETIME NOT NULL,
-                    FOREIGN KEY (activity_id) REFERENCES activity(id) ON DELETE CASCADE
-                );
+                    date_time DATETIME NOT NULL{primary_key if partitioning else ""}{foreign_key}
+                ){self._track_point_partitions(partitioning, partitions)};
                 """
         self.cursor.execute(query)
         self.db_connection.commit()
         
+    def _track_point_partitions(self, partitioning, partitions):
+        """
+        Returns:
+            string: the PARTITION BY clause of the track_point table
+        """
+        if partitioning == "date_time":
+            # RANGE COLUMNS compares date_time itself, so a condition on date_time prunes the partitions
+            # without wrapping it in a function
+            years = ",".join(f"""
+                    PARTITION p{year} VALUES LESS THAN ('{year + 1}-01-01')"""
+                             for year in TRACK_POINT_PARTITION_YEARS)
+            return f"""
+                PARTITION BY RANGE COLUMNS (date_time) ({years},
+                    PARTITION pmax VALUES LESS THAN (MAXVALUE)
+                )"""
+        if partitioning == "activity_id":
+            # The partitions are named p0, p1, ...
+            return f"""
+                PARTITION BY HASH (activity_id)
+                PARTITIONS {partitions}"""
+        if partitioning:
+            raise ValueError(f"Unknown partitioning {partitioning}, expected date_time or activity_id")
+        return ""
+        
+    def drop_track_point_partitions(self, partition_names):
+        """
+        Empties partitions of a partitioned track_point table, which is a lot faster than deleting their rows.
+        The trajectory files of the activities with track points in them are marked as changed in the ingest
+        manifest first, so that the next insert_gps_data deletes what is left of the activities and
+        inserts the files again
+
+        Args:
+            partition_names (list[string]): the partitions, like p2008 or p3
+        """
+        partition_list = ", ".join(partition_names)
+        query = f"""
+                UPDATE ingest_manifest
+                SET size = -1, content_hash = ''
+                WHERE activity_id IN (
+                    SELECT DISTINCT activity_id
+                    FROM track_point PARTITION ({partition_list})
+                )
+                """
+        self.cursor.execute(query)
+        print(f"Marked {self.cursor.rowcount} trajectory files for reloading")
+        self.db_connection.commit()
+        # Committed implicitly, like all DDL
+        self.cursor.execute(f"ALTER TABLE track_point TRUNCATE PARTITION {partition_list}")
         
-    def insert_gps_data(self):
+    def create_track_point_indexes(self):
         """
-        Inserts the GPS data into the database
+        Creates the indexes and foreign key of the track_point table after a bulk load,
+        which is a lot faster than maintaining them for every inserted row. Does nothing if they exist
         """
-        user_ids = os.listdir("./dataset/Data")
+        if self._track_point_has_index("track_point_activity_seq"):
+            return
+        
+        # A partitioned table cannot have a foreign key
+        foreign_key = "" if self._track_point_is_partitioned() else """,
+                ADD FOREIGN KEY (activity_id) REFERENCES activity(id) ON DELETE CASCADE"""
+        # The loaded rows reference existing activities, so the foreign key does not need
+        # to be validated row by row
+        self.cursor.execute("SET foreign_key_checks = 0")
+        query = f"""
+                ALTER TABLE track_point
+                ADD INDEX track_point_activity_seq (activity_id, seq),
+                ADD INDEX track_point_activity_date_time (activity_id, date_time){foreign_key}
+                """
+        self.cursor.execute(query)
+        self.cursor.execute("SET foreign_key_checks = 1")
+        self.db_connection.commit()
+        
+    def migrate_track_point_seq(self):
+        """
+        Upgrades a track_point table created before the seq column existed. The column is numbered
+        in insertion order within each activity, and the activity_id index is replaced by the
+        composite indexes. Does nothing if the column exists
+        """
+        query = """
+                SELECT COUNT(*)
+                FROM information_schema.columns
+                WHERE table_schema = DATABASE()
+                AND table_name = 'track_point'
+                AND column_name = 'seq'
+                """
+        self.cursor.execute(query)
+        if self.cursor.fetchone()[0]:
+            return
+        # Checked before the column is added, as the numbering below is an UPDATE ... JOIN, which SQLite does
+        # not support. A table without numbered track points would otherwise look upgraded on the next run
+        if self.sqlite_path:
+            raise ValueError("SQLite track_point tables have the seq column from the start and cannot be upgraded")
+        
+        print("Adding the seq column to track_point")
+        self.cursor.execute("ALTER TABLE track_point ADD COLUMN seq INT NOT NULL DEFAULT 0 AFTER activity_id")
+        # The ids were assigned in insertion order, which is the recorded order within an activity
+        query = """
+                UPDATE track_point
+                INNER JOIN (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY activity_id ORDER BY id) - 1 AS seq
+                    FROM track_point
+                ) AS numbered
+                ON track_point.id = numbered.id
+                SET track_point.seq = numbered.seq
+                """
+        self.cursor.execute(query)
+        self.db_connection.commit()
+        
+        # A table loaded without indexes gets them from create_track_point_indexes instead
+        if self._track_point_has_index("track_point_activity_id"):
+            # The foreign key is kept, as the new indexes start with activity_id as well
+            query = """
+                    ALTER TABLE track_point
+                    ADD INDEX track_point_activity_seq (activity_id, seq),
+                    ADD INDEX track_point_activity_date_time (activity_id, date_time),
+                    DROP INDEX track_point_activity_id
+                    """
+            self.cursor.execute(query)
+            self.db_connection.commit()
+        
+    def _track_point_has_index(self, index_name):
+        """
+        Args:
+            index_name (string): the name of the index
+
+        Returns:
+            bool: true if the track_point table has the index, else false
+        """
+        query = """
+                SELECT COUNT(*)
+                FROM information_schema.statistics
+                WHERE table_schema = DATABASE()
+                AND table_name = 'track_point'
+                AND index_name = %s
+                """
+        self.cursor.execute(query, (index_name,))
+        return self.cursor.fetchone()[0] > 0
+        
+    def _track_point_is_partitioned(self):
+        """
+        Returns:
+            bool: true if the track_point table is partitioned, else false
+        """
+        query = """
+                SELECT COUNT(*)
+                FROM information_schema.partitions
+                WHERE table_schema = DATABASE()
+                AND table_name = 'track_point'
+                AND partition_name IS NOT NULL
+                """
+        self.cursor.execute(query)
+        return self.cursor.fetchone()[0] > 0
+        
+    def create_table_ingest_manifest(self):
+        """
+        Creates the ingest_manifest table if it does not exist. It records every trajectory file
+        that has been inserted, and the activity it was inserted as (NULL if the file was skipped)
+        """
+        query = """
+                CREATE TABLE IF NOT EXISTS ingest_manifest (
+                    path VARCHAR(255) NOT NULL PRIMARY KEY,
+                    user_id VARCHAR(50) NOT NULL,
+                    size BIGINT NOT NULL,
+                    mtime_ns BIGINT NOT NULL,
+                    content_hash CHAR(64) NOT NULL,
+                    activity_id INT
+                );
+                """
+        self.cursor.execute(query)
+        self.db_connection.commit()
+        
+    def insert_gps_data(self, workers=1, user_ids=None, activity_id_step=1, activity_id_offset=0):
+        """
+        Inserts the GPS data into the database. Trajectory files in the ingest manifest with the same
+        size and modification time are skipped, so a rerun only inserts files that are new, changed
+        or were not committed because the previous run was interrupted
+
+        Args:
+            workers (int): number of processes that parse and insert users in parallel,
+                each over its own connection. 1 inserts everything on this connection.
+            user_ids (list[string]): only insert these users, by default all users of the dataset
+            activity_id_step (int): only assign every activity_id_step-th activity id, those with
+                activity_id_offset as remainder when id - 1 is divided by the step. Databases inserted
+                into with the same step and different offsets then never use the same activity id
+            activity_id_offset (int): see activity_id_step
+        """
+        users = self._insert_users(user_ids)
+        tasks = list(self._trajectory_tasks(users, activity_id_step, activity_id_offset))
+        
+        print(f"Inserting {sum(len(task[2]) for task in tasks)} new or changed trajectory files")
+        
+        if workers > 1:
+            with Pool(workers, initializer=_init_worker, initargs=(self._options(),)) as pool:
+                # One user per task, as the number of trajectories per user varies a lot
+                for user_id in pool.imap(_insert_user_worker, tasks):
+                    print(f"Processed user {user_id}")
+                pool.close()
+                pool.join()
+        else:
+            for task in tasks:
+                print(f"Processing user {task[0]}")
+                self._insert_user_trajectories(*task)
+
+    def _insert_users(self, user_ids=None):
+        """Inserts the users, so that the activities inserted later can reference them
+
+        Args:
+            user_ids (list[string]): the users, by default all users of the dataset
+
+        Returns:
+            list[dict]: id and has_labels of the users, sorted by id
+        """
+        # Sorted so that users and activities are always inserted in the same order
+        user_ids = sorted(user_ids if user_ids is not None else os.listdir("./dataset/Data"))
         
         with open("./dataset/labeled_ids.txt", "r") as f:
-            user_labels = f.read().splitlines()
+            user_labels = set(f.read().splitlines())
             
         insert_user_query = """
         INSERT INTO user
         (id, has_labels)
         VALUES (%(id)s, %(has_labels)s)
+        ON DUPLICATE KEY UPDATE has_labels = VALUES(has_labels)
         """
         
-        insert_activity_query = """
-        INSERT INTO activity
-        (user_id, transportation_mode, start_date_time, end_date_time)
-        VALUES (%(user_id)s, %(transportation_mode)s, %(start_date_time)s, %(end_date_time)s)
-        """
+        users = [{"id": user_id, "has_labels": 1 if user_id in user_labels else 0} for user_id in user_ids]
         
-        insert_track_point_query = """
-        INSERT INTO track_point
-        (activity_id, lat, lon, altitude, date_days, date_time)
-        VALUES (%(activity_id)s, %(lat)s, %(lon)s, %(altitude)s, %(date_days)s, %(date_time)s)
+        # Users are inserted up front, so that the workers only have to insert activities
+        # and track points referencing them
+        self.cursor.executemany(insert_user_query, users)
+        self.db_connection.commit()
+        return users
+
+    def _trajectory_tasks(self, users, activity_id_step=1, activity_id_offset=0):
+        """Finds the trajectory files of each user that are not inserted yet, see insert_gps_data
+
+        Args:
+            users (list[dict]): the users, see _insert_users
+            activity_id_step (int): see insert_gps_data
+            activity_id_offset (int): see insert_gps_data
+
+        Yields:
+            tuple: user id, has_labels and the trajectory files of a user with any files to insert,
+            see _insert_user_trajectories
         """
-    
-        for user_id in user_ids:
-            print(f"Processing user {user_id}")
-            user_root = f"./dataset/Data/{user_id}"
-            has_label = 1 if user_id in user_labels else 0
+        manifest = self._fetch_manifest()
+        
+        # Activity ids are assigned here instead of by AUTO_INCREMENT, one per trajectory file in sorted order.
+        # Then no insert has to wait for lastrowid, and the ids do not depend on the number of workers.
+        # Files that turn out to be too long leave a gap in the ids
+        self.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM activity")
+        next_activity_id = self.cursor.fetchone()[0] + 1
+        next_activity_id += (activity_id_offset - (next_activity_id - 1)) % activity_id_step
+        for user in users:
+            trajectory_files = []
+            for file in sorted(os.listdir(f"./dataset/Data/{user['id']}/Trajectory")):
+                stat = os.stat(f"./dataset/Data/{user['id']}/Trajectory/{file}")
+                previous = manifest.get(f"Data/{user['id']}/Trajectory/{file}")
+                # Unchanged since it was inserted
+                if previous and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                trajectory_files.append((next_activity_id, file, stat.st_size, stat.st_mtime_ns, previous))
+                next_activity_id += activity_id_step
             
-            self.cursor.execute(insert_user_query, {"id": user_id, "has_labels": has_label})
-
-            for file in os.listdir(f"{user_root}/Trajectory"):
-                file_path = f"{user_root}/Trajectory/{file}"
-                
-                # Get trackpoints if length is sufficiently short
-                track_points = self._process_trajectory_file(file_path)
-                
-                if track_points:
-                    start_date_time = f"{track_points[0][5]} {track_points[0][6]}"
-                    end_date_time = f"{track_points[-1][5]} {track_points[-1][6]}"
-                    
-                    if has_label:
-                        labels_file_path = f"{user_root}/labels.txt"
-                        labels = self._process_labels_file(labels_file_path)
-                        
-                        transportation_mode = self._get_transportation_mode(start_date_time, end_date_time, labels)
-                    else:
-                        transportation_mode = None
-                    
-                    self.cursor.execute(insert_activity_query, 
-                                        {"user_id": user_id,
-                                         "transportation_mode": transportation_mode,
-                                         "start_date_time": start_date_time,
-                                         "end_date_time": end_date_time})
-                    
-                    activity_id = self.cursor.lastrowid
-                    
-                    # Convert track points to structured list of dictionaries
-                    track_points_structured = [{"activity_id": activity_id,
-                                                "lat": track_point[0],
-                                                "lon": track_point[1],
-                                                "altitude": track_point[3],
-                                                "date_days": track_point[4],
-                                                "date_time": f"{track_point[5]} {track_point[6]}"}
-                                                for track_point in track_points]
-                    
-                    self.cursor.executemany(insert_track_point_query, track_points_structured)  
-                    self.db_connection.commit()
-
-    def _get_transportation_mode(self, start_date_time, end_date_time, labels):
-        """Fetches the transportation mode for an activity if it exists
+            if trajectory_files:
+                yield user["id"], user["has_labels"], trajectory_files
 
-        Args:
-            start_date_time (string): The start date time of the activity
-            labels (list[string]): Raw labels from the labels.txt file
+    def _options(self):
+        """
+        Returns:
+            dict: the constructor arguments of this instance, used to set up worker processes the same way
+        """
+        return {"batch_size": self.batch_size,
+                "load_data_infile": self.load_data_infile,
+                "label_overlap": self.label_overlap,
+                "sqlite_path": self.sqlite_path,
+                "port": self.port}
+
+    def _fetch_manifest(self):
+        """Fetches the ingest manifest
 
         Returns:
-            string: transportation mode if it exists, else None
-        """
-        for label in labels:
-            # Replace / with - in date
-            label_start_date_time = f"{label[0].replace('/', '-')} {label[1].replace('/', ':')}"
-            label_end_date_time = f"{label[2].replace('/', '-')} {label[3].replace('/', ':')}"            
-            # If the start date time of the label matches the start date time of the activity
-            # then we have found a labeled transportation mode for this activity
-            if label_start_date_time == start_date_time and label_end_date_time == end_date_time:
-                transportation_mode = label[4]
-                return transportation_mode
+            dict[string, tuple]: size, mtime_ns, content_hash and activity_id of each inserted file
+        """
+        self.cursor.execute("SELECT path, size, mtime_ns, content_hash, activity_id FROM ingest_manifest")
+        return {row[0]: row[1:] for row in self.cursor.fetchall()}
+
+    def _insert_user_trajectories(self, user_id, has_label, trajectory_files):
+        """Inserts the activities and track points of the trajectories of a user
+
+        Args:
+            user_id (string): the user id
+            has_label (int): 1 if the user has labeled activities, else 0
+            trajectory_files (list[tuple]): activity id assigned to the file, file name, size, mtime_ns
+                and the manifest entry of the file if it was inserted before, else None
+        """
+        labels = self._load_labels(user_id, has_label)
+
+        for trajectory_file in trajectory_files:
+            activity_id, file, _, _, previous = trajectory_file
+            trajectory = Part1._read_trajectory(f"./dataset/Data/{user_id}/Trajectory/{file}", activity_id,
+                                                previous[2] if previous else None)
+            self._add_trajectory(user_id, self._transportation_mode(labels, trajectory[1]), trajectory_file, trajectory)
             
-        return None
-                
-    def _process_trajectory_file(self, file_path):
-        """Processes the plt file and returns the track points if the file is valid
+            if self._batch_full():
+                self._flush_pending()
+        
+        # Everything of a user is committed before the user is reported as done
+        self._flush_pending()
+
+    def _load_labels(self, user_id, has_label):
+        """
+        Returns:
+            LabelIndex: the labels of the user, parsed once and looked up by the start and end
+            of each activity, or None if the user has no labels
+        """
+        return LabelIndex.from_file(f"./dataset/Data/{user_id}/labels.txt") if has_label else None
+
+    @staticmethod
+    def _read_trajectory(file_path, activity_id, previous_hash=None):
+        """Reads a trajectory file. Uses no connection, so that files can be read in other processes
 
         Args:
             file_path (string): path to the plt file
+            activity_id (int): the activity id assigned to the file
+            previous_hash (string): content hash of the file when it was inserted before, else None
 
         Returns:
-            list[string]: the track points if the file is valid, else None
+            tuple: the content hash, and the track points and activity_summary row if the file has
+            changed and is valid, else None and None
         """
-        with open(file_path, "r") as f:
-            # We only want to read .plt files that contain at most 2506 lines (2500 + 6 header lines)
-            num_lines = sum(1 for _ in f)
-            if num_lines > 2506:
-                print(f"File {file_path} has more than 2500 track points: skipping! {num_lines}")
-                return None
+        # The file is read once, and the same content is hashed and parsed
+        with open(file_path, "rb") as f:
+            content = f.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash == previous_hash:
+            return content_hash, None, None
+        
+        # Get trackpoints if length is sufficiently short
+        track_points = Part1._process_trajectory_file(file_path, content)
+        if not track_points:
+            return content_hash, None, None
+        
+        summary = Part1._summarize_track_points(
+            activity_id, [(lat, lon, altitude, date_time) for lat, lon, altitude, _, date_time in track_points])
+        return content_hash, track_points, summary
+
+    def _transportation_mode(self, labels, track_points):
+        """
+        Args:
+            labels (LabelIndex): the labels of the user, see _load_labels
+            track_points (list[tuple]): the track points of a read trajectory file, see _read_trajectory
+
+        Returns:
+            string: the transportation mode of the label matching the activity, or None
+        """
+        if not labels or not track_points:
+            return None
+        return labels.get_transportation_mode(track_points[0][4], track_points[-1][4], overlap=self.label_overlap)
+
+    def _add_trajectory(self, user_id, transportation_mode, trajectory_file, trajectory):
+        """Adds the rows of a read trajectory file to the pending writes
+
+        Args:
+            user_id (string): the user id
+            transportation_mode (string): the label of the activity, see _transportation_mode
+            trajectory_file (tuple): the file, see _insert_user_trajectories
+            trajectory (tuple): the read file, see _read_trajectory
+        """
+        activity_id, file, size, mtime_ns, previous = trajectory_file
+        content_hash, track_points, summary = trajectory
+        path = f"Data/{user_id}/Trajectory/{file}"
+        
+        if previous:
+            _, _, previous_hash, previous_activity_id = previous
+            if content_hash == previous_hash:
+                # Only touched, so the inserted activity is still up to date
+                self.pending_manifest.append((path, user_id, size, mtime_ns, content_hash, previous_activity_id))
+                return
+            if previous_activity_id is not None:
+                # Replaced by the new version of the file, in the same transaction
+                self.pending_deletes.append(previous_activity_id)
+        
+        if track_points:
+            start_date_time = track_points[0][4]
+            end_date_time = track_points[-1][4]
+            self.pending_activities.append((activity_id, user_id, transportation_mode, start_date_time, end_date_time))
+            self.pending_summaries.append(summary)
+            # The typed track points can be written as is, only prefixed by the activity id
+            # and their position in the activity
+            self.pending_track_points.extend((activity_id, seq, *track_point)
+                                             for seq, track_point in enumerate(track_points))
+        else:
+            activity_id = None
+        
+        # Recorded even if the file is skipped, so that it is not read again
+        self.pending_manifest.append((path, user_id, size, mtime_ns, content_hash, activity_id))
+
+    def _batch_full(self):
+        """
+        Returns:
+            bool: True if enough track points are pending to be written together
+        """
+        return len(self.pending_track_points) >= self.batch_size
+
+    def _take_pending(self):
+        """Takes the pending writes, so that they can be written by another instance with _write_pending
+
+        Returns:
+            dict: the pending writes
+        """
+        pending = {"deletes": self.pending_deletes,
+                   "activities": self.pending_activities,
+                   "summaries": self.pending_summaries,
+                   "track_points": self.pending_track_points,
+                   "manifest": self.pending_manifest}
+        self.pending_deletes = []
+        self.pending_activities = []
+        self.pending_summaries = []
+        self.pending_track_points = []
+        self.pending_manifest = []
+        return pending
+
+    def _write_pending(self, pending):
+        """Writes and commits pending writes taken from another instance with _take_pending
+        """
+        self.pending_deletes = pending["deletes"]
+        self.pending_activities = pending["activities"]
+        self.pending_summaries = pending["summaries"]
+        self.pending_track_points = pending["track_points"]
+        self.pending_manifest = pending["manifest"]
+        self._flush_pending()
+
+    @staticmethod
+    def _summarize_track_points(activity_id, track_points):
+        """
+        Args:
+            activity_id (int): the activity id
+            track_points (list[tuple]): lat, lon, altitude and date_time of the track points, in recorded order
+
+        Returns:
+            tuple: the activity_summary row of the activity
+        """
+        lats, lons, altitudes, date_times = zip(*track_points)
+        summary = summarize_activity(lats, lons, altitudes, np.array(date_times, dtype="datetime64[s]"))
+        return (activity_id, summary["min_lat"], summary["max_lat"], summary["min_lon"], summary["max_lon"],
+                summary["point_count"], summary["total_distance"], summary["altitude_gain"],
+                summary["max_time_gap"], summary["start_date_time"], summary["end_date_time"])
+
+    def _delete_activity(self, activity_id):
+        """Deletes an activity, its summary and its track points, without committing
+        """
+        self.cursor.execute("DELETE FROM activity_summary WHERE activity_id = %s", (activity_id,))
+        self.cursor.execute("DELETE FROM track_point WHERE activity_id = %s", (activity_id,))
+        self.cursor.execute("DELETE FROM activity WHERE id = %s", (activity_id,))
+
+    def _flush_pending(self):
+        """Writes the pending activities, their summaries and track points and the manifest entries of their files,
+        and commits them together. An interrupted run therefore never leaves a file half inserted
+        """
+        # The replaced activities go first, in the same transaction as the activities replacing them
+        for activity_id in self.pending_deletes:
+            self._delete_activity(activity_id)
+        self.pending_deletes = []
+            
+        if self.pending_activities:
+            insert_activity_query = """
+            INSERT INTO activity
+            (id, user_id, transportation_mode, start_date_time, end_date_time)
+            VALUES (%s, %s, %s, %s, %s)
+            """
+            # The activities go first, as the track points reference them
+            self.cursor.executemany(insert_activity_query, self.pending_activities)
+            self.pending_activities = []
+            
+        if self.pending_summaries:
+            insert_summary_query = """
+            INSERT INTO activity_summary
+            (activity_id, min_lat, max_lat, min_lon, max_lon, point_count, total_distance, altitude_gain,
+             max_time_gap, start_date_time, end_date_time)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """
+            self.cursor.executemany(insert_summary_query, self.pending_summaries)
+            self.pending_summaries = []
+            
+        if self.pending_track_points:
+            if self.load_data_infile:
+                self._load_track_points_infile(self.pending_track_points)
             else:
-                f.seek(0)
-                # Skip first 6 header lines
-                track_points_lines = f.read().splitlines()[6:]
-                track_points = [line.strip().split(",") for line in track_points_lines]
-                
-                return track_points
+                insert_track_point_query = """
+                INSERT INTO track_point
+                (activity_id, seq, lat, lon, altitude, date_days, date_time)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """
+                # executemany sends this as a single multi-row INSERT
+                self.cursor.executemany(insert_track_point_query, self.pending_track_points)
+            self.pending_track_points = []
+            
+        if self.pending_manifest:
+            insert_manifest_query = """
+            INSERT INTO ingest_manifest
+            (path, user_id, size, mtime_ns, content_hash, activity_id)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE size = VALUES(size), mtime_ns = VALUES(mtime_ns),
+            content_hash = VALUES(content_hash), activity_id = VALUES(activity_id)
+            """
+            self.cursor.executemany(insert_manifest_query, self.pending_manifest)
+            self.pending_manifest = []
             
-    def _process_labels_file(self, file_path):
-        """Processes the labels.txt file and returns the labels
+        self.db_connection.commit()
+
+    def _load_track_points_infile(self, track_points):
+        """Writes the track points to a staging TSV file and loads it with LOAD DATA LOCAL INFILE
+
+        Args:
+            track_points (list[tuple]): activity_id, seq, lat, lon, altitude, date_days and date_time
+        """
+        with tempfile.NamedTemporaryFile("w", suffix=".tsv", delete=False) as f:
+            for activity_id, seq, lat, lon, altitude, date_days, date_time in track_points:
+                # repr keeps the full precision of the floats
+                f.write(f"{activity_id}\t{seq}\t{lat!r}\t{lon!r}\t{altitude}\t{date_days!r}\t{date_time}\n")
+            staging_file_path = f.name
+        
+        query = """
+        LOAD DATA LOCAL INFILE %s
+        INTO TABLE track_point
+        FIELDS TERMINATED BY '\\t'
+        LINES TERMINATED BY '\\n'
+        (activity_id, seq, lat, lon, altitude, date_days, date_time)
+        """
+        try:
+            self.cursor.execute(query, (staging_file_path,))
+        finally:
+            os.remove(staging_file_path)
+
+    @staticmethod
+    def _process_trajectory_file(file_path, content, max_track_points=2500):
+        """Processes the plt file and returns the track points if the file is valid.
+        Parsing stops as soon as the file has too many track points
 
         Args:
-            file_path (string): the path to the labels.txt file
+            file_path (string): path to the plt file, for the message if it is skipped
+            content (bytes): the content of the plt file
+            max_track_points (int): the maximum number of track points of a valid file
 
         Returns:
-            list[string]: the raw labels
+            list[tuple]: the typed track points if the file is valid, else None
         """
-        with open(file_path, "r") as f:
-            labels_lines = f.read().splitlines()[1:]
-            labels = [line.split() for line in labels_lines]
+        with io.StringIO(content.decode(), newline=None) as f:
+            # Read at most one track point more than allowed, which is enough to tell if the file is too long
+            track_points = list(islice(Part1._iter_track_points(f), max_track_points + 1))
+            if len(track_points) > max_track_points:
+                print(f"File {file_path} has more than {max_track_points} track points: skipping!")
+                return None
+            
+            return track_points
+
+    @staticmethod
+    def _iter_track_points(f):
+        """Lazily parses the track points of an open plt file
+
+        Args:
+            f (file): the opened plt file
+
+        Yields:
+            tuple: lat (float), lon (float), altitude (int), date_days (float) and date_time (datetime)
+        """
+        # Skip first 6 header lines
+        for _ in range(6):
+            f.readline()
+            
+        for line in f:
+            lat, lon, _, altitude, date_days, date, time = line.strip().split(",")
+            # Altitude should in principle be int according to specification, but
+            # is sometimes float, so convert float to int
+            yield (float(lat), float(lon), int(float(altitude)), float(date_days),
+                   datetime.fromisoformat(f"{date} {time}"))
             
-            return labels
-        
     def show_top_10_tables(self):
         user_query = """
         SELECT * FROM user
@@ -236,22 +808,55 @@ class Part1:
         rows = self.cursor.fetchall()
         print("Track point table:")
         print(tabulate(rows, headers=self.cursor.column_names))
+
+
+# Part1 instance owned by a worker process during parallel ingestion
+_worker_program = None
+
+
+def _init_worker(options):
+    """Opens a separate database connection for the current worker process
+    """
+    global _worker_program
+    _worker_program = Part1(**options)
+    # Close the connection when the worker exits after pool.close()
+    Finalize(_worker_program, _worker_program.connection.close_connection, exitpriority=10)
+
+
+def _insert_user_worker(task):
+    _worker_program._insert_user_trajectories(*task)
+    return task[0]
         
                                 
 def main():
     program = None
     create = True
+    # Only insert new or changed trajectory files instead of reloading everything
+    incremental = False
+    workers = os.cpu_count()
+    # Insert into an embedded SQLite database in this file instead of the MySQL server
+    sqlite_path = None
+    # Partition the track points by "date_time" or "activity_id", see create_table_track_point
+    partitioning = None
     try:
-        program = Part1()
+        program = Part1(sqlite_path=sqlite_path)
         
         if create:
-            program.reset_database()
+            if not incremental:
+                program.reset_database()
             program.create_table_user()
             program.create_table_activity()
-            program.create_table_track_point()
+            program.create_table_activity_summary()
+            # The track_point index is created after the load, which is a lot faster
+            program.create_table_track_point(indexes=False, partitioning=partitioning)
+            program.create_table_ingest_manifest()
+            # Databases created before the seq column existed are upgraded in place
+            program.migrate_track_point_seq()
             # Check that the table is dropped
             program.show_tables()
-            program.insert_gps_data()
+            program.insert_gps_data(workers=workers)
+            program.create_track_point_indexes()
+            program.create_missing_activity_summaries()
         else:
             program.show_top_10_tables()
     except Exception as e:
@@ -1,46 +1,75 @@
-from DbConnector import DbConnector
+from DbConnector import DbConnector, SqliteDbConnector
+from proximity import ProximityGrid
+from track_point_cache import TrackPointCache
 from tabulate import tabulate
-from haversine import haversine, Unit, haversine_vector
+from haversine import Unit, haversine_vector
 import numpy as np
+import threading
+import queue
 import time
 
 class Part2:
 
-    def __init__(self):
-        self.connection = DbConnector()
+    def __init__(self, connection=None):
+        """
+        Args:
+            connection (DbConnector): the connection to use, by default a new one
+        """
+        self.connection = connection or DbConnector()
         self.db_connection = self.connection.db_connection
         self.cursor = self.connection.cursor
+        # Shared by the comparisons of the pairwise task8, which read the same activities many times
+        self.track_point_cache = TrackPointCache(self.cursor)
         
     def task1(self):
+        rows, headers = self._task1_rows()
+        print("Task 1: Number of users, activities and trackpoints in the database:")
+        print(tabulate(rows, headers=headers))
+        
+    def _task1_rows(self):
         query = """
         SELECT (SELECT COUNT(*) FROM user) AS user_count,
                (SELECT COUNT(*) FROM activity) AS activity_count,
                (SELECT COUNT(*) FROM track_point) AS trackpoint_count;
         """
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
-        print("Task 1: Number of users, activities and trackpoints in the database:")
-        print(tabulate(rows, headers=self.cursor.column_names))
+        return self._fetch_rows(query)
         
     def task2(self):
+        user_count, trackpoint_count, minimum_count, maximum_count = self._task2_partials()
+        average_count = trackpoint_count / user_count if user_count else None
+        print("Task 2: Average, minimum and maximum number of trackpoints logged by the users:")
+        print(tabulate([(average_count, minimum_count, maximum_count)],
+                       headers=("average_count", "minimum_count", "maximum_count")))
+        
+    def _task2_partials(self):
+        """
+        Returns:
+            tuple: the number of users with trackpoints, their total number of trackpoints, and the minimum
+            and maximum number of trackpoints of a user. Unlike an average, these can be combined across shards
+        """
+        # The number of trackpoints of each activity is kept in activity_summary
         query = """
-        SELECT AVG(user_counts.trackpoint_count) AS average_count,
+        SELECT COUNT(*) AS user_count,
+               SUM(user_counts.trackpoint_count) AS trackpoint_count,
 	           MIN(user_counts.trackpoint_count) AS minimum_count, 
 	           MAX(user_counts.trackpoint_count) AS maximum_count
         FROM (
-            SELECT COUNT(*) AS trackpoint_count
+            SELECT SUM(point_count) AS trackpoint_count
             FROM activity
-            INNER JOIN track_point 
-            ON activity.id = track_point.activity_id
+            INNER JOIN activity_summary
+            ON activity.id = activity_summary.activity_id
             GROUP BY user_id
         ) AS user_counts;
         """
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
-        print("Task 2: Average, minimum and maximum number of trackpoints logged by the users:")
-        print(tabulate(rows, headers=self.cursor.column_names))
+        rows, _ = self._fetch_rows(query)
+        return rows[0]
     
     def task3(self):
+        rows, headers = self._task3_rows()
+        print("Task 3: Top 15 users with the most activities logged:")
+        print(tabulate(rows, headers=headers))
+        
+    def _task3_rows(self):
         query = """
         SELECT user_id, COUNT(*) as activity_count
         FROM activity
@@ -48,23 +77,27 @@ class Part2:
         ORDER BY activity_count DESC
         LIMIT 15;
         """
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
-        print("Task 3: Top 15 users with the most activities logged:")
-        print(tabulate(rows, headers=self.cursor.column_names))
+        return self._fetch_rows(query)
         
     def task4(self):
+        rows, headers = self._task4_rows()
+        print("Task 4: Users that have logged taking the bus:")
+        print(tabulate(rows, headers=headers))
+        
+    def _task4_rows(self):
         query = """
         SELECT DISTINCT user_id
         FROM activity
         WHERE activity.transportation_mode = 'bus';
         """
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
-        print("Task 4: Users that have logged taking the bus:")
-        print(tabulate(rows, headers=self.cursor.column_names))
+        return self._fetch_rows(query)
         
     def task5(self):
+        rows, headers = self._task5_rows()
+        print("Task 5: Top 10 users with most types of different transportation modes:")
+        print(tabulate(rows, headers=headers))
+        
+    def _task5_rows(self):
         query = """
         SELECT user_id, COUNT(DISTINCT transportation_mode) as transportation_count
         FROM activity
@@ -72,12 +105,14 @@ class Part2:
         ORDER BY transportation_count DESC
         LIMIT 10;
         """
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
-        print("Task 5: Top 10 users with most types of different transportation modes:")
-        print(tabulate(rows, headers=self.cursor.column_names))
+        return self._fetch_rows(query)
     
     def task6(self):
+        rows, headers = self._task6_rows()
+        print("Task 6: Activities that are logged twice:")
+        print(tabulate(rows, headers=headers))
+        
+    def _task6_rows(self):
         # Assumes that an activity is logged twice if it has the same user_id, transportation_mode,
         # start_date_time and end_date_time
         query = """
@@ -86,34 +121,213 @@ class Part2:
         GROUP BY user_id, transportation_mode, start_date_time, end_date_time
         HAVING COUNT(*) > 1;
         """
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
-        print("Task 6: Activities that are logged twice:")
-        print(tabulate(rows, headers=self.cursor.column_names))
+        return self._fetch_rows(query)
         
     def task7a(self):
+        rows, headers = self._task7a_rows()
+        print("Task 7a: Number of users with activities that end the next day:")
+        print(tabulate(rows, headers=headers))
+        
+    def _task7a_rows(self):
         query = """
         SELECT COUNT(DISTINCT user_id)
         FROM activity
         WHERE DATEDIFF(end_date_time, start_date_time) = 1;
         """
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
-        print("Task 7a: Number of users with activities that end the next day:")
-        print(tabulate(rows, headers=self.cursor.column_names))
+        return self._fetch_rows(query)
         
     def task7b(self):
+        rows, headers = self._task7b_rows()
+        print("Task 7b: Activities that end the next day:")
+        print(tabulate(rows, headers=headers))
+        
+    def _task7b_rows(self):
         query = """
         SELECT id, user_id, transportation_mode, TIMEDIFF(end_date_time, start_date_time) AS duration
         FROM activity
         WHERE DATEDIFF(end_date_time, start_date_time) = 1;
         """
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
-        print("Task 7b: Activities that end the next day:")
-        print(tabulate(rows, headers=self.cursor.column_names))
+        return self._fetch_rows(query)
         
-    def task8(self):
+    def task8(self, distance=50, time_window=30, use_grid=True):
+        """Finds the number of users that have been close to each other in time and space
+
+        Args:
+            distance (float): maximum distance between two close track points, in meters
+            time_window (int): maximum time difference between two close track points, in seconds
+            use_grid (bool): compare all track points at once in a spatio-temporal grid, instead of
+                comparing the activities of each pair of users with separate queries
+        """
+        if use_grid:
+            close_users_set = self._close_users_grid(distance, time_window)
+        else:
+            close_users_set = self._close_users_pairwise(distance, time_window)
+            
+        print(f"Task 8: Number of users that have been close to each other: {len(close_users_set)}")
+        
+    def _close_users_grid(self, distance, time_window):
+        """Finds the users that have been close to each other, by streaming all track points in time order
+        and comparing only those in neighbouring cells of a spatio-temporal grid, a batch at a time
+
+        Returns:
+            set[string]: the close users
+        """
+        activity_ids, activity_users, activity_bounds = self._proximity_activities()
+        if len(activity_ids) == 0:
+            return set()
+        user_ids, activity_user_codes = np.unique(activity_users, return_inverse=True)
+        
+        grid = ProximityGrid(distance, time_window)
+        close_user_codes = set()
+        window = None
+        for track_point_activity_ids, lats, lons, timestamps in self._proximity_batches():
+            # Track points of activities without a summary are not compared, like in the pairwise comparison
+            activities = np.minimum(np.searchsorted(activity_ids, track_point_activity_ids), len(activity_ids) - 1)
+            known = activity_ids[activities] == track_point_activity_ids
+            batch = [activities[known], lats[known], lons[known], timestamps[known]]
+            if window is not None:
+                batch = [np.concatenate(columns) for columns in zip(window, batch)]
+            activities, lats, lons, timestamps = batch
+            if len(timestamps) == 0:
+                continue
+            
+            close_user_codes |= grid.close_users(activity_user_codes[activities], lats, lons, timestamps,
+                                                 activities, activity_bounds)
+            # The batches are sorted by time, so only the track points within the time window of the last one
+            # can be close to track points of the next batches. They are compared again with those, which
+            # bounds the memory use by the batch size and the number of track points in a time window
+            window = [column[np.searchsorted(timestamps, timestamps[-1] - time_window):] for column in batch]
+        
+        return {user_ids[code] for code in close_user_codes}
+        
+    def _proximity_activities(self):
+        """Fetches the activities compared by _close_users_grid
+
+        Returns:
+            tuple[np.ndarray]: the sorted activity ids, and the user id and the bounding box and time span of each
+            activity
+        """
+        # Two points only count if the bounding boxes and time spans of their activities overlap too,
+        # like in the pairwise comparison
+        activity_query = """
+        SELECT id, user_id, min_lat, max_lat, min_lon, max_lon,
+               TIMESTAMPDIFF(SECOND, '1970-01-01', activity.start_date_time),
+               TIMESTAMPDIFF(SECOND, '1970-01-01', activity.end_date_time)
+        FROM activity
+        INNER JOIN activity_summary
+        ON activity.id = activity_summary.activity_id
+        ORDER BY id
+        """
+        activity_ids, activity_users, *bounds = self._fetch_arrays(
+            activity_query, [np.int64, object, np.float64, np.float64, np.float64, np.float64, np.int64, np.int64])
+        activity_bounds = np.column_stack(bounds).astype(np.float64)
+        return activity_ids, activity_users, activity_bounds
+        
+    def _proximity_batches(self, batch_size=100000):
+        """Streams all track points sorted by time. Every track point is read once, so they are not
+        read through the track point cache
+
+        Args:
+            batch_size (int): number of track points per batch
+
+        Yields:
+            list[np.ndarray]: the activity id, lat, lon and time (in seconds since 1970) of the track points
+            of a batch
+        """
+        track_points_query = """
+        SELECT activity_id, lat, lon, TIMESTAMPDIFF(SECOND, '1970-01-01', date_time)
+        FROM track_point
+        ORDER BY date_time
+        """
+        yield from self._stream_arrays(track_points_query, [np.int64, np.float64, np.float64, np.int64],
+                                       batch_size=batch_size)
+        
+    def _fetch_rows(self, query, params=None):
+        """
+        Returns:
+            tuple[list[tuple], tuple]: the rows of the query and the names of its columns
+        """
+        self.cursor.execute(query, params)
+        return self.cursor.fetchall(), self.cursor.column_names
+        
+    def _fetch_arrays(self, query, dtypes, params=None, batch_size=100000):
+        """Streams the rows of a query in batches into one NumPy array per column
+
+        Args:
+            query (string): the query
+            dtypes (list): the dtype of each column
+            params (dict): the query parameters
+            batch_size (int): number of rows fetched at a time
+
+        Returns:
+            list[np.ndarray]: the columns
+        """
+        chunks = [[] for _ in dtypes]
+        for batch in self._stream_arrays(query, dtypes, params, batch_size):
+            for chunk, column in zip(chunks, batch):
+                chunk.append(column)
+        
+        return [np.concatenate(chunk) if chunk else np.empty(0, dtype=dtype) for chunk, dtype in zip(chunks, dtypes)]
+    
+    def _stream_arrays(self, query, dtypes, params=None, batch_size=100000, prefetch=2):
+        """Streams the rows of a query in batches of NumPy columns. The cursor is unbuffered, so the rows are
+        read from the server as they are fetched. A background thread fetches and converts the next batches
+        while the current one is processed, and at most prefetch batches wait in memory
+
+        Args:
+            query (string): the query
+            dtypes (list): the dtype of each column
+            params (dict): the query parameters
+            batch_size (int): number of rows fetched at a time
+            prefetch (int): number of batches fetched ahead
+
+        Yields:
+            list[np.ndarray]: the columns of a batch
+        """
+        self.cursor.execute(query, params)
+        batches = queue.Queue(maxsize=prefetch)
+        stopped = threading.Event()
+        
+        def fetch():
+            try:
+                while True:
+                    rows = self.cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    # The rest of the result is still read if the batches are no longer needed, as the
+                    # connection cannot run another query before that
+                    if not stopped.is_set():
+                        batches.put([np.array(column, dtype=dtype) for column, dtype in zip(zip(*rows), dtypes)])
+                batches.put(None)
+            except Exception as e:
+                batches.put(e)
+        
+        thread = threading.Thread(target=fetch, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stopped.set()
+            # Unblocks the thread if it is waiting for room in the queue
+            while thread.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        
+    def _close_users_pairwise(self, distance, time_window):
+        """Finds the users that have been close to each other, by comparing the activities
+        of each pair of users that overlap in time and space
+
+        Returns:
+            set[string]: the close users
+        """
         # Idea, find max and min lat and long for each activity and then compare activities between each user
         # Fetch all users
         self.cursor.execute("SELECT id FROM user")
@@ -122,24 +336,22 @@ class Part2:
         
         close_users_set = set()
         # Find all pairs of activities that overlap in time and space, defined by time window and bounding boxes
-        # (max lat and lon)
+        # (max lat and lon), which are read from activity_summary
         activities_query = """
         SELECT u1.id AS user1_activity_id, u2.id AS user2_activity_id
         FROM (
-            SELECT activity.id, MAX(lat) AS max_lat, MAX(lon) AS max_lon, MIN(lat) AS min_lat, MIN(lon) AS min_lon, start_date_time, end_date_time
+            SELECT activity.id, max_lat, max_lon, min_lat, min_lon, activity.start_date_time, activity.end_date_time
             FROM activity
-            INNER JOIN track_point
-            ON activity.id = track_point.activity_id
+            INNER JOIN activity_summary
+            ON activity.id = activity_summary.activity_id
             WHERE user_id = %(user_id1)s
-            GROUP BY activity_id
         ) AS u1
         INNER JOIN (
-            SELECT activity.id, MAX(lat) AS max_lat, MAX(lon) AS max_lon, MIN(lat) AS min_lat, MIN(lon) AS min_lon, start_date_time, end_date_time, user_id
+            SELECT activity.id, max_lat, max_lon, min_lat, min_lon, activity.start_date_time, activity.end_date_time
             FROM activity
-            INNER JOIN track_point
-            ON activity.id = track_point.activity_id
+            INNER JOIN activity_summary
+            ON activity.id = activity_summary.activity_id
             WHERE user_id = %(user_id2)s
-            GROUP BY activity_id
         ) AS u2
         ON u1.max_lat >= u2.min_lat 
         AND u1.max_lon >= u2.min_lon 
@@ -148,11 +360,6 @@ class Part2:
         AND u1.end_date_time >= u2.start_date_time
         AND u1.start_date_time <= u2.end_date_time
         """
-        select_trackpoints_query = """
-        SELECT track_point.lat, track_point.lon, track_point.date_time
-        FROM track_point
-        WHERE track_point.activity_id = %(activity_id)s
-        """
 
         # For each user, fetch their trackpoints and compare with those of every other user not in close_users_set
         for user_id1 in users:
@@ -161,11 +368,11 @@ class Part2:
                 # No point in comparing previous users, or if the two users are both close to someone else
                 if user_id2 > user_id1 and (user_id1 not in close_users_set or user_id2 not in close_users_set):
                     # Fetch trackpoints for user_id1
-                    self._compare_users(user_id1, user_id2, activities_query, select_trackpoints_query, close_users_set)
+                    self._compare_users(user_id1, user_id2, activities_query, close_users_set, distance, time_window)
             
-        print(f"Task 8: Number of users that have been close to each other: {len(close_users_set)}")
+        return close_users_set
     
-    def _compare_users(self, user_id1, user_id2, activities_query, select_trackpoints_query, close_users_set):
+    def _compare_users(self, user_id1, user_id2, activities_query, close_users_set, distance, time_window):
         print(f"Comparing user {user_id1} with user {user_id2}")
         self.cursor.execute(activities_query, {'user_id1': user_id1, 'user_id2': user_id2})
         # The pairs of activities that overlap, we should only need to compare the pairs
@@ -174,153 +381,330 @@ class Part2:
         activity_pairs = [(row[0], row[1]) for row in rows]
         
         for activity_pair in activity_pairs:
-            # Fetch trackpoints for user_id1
-            self.cursor.execute(select_trackpoints_query, {'activity_id': activity_pair[0]})
-            rows = self.cursor.fetchall()
-            user1_trackpoints = [(row[0], row[1], row[2]) for row in rows]
-            # Fetch trackpoints for user_id2
-            self.cursor.execute(select_trackpoints_query, {'activity_id': activity_pair[1]})
-            rows = self.cursor.fetchall()
-            user2_trackpoints = [(row[0], row[1], row[2]) for row in rows]
+            # The same activity is part of many pairs, so the trackpoints are only fetched the first time
+            trackpoints = self.track_point_cache.get_many(activity_pair)
+            user1_trackpoints = trackpoints[activity_pair[0]]
+            user2_trackpoints = trackpoints[activity_pair[1]]
             
-            if self._compare_trackpoints(user1_trackpoints, user2_trackpoints):
+            if self._compare_trackpoints(user1_trackpoints, user2_trackpoints, distance, time_window):
                 print(f"User {user_id1} and user {user_id2} have been close to each other")
                 close_users_set.add(user_id1)
                 close_users_set.add(user_id2)
                 return
                     
-    def _compare_trackpoints(self, trackpoints1, trackpoints2):
-        locs1 = [(trackpoint[0], trackpoint[1]) for trackpoint in trackpoints1]
-        locs2 = [(trackpoint[0], trackpoint[1]) for trackpoint in trackpoints2]
-        
-        distances = haversine_vector(locs1, locs2, comb=True, unit=Unit.METERS)
-        rows, columns = np.where(distances <= 50)
-        
-        for close_index_pair in zip(rows, columns):
-            # A bit weird, but the columns of the distance matrix corresponds to user1
-            # and the rows to user2
-            trackpoint1 = trackpoints1[close_index_pair[1]]
-            trackpoint2 = trackpoints2[close_index_pair[0]]
-            time_difference = abs(trackpoint1[2] - trackpoint2[2]).total_seconds()
-            # If the time difference is less or equal to 30 seconds, these users have been close to each other
-            if time_difference <= 30:
-                return True
+    def _compare_trackpoints(self, trackpoints1, trackpoints2, distance, time_window, max_pairs=100000):
+        """Checks if two activities have a pair of track points within the distance and time window of each other.
+        Both activities are sorted by time, so that each track point is only compared with the track points
+        of the other activity within its time window, instead of computing all N x M distances
+
+        Args:
+            trackpoints1 (tuple[np.ndarray]): lat, lon and time in seconds of the track points of the first activity
+            trackpoints2 (tuple[np.ndarray]): lat, lon and time in seconds of the track points of the second activity
+            distance (float): maximum distance in meters
+            time_window (int): maximum time difference in seconds
+            max_pairs (int): maximum number of distances computed at once, which bounds the memory use
+
+        Returns:
+            bool: true if the activities have been close to each other, else false
+        """
+        lats1, lons1, times1 = self._sort_trackpoints_by_time(trackpoints1)
+        lats2, lons2, times2 = self._sort_trackpoints_by_time(trackpoints2)
+        
+        # The window of each track point of the first activity among the track points of the second.
+        # As both are sorted, the window bounds only move forward, like two pointers sweeping through them
+        window_starts = np.searchsorted(times2, times1 - time_window, side="left")
+        window_ends = np.searchsorted(times2, times1 + time_window, side="right")
+        window_sizes = window_ends - window_starts
+        window_size_sums = np.cumsum(window_sizes)
+        
+        first = 0
+        while first < len(window_sizes):
+            # Take as many windows as fit in max_pairs, but at least one
+            done = window_size_sums[first - 1] if first > 0 else 0
+            last = max(int(np.searchsorted(window_size_sums, done + max_pairs, side="right")), first + 1)
+            
+            sizes = window_sizes[first:last]
+            indices1 = np.repeat(np.arange(first, last), sizes)
+            within_window = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+            indices2 = window_starts[indices1] + within_window
+            
+            if len(indices1):
+                distances = haversine_vector(np.column_stack((lats1[indices1], lons1[indices1])),
+                                             np.column_stack((lats2[indices2], lons2[indices2])),
+                                             Unit.METERS)
+                # Stop at the first chunk with a close pair
+                if np.any(distances <= distance):
+                    return True
+            first = last
         
         return False
+    
+    def _sort_trackpoints_by_time(self, trackpoints):
+        """
+        Args:
+            trackpoints (tuple[np.ndarray]): lat, lon and time in seconds of track points
+
+        Returns:
+            tuple[np.ndarray]: lat, lon and time in seconds of the track points, sorted by time
+        """
+        lats, lons, times = trackpoints
+        order = np.argsort(times, kind="stable")
+        
+        return lats[order], lons[order], times[order]
             
-    def task9(self):
-        query = """
-        WITH tp_cleaned AS (
-            SELECT 
-                id,
-                activity_id,
-                altitude,
-                ROW_NUMBER() OVER (PARTITION BY activity_id) AS rn
-            FROM track_point
-            WHERE altitude != -777
-        )
+    def task9(self, use_summary=True):
+        """Finds the top 15 users with the highest total altitude gained
 
-        SELECT user_id, SUM(
-                CASE
-                    WHEN tp.altitude > tp_prev.altitude THEN (tp.altitude - tp_prev.altitude) * 0.3048
-                    ELSE 0
-                END) AS total_gained_altitude
-        FROM activity
-        INNER JOIN tp_cleaned tp
-        ON tp.activity_id = activity.id
-        INNER JOIN tp_cleaned tp_prev
-        ON tp.rn = tp_prev.rn + 1
-        AND tp.activity_id = tp_prev.activity_id
-        GROUP BY user_id
-        ORDER BY total_gained_altitude DESC
-        LIMIT 15;
+        Args:
+            use_summary (bool): sum the altitude gained per activity kept in activity_summary, instead of
+                comparing each track point with the previous one of its activity
         """
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
+        rows, headers = self._task9_rows(use_summary)
         print("Task 9: Top 15 users with the highest total altitude gained:")
-        print(tabulate(rows, headers=self.cursor.column_names))
-        
-    def task10(self):
-        # Filter out users that have not labeled their activities,
-        # no need to iterate through them
-        user_query = """
-        SELECT id
-        FROM user
-        WHERE has_labels = 1
-        """
-        self.cursor.execute(user_query)
-        user_rows = self.cursor.fetchall()
-        user_ids = [user_row[0] for user_row in user_rows]
-        
-        transport_query = """
-        SELECT DISTINCT transportation_mode
-        FROM activity
-        WHERE transportation_mode IS NOT NULL
-        """
-        self.cursor.execute(transport_query)
-        transportation_rows = self.cursor.fetchall()
-        transportation_modes = [transport_row[0] for transport_row in transportation_rows]
-        max_distances = {transportation_mode: (None, 0) for transportation_mode in transportation_modes}
+        print(tabulate(rows, headers=headers))
         
-        for user_id in user_ids:
-            print(f"Calculating distances for user {user_id}")
-            distances_user = {transport_mode: 0 for transport_mode in transportation_modes}
-            distances = {}
-            # Select all trackpoints for the user that have a transportation mode
-            track_points_query = """
-            SELECT activity.id, lat, lon, date_time, transportation_mode
+    def _task9_rows(self, use_summary):
+        if use_summary:
+            # The altitude gained per activity, ignoring invalid altitudes, is kept in activity_summary
+            query = """
+            SELECT user_id, SUM(altitude_gain) AS total_gained_altitude
             FROM activity
-            INNER JOIN track_point
-            ON activity.id = track_point.activity_id
-            WHERE transportation_mode IS NOT NULL
-            AND user_id = %(user_id)s
+            INNER JOIN activity_summary
+            ON activity.id = activity_summary.activity_id
+            GROUP BY user_id
+            ORDER BY total_gained_altitude DESC
+            LIMIT 15;
             """
-            self.cursor.execute(track_points_query, {'user_id': user_id})
-            trackpoint_rows = self.cursor.fetchall()
-            for i in range(1, len(trackpoint_rows)):
-                activity_id, lat, lon, date_time, transportation_mode = trackpoint_rows[i]
-                prev_activity_id, prev_lat, prev_lon, prev_date_time, prev_transportation_mode = trackpoint_rows[i-1]
-                # We only care about the actual date, not datetime
-                date = date_time.date()
-                prev_date = prev_date_time.date()
-                # If the date is the same as the previous date, and the transportation mode is the same
-                # as the previous transportation mode and the activity id is the same, we can calculate
-                # the distance between the two points
-                if date == prev_date and transportation_mode == prev_transportation_mode and activity_id == prev_activity_id:
-                    distances[(date, transportation_mode)] = distances.get((date, transportation_mode), 0) + haversine((lat, lon), (prev_lat, prev_lon))
-            
-            for (date, transportation_mode), distance in distances.items():
-                distances_user[transportation_mode] = max(distances_user[transportation_mode], distance)
-        
-            for transportation_mode, distance in distances_user.items():
-                if distance > max_distances[transportation_mode][1]:
-                    max_distances[transportation_mode] = (user_id, distance)
+        else:
+            # The previous valid altitude of the activity, read in order from the (activity_id, seq) index
+            query = """
+            SELECT user_id, SUM(
+                    CASE
+                        WHEN tp.altitude > tp.prev_altitude THEN (tp.altitude - tp.prev_altitude) * 0.3048
+                        ELSE 0
+                    END) AS total_gained_altitude
+            FROM (
+                SELECT activity_id, altitude,
+                       LAG(altitude) OVER (PARTITION BY activity_id ORDER BY seq) AS prev_altitude
+                FROM track_point
+                WHERE altitude != -777
+            ) AS tp
+            INNER JOIN activity
+            ON tp.activity_id = activity.id
+            GROUP BY user_id
+            ORDER BY total_gained_altitude DESC
+            LIMIT 15;
+            """
+        return self._fetch_rows(query)
         
-        print("Task 10: Users with the longest distance traveled per transportation mode:")
+    def task10(self, year=None):
+        """Finds the user with the longest distance traveled on a single date per transportation mode
+
+        Args:
+            year (int): only count the dates of this year. The track points are then bounded by date_time,
+                so only the partition of the year is read if track_point is partitioned by date_time
+        """
+        max_distances = self._max_distances_per_mode(year)
+        print(f"Task 10: Users with the longest distance traveled per transportation mode{f' in {year}' if year else ''}:")
         for transportation_mode, (user_id, distance) in max_distances.items():
             print(f"Transportation mode {transportation_mode}: user: {user_id}, distance: {distance:.2f} km")
             
-    def task11(self):
-        query = """
-        SELECT activity.user_id, COUNT(*) AS invalid_activity_count
-        FROM ( 
-            SELECT DISTINCT tp.activity_id
-            FROM track_point AS tp
-            INNER JOIN track_point AS tp_prev
-            ON tp.id = tp_prev.id + 1
-            AND tp.activity_id = tp_prev.activity_id
-            WHERE ABS(TIMESTAMPDIFF(MINUTE, tp.date_time, tp_prev.date_time)) >= 5
-        ) AS invalid_activities
+    def _max_distances_per_mode(self, year):
+        """
+        Returns:
+            dict[string, tuple]: user id and longest distance in km on a single date per transportation mode,
+            see _max_daily_distances
+        """
+        params = {"start": f"{year}-01-01", "end": f"{year + 1}-01-01"} if year else None
+        # Only labeled activities count, the track points are mapped to their activity afterwards
+        activities_query = f"""
+        SELECT id, user_id, transportation_mode, total_distance,
+               DATEDIFF(activity_summary.start_date_time, '1970-01-01'),
+               DATEDIFF(activity_summary.end_date_time, '1970-01-01')
+        FROM activity
+        INNER JOIN activity_summary
+        ON activity.id = activity_summary.activity_id
+        WHERE transportation_mode IS NOT NULL
+        {"AND activity_summary.start_date_time < %(end)s AND activity_summary.end_date_time >= %(start)s"
+         if year else ""}
+        ORDER BY id
+        """
+        self.cursor.execute(activities_query, params)
+        activity_rows = self.cursor.fetchall()
+        activity_ids = np.array([activity_row[0] for activity_row in activity_rows], dtype=np.int64)
+        # User ids are strings, so users and modes are grouped by their index into the sorted unique values
+        user_ids, activity_users = np.unique([activity_row[1] for activity_row in activity_rows], return_inverse=True)
+        user_ids = user_ids.tolist()
+        transportation_modes, activity_modes = np.unique([activity_row[2] for activity_row in activity_rows],
+                                                         return_inverse=True)
+        transportation_modes = transportation_modes.tolist()
+        
+        # The whole distance of an activity on a single date is its total distance in activity_summary
+        total_distances = np.array([activity_row[3] for activity_row in activity_rows], dtype=np.float64)
+        start_dates = np.array([activity_row[4] for activity_row in activity_rows], dtype=np.int64)
+        single_date = start_dates == np.array([activity_row[5] for activity_row in activity_rows], dtype=np.int64)
+        # Total distance per user, mode and date
+        daily_distances = {}
+        self._add_daily_distances(daily_distances, activity_users[single_date], activity_modes[single_date],
+                                  start_dates[single_date], total_distances[single_date])
+        
+        # Only activities spanning several dates are split up by date from their track points,
+        # streamed in one query in the order they were recorded per activity. They are read once,
+        # so not through the track point cache
+        track_points_query = f"""
+        SELECT track_point.activity_id, lat, lon, TIMESTAMPDIFF(SECOND, '1970-01-01', date_time)
+        FROM activity_summary
+        INNER JOIN track_point
+        ON activity_summary.activity_id = track_point.activity_id
         INNER JOIN activity
-        ON invalid_activities.activity_id = activity.id
-        GROUP BY activity.user_id;
+        ON activity_summary.activity_id = activity.id
+        WHERE transportation_mode IS NOT NULL
+        AND DATE(activity_summary.start_date_time) != DATE(activity_summary.end_date_time)
+        {"AND track_point.date_time >= %(start)s AND track_point.date_time < %(end)s" if year else ""}
+        ORDER BY track_point.activity_id, track_point.seq
         """
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
+        # Each batch is added to the totals as it arrives, so the memory use does not grow with the number
+        # of track points. The last track point of a batch is kept, as it starts a segment of the next batch
+        last_track_point = None
+        for batch in self._stream_arrays(track_points_query, [np.int64, np.float64, np.float64, np.int64], params):
+            if last_track_point is not None:
+                batch = [np.concatenate(([last], column)) for last, column in zip(last_track_point, batch)]
+            activities, lats, lons, times = batch
+            self._add_daily_distances(daily_distances,
+                                      *self._segment_distances(activity_ids, activity_users, activity_modes,
+                                                               activities, lats, lons, times))
+            last_track_point = [column[-1] for column in batch]
+        
+        return self._max_daily_distances(daily_distances, user_ids, transportation_modes)
+    
+    def _max_daily_distances(self, daily_distances, user_ids, transportation_modes):
+        """Finds the user with the longest distance traveled on a single date per transportation mode
+
+        Args:
+            daily_distances (dict[tuple, float]): total distance per user code, mode code and date
+            user_ids (list[string]): the user id of each user code, sorted
+            transportation_modes (list[string]): the transportation mode of each mode code
+
+        Returns:
+            dict[string, tuple]: user id and distance in km per transportation mode, (None, 0) if no user
+        """
+        max_distances = {transportation_mode: (None, 0) for transportation_mode in transportation_modes}
+        if not daily_distances:
+            return max_distances
+        
+        # Sorted by user, mode and date
+        groups = np.array(sorted(daily_distances), dtype=np.int64)
+        group_distances = np.array([daily_distances[tuple(group)] for group in groups.tolist()])
+        # Longest distance on a single date per user and mode
+        user_mode_starts = np.flatnonzero(np.r_[True, np.any(groups[1:, :2] != groups[:-1, :2], axis=1)])
+        user_mode_groups = groups[user_mode_starts, :2]
+        user_mode_distances = np.maximum.reduceat(group_distances, user_mode_starts)
+        
+        for mode in range(len(transportation_modes)):
+            mode_rows = np.flatnonzero(user_mode_groups[:, 1] == mode)
+            if len(mode_rows) == 0:
+                continue
+            # The rows are sorted by user, so ties go to the smallest user id
+            best = mode_rows[np.argmax(user_mode_distances[mode_rows])]
+            max_distances[transportation_modes[mode]] = (user_ids[user_mode_groups[best, 0]],
+                                                          user_mode_distances[best].item())
+        
+        return max_distances
+    
+    def _add_daily_distances(self, daily_distances, users, modes, dates, distances):
+        """Adds distances to the totals per user, mode and date
+
+        Args:
+            daily_distances (dict[tuple, float]): total distance per user code, mode code and date
+            users (np.ndarray): user code of each distance
+            modes (np.ndarray): transportation mode code of each distance
+            dates (np.ndarray): date of each distance, in days since 1970
+            distances (np.ndarray): the distances in km
+        """
+        if len(distances) == 0:
+            return
+        # Summed per group first, so only one dict update per group is done in Python
+        groups, group_index = np.unique(np.column_stack((users, modes, dates)), axis=0, return_inverse=True)
+        group_distances = np.bincount(group_index.ravel(), weights=distances)
+        for group, distance in zip(map(tuple, groups.tolist()), group_distances.tolist()):
+            daily_distances[group] = daily_distances.get(group, 0) + distance
+    
+    def _segment_distances(self, activity_ids, activity_users, activity_modes, activities, lats, lons, times):
+        """Computes the distance between each pair of consecutive track points of the same activity and date
+
+        Args:
+            activity_ids (np.ndarray): sorted ids of the labeled activities
+            activity_users (np.ndarray): user code of each activity
+            activity_modes (np.ndarray): transportation mode code of each activity
+            activities (np.ndarray): activity id of each track point, with the points of an activity in recorded order
+            lats (np.ndarray): latitude of each track point
+            lons (np.ndarray): longitude of each track point
+            times (np.ndarray): time of each track point, in seconds since 1970
+
+        Returns:
+            tuple[np.ndarray]: user code, transportation mode code, date (in days since 1970) and distance in km
+            of each segment
+        """
+        # We only care about the actual date, not datetime
+        dates = times // 86400
+        same_segment = (activities[1:] == activities[:-1]) & (dates[1:] == dates[:-1])
+        
+        locations = np.column_stack((lats, lons))
+        segment_distances = (haversine_vector(locations[:-1][same_segment], locations[1:][same_segment])
+                             if same_segment.any() else np.empty(0))
+        segment_activities = np.searchsorted(activity_ids, activities[1:][same_segment])
+        
+        return (activity_users[segment_activities], activity_modes[segment_activities], dates[1:][same_segment],
+                segment_distances)
+            
+    def task11(self, use_summary=True):
+        """Finds the number of invalid activities per user. An activity is invalid if two consecutive
+        trackpoints are at least 5 minutes apart
+
+        Args:
+            use_summary (bool): use the largest time gap per activity kept in activity_summary, instead of
+                comparing each track point with the previous one of its activity
+        """
+        rows, headers = self._task11_rows(use_summary)
         print("Task 11: Users with invalid activities:")
-        print(tabulate(rows, headers=self.cursor.column_names))
+        print(tabulate(rows, headers=headers))
+        
+    def _task11_rows(self, use_summary):
+        if use_summary:
+            query = """
+            SELECT activity.user_id, COUNT(*) AS invalid_activity_count
+            FROM activity_summary
+            INNER JOIN activity
+            ON activity_summary.activity_id = activity.id
+            WHERE max_time_gap >= 5 * 60
+            GROUP BY activity.user_id;
+            """
+        else:
+            # The previous date_time of the activity, read in order from the (activity_id, seq) index
+            query = """
+            SELECT activity.user_id, COUNT(*) AS invalid_activity_count
+            FROM (
+                SELECT DISTINCT activity_id
+                FROM (
+                    SELECT activity_id,
+                           ABS(TIMESTAMPDIFF(MINUTE, LAG(date_time) OVER (PARTITION BY activity_id ORDER BY seq),
+                                             date_time)) AS gap
+                    FROM track_point
+                ) AS gaps
+                WHERE gap >= 5
+            ) AS invalid_activities
+            INNER JOIN activity
+            ON invalid_activities.activity_id = activity.id
+            GROUP BY activity.user_id;
+            """
+        return self._fetch_rows(query)
     
     def task12(self):
+        rows, headers = self._task12_rows()
+        print("Task 12: Most used transportation mode per user:")
+        print(tabulate(rows, headers=headers))
+        
+    def _task12_rows(self):
         query = """
         SELECT user_id, transportation_mode
         FROM (
@@ -335,17 +719,16 @@ class Part2:
         ) AS transportation_ranking
         WHERE ranking = 1;
         """
-        self.cursor.execute(query)
-        rows = self.cursor.fetchall()
-        print("Task 12: Most used transportation mode per user:")
-        print(tabulate(rows, headers=self.cursor.column_names))
+        return self._fetch_rows(query)
 
                                 
 def main():
     start_time = time.perf_counter()
     program = None
+    # Read from an embedded SQLite database in this file instead of the MySQL server
+    sqlite_path = None
     try:
-        program = Part2()
+        program = Part2(SqliteDbConnector(PATH=sqlite_path) if sqlite_path else None)
         # program.task1()
         # program.task2()
         # program.task3()
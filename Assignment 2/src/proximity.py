@@ -0,0 +1,193 @@
+from haversine import Unit, haversine_vector
+import numpy as np
+
+# Mean earth radius in meters, the same as used by haversine
+EARTH_RADIUS = 6371008.8
+
+
+class ProximityGrid:
+    """
+    Finds users that have been close to each other, by bucketing all track points into a spatio-temporal grid.
+    The cells are slightly larger than the distance and time window, so two points within the distance and
+    time window of each other are always in the same or in neighbouring cells. Only points in neighbouring
+    cells are compared, and only if the cells contain more than one user.
+    """
+
+    def __init__(self, distance=50, time_window=30, max_pairs=2000000):
+        """
+        Args:
+            distance (float): maximum distance between two close points, in meters
+            time_window (int): maximum time difference between two close points, in seconds
+            max_pairs (int): maximum number of point pairs compared at once, which bounds the memory use
+        """
+        self.distance = distance
+        self.time_window = time_window
+        self.max_pairs = max_pairs
+
+    def close_user_pairs(self, users, lat, lon, timestamps, activities=None, activity_bounds=None):
+        """Finds all pairs of users with at least one pair of points within the distance and time window
+
+        Args:
+            users (np.ndarray): user id of each point
+            lat (np.ndarray): latitude of each point
+            lon (np.ndarray): longitude of each point
+            timestamps (np.ndarray): time of each point, in whole seconds
+            activities (np.ndarray): optional index of the activity of each point into activity_bounds
+            activity_bounds (np.ndarray): optional min_lat, max_lat, min_lon, max_lon, start and end time of
+                each activity. If given, two points are only close if the bounding boxes and the time spans
+                of their activities overlap as well
+
+        Returns:
+            set[tuple]: the close pairs of users, with the smallest user id first
+        """
+        if len(users) == 0:
+            return set()
+
+        user_ids, user_codes = np.unique(users, return_inverse=True)
+        user_ids = user_ids.tolist()
+        order, cell_keys, cell_starts, cell_counts, width, height = self._build_cells(lat, lon, timestamps)
+
+        # Per cell, the smallest and largest user, to skip cells visited by a single user
+        sorted_user_codes = user_codes[order]
+        cell_user_min = np.minimum.reduceat(sorted_user_codes, cell_starts)
+        cell_user_max = np.maximum.reduceat(sorted_user_codes, cell_starts)
+
+        close_codes = set()
+        for key_offset in self._neighbour_key_offsets(width, height):
+            targets = cell_keys + key_offset
+            neighbours = np.searchsorted(cell_keys, targets)
+            found = neighbours < len(cell_keys)
+            found[found] = cell_keys[neighbours[found]] == targets[found]
+            cells_a = np.nonzero(found)[0]
+            cells_b = neighbours[found]
+
+            single_user = ((cell_user_min[cells_a] == cell_user_max[cells_a])
+                           & (cell_user_min[cells_b] == cell_user_max[cells_b])
+                           & (cell_user_min[cells_a] == cell_user_min[cells_b]))
+            cells_a = cells_a[~single_user]
+            cells_b = cells_b[~single_user]
+
+            for points_a, points_b in self._point_pairs(cell_starts, cell_counts, cells_a, cells_b):
+                points_a = order[points_a]
+                points_b = order[points_b]
+                close = self._close(points_a, points_b, user_codes, lat, lon, timestamps,
+                                    activities, activity_bounds)
+                users_a = user_codes[points_a[close]]
+                users_b = user_codes[points_b[close]]
+                code_pairs = np.unique(np.column_stack((np.minimum(users_a, users_b), np.maximum(users_a, users_b))),
+                                       axis=0)
+                close_codes.update(map(tuple, code_pairs.tolist()))
+
+        return {(user_ids[code_a], user_ids[code_b]) for code_a, code_b in close_codes}
+
+    def close_users(self, users, lat, lon, timestamps, activities=None, activity_bounds=None):
+        """Finds all users with at least one point within the distance and time window of a point of another user.
+        See close_user_pairs for the arguments
+
+        Returns:
+            set: the close users
+        """
+        pairs = self.close_user_pairs(users, lat, lon, timestamps, activities, activity_bounds)
+        return {user for pair in pairs for user in pair}
+
+    def _build_cells(self, lat, lon, timestamps):
+        """Sorts the points by the cell they fall in
+
+        Returns:
+            tuple: the order of the points sorted by cell, the key, first sorted position and
+            number of points of each non-empty cell, and the width and height of the grid in cells
+        """
+        # Degrees of latitude are at least the same length everywhere. A degree of longitude is shortest
+        # at the largest absolute latitude, so using its length there makes the cells at least as wide
+        # as the distance everywhere. The margin covers floating point rounding
+        meters_per_degree = EARTH_RADIUS * np.pi / 180
+        cell_size = self.distance * 1.001
+        max_abs_lat = min(float(np.max(np.abs(lat))), 89.9)
+        lat_cell = cell_size / meters_per_degree
+        lon_cell = cell_size / (meters_per_degree * np.cos(np.radians(max_abs_lat)))
+
+        cell_x = np.floor(lon / lon_cell).astype(np.int64)
+        cell_y = np.floor(lat / lat_cell).astype(np.int64)
+        cell_t = np.floor_divide(timestamps.astype(np.int64), self.time_window)
+        # Shifted to start at 1, so that the neighbours of every cell have non-negative coordinates
+        cell_x -= cell_x.min() - 1
+        cell_y -= cell_y.min() - 1
+        cell_t -= cell_t.min() - 1
+
+        width = int(cell_x.max()) + 2
+        height = int(cell_y.max()) + 2
+        if (int(cell_t.max()) + 2) * height * width >= 2 ** 63:
+            raise ValueError("The points span too many cells to be indexed, use a larger distance or time window")
+
+        keys = (cell_t * height + cell_y) * width + cell_x
+        order = np.argsort(keys, kind="stable")
+        cell_keys, cell_starts, cell_counts = np.unique(keys[order], return_index=True, return_counts=True)
+
+        return order, cell_keys, cell_starts, cell_counts, width, height
+
+    def _neighbour_key_offsets(self, width, height):
+        """
+        Returns:
+            list[int]: key offsets of the cell itself and half of its 26 neighbours. Comparing every cell
+            with these covers each pair of neighbouring cells exactly once
+        """
+        offsets = []
+        for dt in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dx in (-1, 0, 1):
+                    if (dt, dy, dx) >= (0, 0, 0):
+                        offsets.append((dt * height + dy) * width + dx)
+        return offsets
+
+    def _point_pairs(self, cell_starts, cell_counts, cells_a, cells_b):
+        """Expands pairs of cells into all pairs of their points, in chunks of at most max_pairs pairs
+        (or a single pair of cells, if that is larger)
+
+        Yields:
+            tuple[np.ndarray, np.ndarray]: sorted positions of the first and second point of each pair
+        """
+        sizes = cell_counts[cells_a] * cell_counts[cells_b]
+        ends = np.cumsum(sizes)
+        first = 0
+        while first < len(sizes):
+            done = ends[first - 1] if first > 0 else 0
+            last = max(int(np.searchsorted(ends, done + self.max_pairs, side="right")), first + 1)
+
+            chunk_a = cells_a[first:last]
+            chunk_b = cells_b[first:last]
+            chunk_sizes = sizes[first:last]
+            pair = np.repeat(np.arange(len(chunk_sizes)), chunk_sizes)
+            within = np.arange(chunk_sizes.sum()) - np.repeat(np.cumsum(chunk_sizes) - chunk_sizes, chunk_sizes)
+            counts_b = cell_counts[chunk_b][pair]
+
+            yield (cell_starts[chunk_a][pair] + within // counts_b,
+                   cell_starts[chunk_b][pair] + within % counts_b)
+            first = last
+
+    def _close(self, points_a, points_b, user_codes, lat, lon, timestamps, activities, activity_bounds):
+        """
+        Returns:
+            np.ndarray: mask of the point pairs of different users within the distance and time window
+        """
+        close = ((user_codes[points_a] != user_codes[points_b])
+                 & (np.abs(timestamps[points_a] - timestamps[points_b]) <= self.time_window))
+
+        if activity_bounds is not None:
+            bounds_a = activity_bounds[activities[points_a[close]]]
+            bounds_b = activity_bounds[activities[points_b[close]]]
+            overlap = ((bounds_a[:, 1] >= bounds_b[:, 0]) & (bounds_a[:, 0] <= bounds_b[:, 1])
+                       & (bounds_a[:, 3] >= bounds_b[:, 2]) & (bounds_a[:, 2] <= bounds_b[:, 3])
+                       & (bounds_a[:, 5] >= bounds_b[:, 4]) & (bounds_a[:, 4] <= bounds_b[:, 5]))
+            close[close] = overlap
+
+        if not close.any():
+            return close
+
+        candidates_a = points_a[close]
+        candidates_b = points_b[close]
+        distances = haversine_vector(np.column_stack((lat[candidates_a], lon[candidates_a])),
+                                     np.column_stack((lat[candidates_b], lon[candidates_b])),
+                                     Unit.METERS)
+        close[close] = distances <= self.distance
+
+        return close
@@ -0,0 +1,297 @@
+from DbConnector import DbConnector, SqliteDbConnector
+from part1 import Part1
+from part2 import Part2
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process
+import numpy as np
+import hashlib
+import time
+import os
+
+
+def shard_of(user_id, shard_count):
+    """Assigns a user to a shard by a hash of the user id, which unlike the built-in hash of strings
+    is the same in every process and run
+
+    Args:
+        user_id (string): the user id
+        shard_count (int): the number of shards
+
+    Returns:
+        int: the index of the shard of the user
+    """
+    return int.from_bytes(hashlib.md5(user_id.encode()).digest()[:8], "big") % shard_count
+
+
+class ShardedPart1:
+    """
+    Inserts the dataset into several databases, with each user and its activities and track points
+    in the shard given by shard_of. A shard is given by the Part1 arguments selecting its database,
+    like {"port": 3307} for a MySQL server or {"sqlite_path": "shard0.sqlite"}.
+    The other Part1 methods, like create_table_user, are run on every shard in turn
+    """
+
+    def __init__(self, shards, **options):
+        """
+        Args:
+            shards (list[dict]): the Part1 arguments selecting the database of each shard
+            options: the other Part1 arguments, the same for every shard
+        """
+        self.shards = shards
+        self.options = options
+        self.programs = [Part1(**options, **shard) for shard in shards]
+
+    def __getattr__(self, name):
+        # Raises AttributeError for anything that is not a Part1 method
+        getattr(Part1, name)
+
+        def run_on_shards(*args, **kwargs):
+            return [getattr(program, name)(*args, **kwargs) for program in self.programs]
+
+        return run_on_shards
+
+    def insert_gps_data(self, workers=1):
+        """Inserts the users of each shard into it, all shards at once. Activity ids are interleaved,
+        so that they are unique across the shards as long as the number of shards does not change
+
+        Args:
+            workers (int): number of processes inserting users in parallel per shard
+        """
+        shard_user_ids = [[] for _ in self.shards]
+        for user_id in os.listdir("./dataset/Data"):
+            shard_user_ids[shard_of(user_id, len(self.shards))].append(user_id)
+
+        # A process per shard, as the ingestion of a shard starts worker processes of its own
+        processes = [Process(target=_insert_shard,
+                             args=(self.options, shard, workers, user_ids, len(self.shards), index))
+                     for index, (shard, user_ids) in enumerate(zip(self.shards, shard_user_ids))]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        failed = [index for index, process in enumerate(processes) if process.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"Inserting into shards {failed} failed")
+
+    def close_connection(self):
+        for program in self.programs:
+            program.connection.close_connection()
+
+
+def _insert_shard(options, shard, workers, user_ids, shard_count, index):
+    program = Part1(**options, **shard)
+    try:
+        program.insert_gps_data(workers, user_ids, activity_id_step=shard_count, activity_id_offset=index)
+    finally:
+        program.connection.close_connection()
+
+
+class ShardConnections:
+    """
+    The connections to the shards of a ShardedPart2, closed together like a DbConnector
+    """
+
+    def __init__(self, shards):
+        """
+        Args:
+            shards (list[dict]): "port" of the MySQL server or "sqlite_path" of the SQLite database of each shard
+        """
+        self.connections = [SqliteDbConnector(PATH=shard["sqlite_path"]) if "sqlite_path" in shard
+                            else DbConnector(PORT=shard.get("port", 3306)) for shard in shards]
+
+    def close_connection(self):
+        for connection in self.connections:
+            connection.close_connection()
+
+
+class ShardedPart2(Part2):
+    """
+    Runs the Part2 tasks on the shards inserted by ShardedPart1 as scatter-gather: every shard computes
+    the partial result of a task at the same time, and the partial results are merged here.
+    A user is only in one shard, so rows per user are merged by concatenating them, and the top k users
+    are among the top k of each shard. Task 8 compares users across shards, so the track points of all
+    shards are streamed in time order, merged and compared in one grid
+    """
+
+    def __init__(self, shards):
+        """
+        Args:
+            shards (list[dict]): see ShardConnections
+        """
+        self.connection = ShardConnections(shards)
+        self.programs = [Part2(connection) for connection in self.connection.connections]
+        self.executor = ThreadPoolExecutor(max_workers=len(self.programs))
+
+    def _scatter(self, method, *args):
+        """Runs a Part2 method on every shard at once, each with its own connection
+
+        Returns:
+            list: the result of each shard
+        """
+        return list(self.executor.map(lambda program: getattr(program, method)(*args), self.programs))
+
+    def _concatenate(self, results):
+        """
+        Args:
+            results (list[tuple]): the rows and column names of each shard
+
+        Returns:
+            tuple[list[tuple], tuple]: the rows of all shards, sorted by their first column (the user id or
+            activity id), and the column names
+        """
+        return sorted((row for rows, _ in results for row in rows), key=lambda row: row[0]), results[0][1]
+
+    def _sum_rows(self, results):
+        """
+        Returns:
+            tuple[list[tuple], tuple]: a row with the sum of each column of the rows of all shards,
+            and the column names
+        """
+        rows, headers = self._concatenate(results)
+        return [tuple(sum(column) for column in zip(*rows))], headers
+
+    def _top(self, results, k):
+        """
+        Returns:
+            tuple[list[tuple], tuple]: the k rows of all shards with the largest second column,
+            and the column names
+        """
+        rows, headers = self._concatenate(results)
+        return sorted(rows, key=lambda row: row[1], reverse=True)[:k], headers
+
+    def _task1_rows(self):
+        return self._sum_rows(self._scatter("_task1_rows"))
+
+    def _task2_partials(self):
+        partials = [partial for partial in self._scatter("_task2_partials") if partial[0]]
+        if not partials:
+            return 0, None, None, None
+        user_counts, trackpoint_counts, minimum_counts, maximum_counts = zip(*partials)
+        return sum(user_counts), sum(trackpoint_counts), min(minimum_counts), max(maximum_counts)
+
+    def _task3_rows(self):
+        return self._top(self._scatter("_task3_rows"), 15)
+
+    def _task4_rows(self):
+        return self._concatenate(self._scatter("_task4_rows"))
+
+    def _task5_rows(self):
+        return self._top(self._scatter("_task5_rows"), 10)
+
+    def _task6_rows(self):
+        return self._concatenate(self._scatter("_task6_rows"))
+
+    def _task7a_rows(self):
+        # The users of the shards are distinct, so the distinct counts add up
+        return self._sum_rows(self._scatter("_task7a_rows"))
+
+    def _task7b_rows(self):
+        return self._concatenate(self._scatter("_task7b_rows"))
+
+    def task8(self, distance=50, time_window=30, use_grid=True):
+        """Finds the number of users that have been close to each other in time and space.
+        Users in different shards are compared too, so the shards are always compared in the
+        spatio-temporal grid, see Part2.task8
+        """
+        print(f"Task 8: Number of users that have been close to each other: "
+              f"{len(self._close_users_grid(distance, time_window))}")
+
+    def _proximity_activities(self):
+        activity_ids, activity_users, activity_bounds = [
+            np.concatenate(columns) for columns in zip(*self._scatter("_proximity_activities"))]
+        # The activity ids are unique across the shards, but only sorted within each of them
+        order = np.argsort(activity_ids, kind="stable")
+        return activity_ids[order], activity_users[order], activity_bounds[order]
+
+    def _proximity_batches(self, batch_size=100000):
+        """Merges the track point streams of the shards, which are each sorted by time, into one stream
+        sorted by time. The streams of the shards are read at the same time by their prefetching threads
+        """
+        streams = [program._proximity_batches(batch_size) for program in self.programs]
+        buffers = [next(stream, None) for stream in streams]
+        while any(buffer is not None for buffer in buffers):
+            # Every shard has sent all its track points up to the last time of the shard that is furthest behind
+            until = min(buffer[3][-1] for buffer in buffers if buffer is not None)
+            merged = []
+            for index, buffer in enumerate(buffers):
+                if buffer is None:
+                    continue
+                end = np.searchsorted(buffer[3], until, side="right")
+                merged.append([column[:end] for column in buffer])
+                buffers[index] = ([column[end:] for column in buffer] if end < len(buffer[3])
+                                  else next(streams[index], None))
+            batch = [np.concatenate(columns) for columns in zip(*merged)]
+            order = np.argsort(batch[3], kind="stable")
+            yield [column[order] for column in batch]
+
+    def _task9_rows(self, use_summary):
+        return self._top(self._scatter("_task9_rows", use_summary), 15)
+
+    def _max_distances_per_mode(self, year):
+        max_distances = {}
+        for shard_max_distances in self._scatter("_max_distances_per_mode", year):
+            for transportation_mode, (user_id, distance) in shard_max_distances.items():
+                current = max_distances.get(transportation_mode)
+                # Ties go to the smallest user id, like within a shard
+                if (current is None or distance > current[1]
+                        or (distance == current[1] and user_id is not None
+                            and (current[0] is None or user_id < current[0]))):
+                    max_distances[transportation_mode] = (user_id, distance)
+        return dict(sorted(max_distances.items()))
+
+    def _task11_rows(self, use_summary):
+        return self._concatenate(self._scatter("_task11_rows", use_summary))
+
+    def _task12_rows(self):
+        return self._concatenate(self._scatter("_task12_rows"))
+
+    def close_connection(self):
+        self.executor.shutdown()
+        self.connection.close_connection()
+
+
+def main():
+    start_time = time.perf_counter()
+    # The database of each shard, like local MySQL servers on different ports
+    shards = [{"port": 3306}, {"port": 3307}]
+    insert = False
+    program = None
+    try:
+        if insert:
+            program = ShardedPart1(shards)
+            program.reset_database()
+            program.create_table_user()
+            program.create_table_activity()
+            program.create_table_activity_summary()
+            program.create_table_track_point(indexes=False)
+            program.create_table_ingest_manifest()
+            program.insert_gps_data(workers=max(os.cpu_count() // len(shards), 1))
+            program.create_track_point_indexes()
+        else:
+            program = ShardedPart2(shards)
+            program.task1()
+            program.task2()
+            program.task3()
+            program.task4()
+            program.task5()
+            program.task6()
+            program.task7a()
+            program.task7b()
+            program.task8()
+            program.task9()
+            program.task10()
+            program.task11()
+            program.task12()
+    except Exception as e:
+        print("ERROR: Failed to use database:", e)
+    finally:
+        if program:
+            program.close_connection()
+
+    end_time = time.perf_counter()
+    print(f"Program took {(end_time - start_time)/60} minutes to run")
+
+
+if __name__ == '__main__':
+    main()
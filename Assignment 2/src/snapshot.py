@@ -0,0 +1,382 @@
+from DbConnector import DbConnector
+from part2 import Part2
+from proximity import ProximityGrid
+from tabulate import tabulate
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.compute as pc
+import numpy as np
+import time
+import os
+
+USER_SCHEMA = pa.schema([("id", pa.string()),
+                         ("has_labels", pa.int8())])
+ACTIVITY_SCHEMA = pa.schema([("id", pa.int64()),
+                             ("user_id", pa.string()),
+                             ("transportation_mode", pa.string()),
+                             ("start_date_time", pa.timestamp("s")),
+                             ("end_date_time", pa.timestamp("s"))])
+TRACK_POINT_SCHEMA = pa.schema([("activity_id", pa.int64()),
+                                ("seq", pa.int32()),
+                                ("lat", pa.float64()),
+                                ("lon", pa.float64()),
+                                ("altitude", pa.int32()),
+                                ("date_time", pa.timestamp("s"))])
+
+
+def export_snapshot(cursor, path, batch_size=100000):
+    """Writes the users, activities and track points in the database to Arrow IPC files, so that the tasks
+    can be answered without the database by SnapshotPart2. The track points are partitioned by user,
+    in path/track_point/user_id=<user id>.arrow, sorted by activity and seq
+
+    Args:
+        cursor: the database cursor
+        path (string): the directory to write the snapshot to
+        batch_size (int): number of rows fetched and written at a time
+    """
+    os.makedirs(f"{path}/track_point", exist_ok=True)
+
+    user_query = """
+    SELECT id, has_labels
+    FROM user
+    ORDER BY id
+    """
+    _export_query(cursor, user_query, None, USER_SCHEMA, f"{path}/user.arrow", batch_size)
+
+    # Dates as seconds since 1970, which converts to timestamps without creating datetime objects
+    activity_query = """
+    SELECT id, user_id, transportation_mode,
+           TIMESTAMPDIFF(SECOND, '1970-01-01', start_date_time),
+           TIMESTAMPDIFF(SECOND, '1970-01-01', end_date_time)
+    FROM activity
+    ORDER BY id
+    """
+    _export_query(cursor, activity_query, None, ACTIVITY_SCHEMA, f"{path}/activity.arrow", batch_size)
+
+    cursor.execute("SELECT id FROM user ORDER BY id")
+    user_ids = [row[0] for row in cursor.fetchall()]
+    track_point_query = """
+    SELECT track_point.activity_id, seq, lat, lon, altitude, TIMESTAMPDIFF(SECOND, '1970-01-01', date_time)
+    FROM activity
+    INNER JOIN track_point
+    ON activity.id = track_point.activity_id
+    WHERE user_id = %(user_id)s
+    ORDER BY track_point.activity_id, seq
+    """
+    for user_id in user_ids:
+        print(f"Exporting track points of user {user_id}")
+        _export_query(cursor, track_point_query, {"user_id": user_id}, TRACK_POINT_SCHEMA,
+                      f"{path}/track_point/user_id={user_id}.arrow", batch_size)
+
+
+def _export_query(cursor, query, params, schema, file_path, batch_size):
+    """Streams the rows of a query into an Arrow IPC file, a record batch at a time
+    """
+    cursor.execute(query, params)
+    with ipc.new_file(file_path, schema) as writer:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            columns = []
+            for column, field in zip(zip(*rows), schema):
+                if pa.types.is_timestamp(field.type):
+                    column = np.array(column, dtype=np.int64).astype("datetime64[s]")
+                columns.append(pa.array(column, type=field.type))
+            writer.write_batch(pa.record_batch(columns, schema=schema))
+
+
+def _read_table(file_path):
+    """Memory-maps an Arrow IPC file, so that its columns are only read from disk when they are used
+
+    Returns:
+        pa.Table: the table
+    """
+    return ipc.open_file(pa.memory_map(file_path, "r")).read_all()
+
+
+class Snapshot:
+    """
+    A snapshot written by export_snapshot, with memory-mapped tables
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (string): the directory of the snapshot
+        """
+        self.path = path
+        self.users = _read_table(f"{path}/user.arrow")
+        self.activities = _read_table(f"{path}/activity.arrow")
+
+    def track_point_partitions(self):
+        """Reads the track points one user at a time
+
+        Yields:
+            tuple[string, pa.Table]: the user id and the track points of the user, sorted by activity and seq
+        """
+        for user_id in self.users["id"].to_pylist():
+            file_path = f"{self.path}/track_point/user_id={user_id}.arrow"
+            if os.path.exists(file_path):
+                yield user_id, _read_table(file_path)
+
+    def track_points(self, columns=None):
+        """Reads the track points of all users
+
+        Args:
+            columns (list[string]): the columns to read, all by default
+
+        Returns:
+            pa.Table: the track points, sorted by user, activity and seq
+        """
+        tables = [table.select(columns) if columns else table for _, table in self.track_point_partitions()]
+        if not tables:
+            return TRACK_POINT_SCHEMA.empty_table().select(columns) if columns else TRACK_POINT_SCHEMA.empty_table()
+        return pa.concat_tables(tables)
+
+
+class SnapshotPart2(Part2):
+    """
+    Answers the Part2 tasks from a snapshot written by export_snapshot instead of the database.
+    The tasks scan the columns of the snapshot with NumPy and Arrow compute functions, one user
+    at a time where the task allows it
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (string): the directory of the snapshot
+        """
+        self.snapshot = Snapshot(path)
+
+    def task1(self):
+        track_point_count = sum(table.num_rows for _, table in self.snapshot.track_point_partitions())
+        rows = [(self.snapshot.users.num_rows, self.snapshot.activities.num_rows, track_point_count)]
+        print("Task 1: Number of users, activities and trackpoints in the database:")
+        print(tabulate(rows, headers=("user_count", "activity_count", "trackpoint_count")))
+
+    def task2(self):
+        # Only users with trackpoints, like the inner join of the query
+        counts = [table.num_rows for _, table in self.snapshot.track_point_partitions() if table.num_rows > 0]
+        rows = [(np.mean(counts), np.min(counts), np.max(counts))] if counts else [(None, None, None)]
+        print("Task 2: Average, minimum and maximum number of trackpoints logged by the users:")
+        print(tabulate(rows, headers=("average_count", "minimum_count", "maximum_count")))
+
+    def task3(self):
+        counts = self.snapshot.activities.group_by("user_id").aggregate([("id", "count")])
+        counts = counts.sort_by([("id_count", "descending"), ("user_id", "ascending")]).slice(0, 15)
+        print("Task 3: Top 15 users with the most activities logged:")
+        print(tabulate(self._rows(counts), headers=("user_id", "activity_count")))
+
+    def task4(self):
+        activities = self.snapshot.activities
+        bus_activities = activities.filter(pc.equal(activities["transportation_mode"], "bus"))
+        rows = [(user_id,) for user_id in pc.unique(bus_activities["user_id"]).to_pylist()]
+        print("Task 4: Users that have logged taking the bus:")
+        print(tabulate(rows, headers=("user_id",)))
+
+    def task5(self):
+        # count_distinct leaves out null transportation modes, like COUNT(DISTINCT ...)
+        counts = self.snapshot.activities.group_by("user_id").aggregate([("transportation_mode", "count_distinct")])
+        counts = counts.sort_by([("transportation_mode_count_distinct", "descending"),
+                                 ("user_id", "ascending")]).slice(0, 10)
+        print("Task 5: Top 10 users with most types of different transportation modes:")
+        print(tabulate(self._rows(counts), headers=("user_id", "transportation_count")))
+
+    def task6(self):
+        keys = ["user_id", "transportation_mode", "start_date_time", "end_date_time"]
+        counts = self.snapshot.activities.group_by(keys).aggregate([("id", "count")])
+        duplicates = counts.filter(pc.greater(counts["id_count"], 1)).select(keys)
+        print("Task 6: Activities that are logged twice:")
+        print(tabulate(self._rows(duplicates), headers=keys))
+
+    def task7a(self):
+        next_day_activities = self._next_day_activities()
+        rows = [(len(pc.unique(next_day_activities["user_id"])),)]
+        print("Task 7a: Number of users with activities that end the next day:")
+        print(tabulate(rows, headers=("COUNT(DISTINCT user_id)",)))
+
+    def task7b(self):
+        next_day_activities = self._next_day_activities()
+        durations = pc.subtract(next_day_activities["end_date_time"], next_day_activities["start_date_time"])
+        rows = zip(next_day_activities["id"].to_pylist(), next_day_activities["user_id"].to_pylist(),
+                   next_day_activities["transportation_mode"].to_pylist(), durations.to_pylist())
+        print("Task 7b: Activities that end the next day:")
+        print(tabulate(list(rows), headers=("id", "user_id", "transportation_mode", "duration")))
+
+    def _next_day_activities(self):
+        """
+        Returns:
+            pa.Table: the activities ending on the date after they start
+        """
+        activities = self.snapshot.activities
+        start_dates = activities["start_date_time"].to_numpy().astype("datetime64[D]")
+        end_dates = activities["end_date_time"].to_numpy().astype("datetime64[D]")
+        return activities.filter(pa.array((end_dates - start_dates) == np.timedelta64(1, "D")))
+
+    def task8(self, distance=50, time_window=30, use_grid=True):
+        """Finds the number of users that have been close to each other in time and space.
+        The snapshot is always compared in the spatio-temporal grid, see Part2.task8
+        """
+        print(f"Task 8: Number of users that have been close to each other: "
+              f"{len(self._close_users_grid(distance, time_window))}")
+
+    def _close_users_grid(self, distance, time_window):
+        activities = self.snapshot.activities
+        activity_ids = activities["id"].to_numpy()
+        user_ids, activity_user_codes = np.unique(activities["user_id"].to_numpy(zero_copy_only=False),
+                                                  return_inverse=True)
+        track_points = self.snapshot.track_points(["activity_id", "lat", "lon", "date_time"])
+
+        # Bounding box and time span of each activity, like in Part2._close_users_grid
+        bounds = track_points.group_by("activity_id").aggregate([("lat", "min"), ("lat", "max"),
+                                                                 ("lon", "min"), ("lon", "max")])
+        bounded = np.searchsorted(activity_ids, bounds["activity_id"].to_numpy())
+        activity_bounds = np.zeros((len(activity_ids), 6))
+        for i, column in enumerate(["lat_min", "lat_max", "lon_min", "lon_max"]):
+            activity_bounds[bounded, i] = bounds[column].to_numpy()
+        activity_bounds[:, 4] = activities["start_date_time"].to_numpy().astype(np.int64)
+        activity_bounds[:, 5] = activities["end_date_time"].to_numpy().astype(np.int64)
+
+        point_activities = np.searchsorted(activity_ids, track_points["activity_id"].to_numpy())
+        grid = ProximityGrid(distance, time_window)
+        close_user_codes = grid.close_users(activity_user_codes[point_activities],
+                                            track_points["lat"].to_numpy(),
+                                            track_points["lon"].to_numpy(),
+                                            track_points["date_time"].to_numpy().astype(np.int64),
+                                            point_activities, activity_bounds)
+        return {user_ids[code] for code in close_user_codes}
+
+    def task9(self, use_summary=True):
+        """Finds the top 15 users with the highest total altitude gained, one user at a time
+        """
+        rows = []
+        for user_id, table in self.snapshot.track_point_partitions():
+            table = table.filter(pc.not_equal(table["altitude"], -777))
+            activities = table["activity_id"].to_numpy()
+            altitudes = table["altitude"].to_numpy().astype(np.int64)
+            # Consecutive valid altitudes of the same activity, like the query
+            same_activity = activities[1:] == activities[:-1]
+            if not same_activity.any():
+                continue
+            gains = np.diff(altitudes)[same_activity]
+            rows.append((user_id, float(gains[gains > 0].sum() * 0.3048)))
+
+        rows.sort(key=lambda row: row[1], reverse=True)
+        print("Task 9: Top 15 users with the highest total altitude gained:")
+        print(tabulate(rows[:15], headers=("user_id", "total_gained_altitude")))
+
+    def task10(self, year=None):
+        """Finds the user with the longest distance traveled on a single date per transportation mode,
+        see Part2.task10
+        """
+        activities = self.snapshot.activities
+        labeled = activities.filter(pc.is_valid(activities["transportation_mode"]))
+        if year:
+            start_years = labeled["start_date_time"].to_numpy().astype("datetime64[Y]").astype(np.int64) + 1970
+            end_years = labeled["end_date_time"].to_numpy().astype("datetime64[Y]").astype(np.int64) + 1970
+            labeled = labeled.filter(pa.array((start_years <= year) & (end_years >= year)))
+        activity_ids = labeled["id"].to_numpy()
+        user_ids, activity_users = np.unique(labeled["user_id"].to_numpy(zero_copy_only=False),
+                                             return_inverse=True)
+        user_ids = user_ids.tolist()
+        transportation_modes, activity_modes = np.unique(
+            labeled["transportation_mode"].to_numpy(zero_copy_only=False), return_inverse=True)
+        transportation_modes = transportation_modes.tolist()
+
+        daily_distances = {}
+        for _, table in self.snapshot.track_point_partitions():
+            track_point_activities = table["activity_id"].to_numpy()
+            is_labeled = np.isin(track_point_activities, activity_ids)
+            if year:
+                years = table["date_time"].to_numpy().astype("datetime64[Y]").astype(np.int64) + 1970
+                is_labeled &= years == year
+            if not is_labeled.any():
+                continue
+            self._add_daily_distances(daily_distances,
+                                      *self._segment_distances(activity_ids, activity_users, activity_modes,
+                                                               track_point_activities[is_labeled],
+                                                               table["lat"].to_numpy()[is_labeled],
+                                                               table["lon"].to_numpy()[is_labeled],
+                                                               table["date_time"].to_numpy().astype(np.int64)[is_labeled]))
+
+        max_distances = self._max_daily_distances(daily_distances, user_ids, transportation_modes)
+        print(f"Task 10: Users with the longest distance traveled per transportation mode{f' in {year}' if year else ''}:")
+        for transportation_mode, (user_id, distance) in max_distances.items():
+            print(f"Transportation mode {transportation_mode}: user: {user_id}, distance: {distance:.2f} km")
+
+    def task11(self, use_summary=True):
+        """Finds the number of invalid activities per user, one user at a time. An activity is invalid
+        if two consecutive trackpoints are at least 5 minutes apart
+        """
+        rows = []
+        for user_id, table in self.snapshot.track_point_partitions():
+            activities = table["activity_id"].to_numpy()
+            times = table["date_time"].to_numpy().astype(np.int64)
+            gaps = (activities[1:] == activities[:-1]) & (np.abs(np.diff(times)) >= 5 * 60)
+            invalid_activity_count = len(np.unique(activities[1:][gaps]))
+            if invalid_activity_count:
+                rows.append((user_id, invalid_activity_count))
+
+        print("Task 11: Users with invalid activities:")
+        print(tabulate(rows, headers=("user_id", "invalid_activity_count")))
+
+    def task12(self):
+        activities = self.snapshot.activities
+        labeled = activities.filter(pc.is_valid(activities["transportation_mode"]))
+        counts = labeled.group_by(["user_id", "transportation_mode"]).aggregate([("id", "count")])
+        counts = counts.sort_by([("user_id", "ascending"), ("id_count", "descending"),
+                                 ("transportation_mode", "ascending")])
+        # The first row of each user has the highest count
+        user_ids = counts["user_id"].to_pylist()
+        rows = [(user_id, transportation_mode)
+                for i, (user_id, transportation_mode) in enumerate(zip(user_ids, counts["transportation_mode"].to_pylist()))
+                if i == 0 or user_ids[i - 1] != user_id]
+        print("Task 12: Most used transportation mode per user:")
+        print(tabulate(rows, headers=("user_id", "transportation_mode")))
+
+    def _rows(self, table):
+        """
+        Returns:
+            list[tuple]: the rows of the table
+        """
+        return list(zip(*[column.to_pylist() for column in table.columns]))
+
+
+def main():
+    start_time = time.perf_counter()
+    # Write the snapshot from the database, instead of answering the tasks from it
+    export = False
+    path = "./snapshot"
+    if export:
+        connection = None
+        try:
+            connection = DbConnector()
+            export_snapshot(connection.cursor, path)
+        except Exception as e:
+            print("ERROR: Failed to use database:", e)
+        finally:
+            if connection:
+                connection.close_connection()
+    else:
+        program = SnapshotPart2(path)
+        program.task1()
+        program.task2()
+        program.task3()
+        program.task4()
+        program.task5()
+        program.task6()
+        program.task7a()
+        program.task7b()
+        program.task8()
+        program.task9()
+        program.task10()
+        program.task11()
+        program.task12()
+
+    end_time = time.perf_counter()
+    print(f"Program took {(end_time - start_time)/60} minutes to run")
+
+
+if __name__ == '__main__':
+    main()
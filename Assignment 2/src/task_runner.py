@@ -0,0 +1,191 @@
+from DbConnector import DbConnectionPool
+from part2 import Part2
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import threading
+import json
+import time
+import sys
+import io
+import re
+
+
+class CountingCursor:
+    """
+    Wraps a cursor and counts the rows fetched through it
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.rows = 0
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self.rows += 1
+        return row
+
+    def fetchmany(self, size=1):
+        rows = self.cursor.fetchmany(size)
+        self.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.rows += len(rows)
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class ThreadOutput(io.TextIOBase):
+    """
+    Replaces sys.stdout while tasks run concurrently, so that the output of each task is collected
+    separately and printed in one piece when the task is done
+    """
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def capture(self):
+        """Starts collecting the output of the current thread
+        """
+        self.local.buffer = io.StringIO()
+
+    def release(self):
+        """Stops collecting the output of the current thread
+
+        Returns:
+            string: the collected output
+        """
+        output = self.local.buffer.getvalue()
+        self.local.buffer = None
+        return output
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            return self.stdout.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        self.stdout.flush()
+
+
+def task_names():
+    """
+    Returns:
+        list[string]: the tasks of Part2, in numerical order (task10 after task9)
+    """
+    names = [name for name in dir(Part2) if re.fullmatch(r"task\d+\w*", name)]
+    return sorted(names, key=lambda name: (int(re.search(r"\d+", name).group()), name))
+
+
+def bytes_sent(cursor):
+    """
+    Args:
+        cursor: a cursor of the connection
+
+    Returns:
+        int: the number of bytes the server has sent over the connection
+    """
+    cursor.execute("SHOW SESSION STATUS LIKE 'Bytes_sent'")
+    return int(cursor.fetchone()[1])
+
+
+def run_task(pool, output, name):
+    """Runs a task on a connection borrowed from the pool
+
+    Args:
+        pool (DbConnectionPool): the connection pool
+        output (ThreadOutput): collects the output of the task
+        name (string): the task
+
+    Returns:
+        dict: the report of the task
+    """
+    connector = pool.get_connector()
+    # Counted separately, so the status queries do not count as rows of the task
+    status_cursor = connector.db_connection.cursor()
+    connector.cursor = CountingCursor(connector.cursor)
+    report = {"task": name}
+    output.capture()
+    try:
+        bytes_before = bytes_sent(status_cursor)
+        start_time = time.perf_counter()
+        getattr(Part2(connector), name)()
+        report["seconds"] = time.perf_counter() - start_time
+        report["rows"] = connector.cursor.rows
+        report["bytes"] = bytes_sent(status_cursor) - bytes_before
+    except Exception as e:
+        print("ERROR: Failed to use database:", e)
+        report["error"] = str(e)
+    finally:
+        report["output"] = output.release()
+        status_cursor.close()
+        connector.cursor = connector.cursor.cursor
+        connector.close_connection()
+
+    return report
+
+
+def run_tasks(names, connections=4):
+    """Runs the tasks concurrently, each on its own connection from a pool of connections.
+    The output of each task is printed when it is done
+
+    Args:
+        names (list[string]): the tasks
+        connections (int): the number of connections, and so the number of tasks running at once
+
+    Returns:
+        dict: the total wall time, and the wall time, rows fetched and bytes sent by the server
+        of each task, in the given order
+    """
+    pool = DbConnectionPool(SIZE=connections)
+    output = ThreadOutput(sys.stdout)
+    sys.stdout = output
+    start_time = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            futures = [executor.submit(run_task, pool, output, name) for name in names]
+            reports = []
+            for future in futures:
+                report = future.result()
+                output.stdout.write(report.pop("output"))
+                reports.append(report)
+    finally:
+        sys.stdout = output.stdout
+
+    return {"seconds": time.perf_counter() - start_time, "tasks": reports}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the tasks of part 2 concurrently")
+    parser.add_argument("tasks", nargs="*", help=f"the tasks to run, all by default: {' '.join(task_names())}")
+    parser.add_argument("--connections", type=int, default=4, help="number of tasks running at once")
+    parser.add_argument("--report", help="write the timing report as JSON to this file")
+    args = parser.parse_args()
+
+    names = args.tasks or task_names()
+    unknown = set(names) - set(task_names())
+    if unknown:
+        parser.error(f"unknown tasks: {' '.join(sorted(unknown))}")
+
+    report = run_tasks(names, args.connections)
+    for task_report in report["tasks"]:
+        if "error" in task_report:
+            print(f"{task_report['task']}: failed: {task_report['error']}")
+        else:
+            print(f"{task_report['task']}: {task_report['seconds']:.2f} s, {task_report['rows']} rows, "
+                  f"{task_report['bytes']} bytes")
+    print(f"All tasks took {report['seconds']:.2f} s")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+from collections import OrderedDict
+import numpy as np
+
+
+class TrackPointCache:
+    """
+    Least recently used cache of the track points of activities as NumPy arrays, so that an activity
+    read by many comparisons or tasks is only fetched and decoded once. The cached arrays never take up
+    more than max_bytes: the least recently used activities are evicted as new ones are fetched.
+    """
+
+    def __init__(self, cursor, max_bytes=512 * 1024 ** 2, batch_size=100000, ids_per_query=1000):
+        """
+        Args:
+            cursor: the database cursor used to fetch track points
+            max_bytes (int): memory budget of the cached arrays
+            batch_size (int): number of rows fetched at a time
+            ids_per_query (int): maximum number of activities fetched by one query
+        """
+        self.cursor = cursor
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.ids_per_query = ids_per_query
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        # Activity id -> (lats, lons, times), from least to most recently used
+        self.activities = OrderedDict()
+
+    def get(self, activity_id):
+        """Fetches the track points of an activity
+
+        Args:
+            activity_id (int): the activity id
+
+        Returns:
+            tuple[np.ndarray]: lat, lon and time in seconds since 1970 of the track points, in insertion order
+        """
+        return self.get_many([activity_id])[activity_id]
+
+    def get_many(self, activity_ids):
+        """Fetches the track points of several activities, with one query per ids_per_query activities
+        not in the cache. The fetched activities are cached until the requested activities no longer fit
+        in the budget, and the rest are returned without caching them. A request larger than the budget
+        then does not evict the whole cache only to evict its own first activities again
+
+        Args:
+            activity_ids (list[int]): the activity ids
+
+        Returns:
+            dict[int, tuple[np.ndarray]]: lat, lon and time in seconds since 1970 of the track points
+            of each activity, in insertion order
+        """
+        result = {}
+        missing = []
+        for activity_id in dict.fromkeys(activity_ids):
+            if activity_id in self.activities:
+                self.activities.move_to_end(activity_id)
+                result[activity_id] = self.activities[activity_id]
+            else:
+                missing.append(activity_id)
+        self.misses += len(missing)
+        self.hits += len(result)
+
+        requested_bytes = sum(self._size(columns) for columns in result.values())
+        for start in range(0, len(missing), self.ids_per_query):
+            for activity_id, columns in self._fetch(missing[start:start + self.ids_per_query]):
+                result[activity_id] = columns
+                requested_bytes += self._size(columns)
+                if requested_bytes <= self.max_bytes:
+                    self._store(activity_id, columns)
+
+        return result
+
+    def clear(self):
+        """Empties the cache
+        """
+        self.activities.clear()
+        self.bytes = 0
+
+    def _size(self, columns):
+        return sum(column.nbytes for column in columns)
+
+    def _store(self, activity_id, columns):
+        """Caches the track points of an activity, after evicting the least recently used activities
+        until they fit in the budget
+        """
+        size = self._size(columns)
+        while self.activities and self.bytes + size > self.max_bytes:
+            _, evicted = self.activities.popitem(last=False)
+            self.bytes -= self._size(evicted)
+        self.activities[activity_id] = columns
+        self.bytes += size
+
+    def _fetch(self, activity_ids):
+        """Fetches the track points of activities with one query
+
+        Yields:
+            tuple: the activity id and the lat, lon and time in seconds since 1970 of its track points,
+            for each activity
+        """
+        query = f"""
+        SELECT activity_id, lat, lon, TIMESTAMPDIFF(SECOND, '1970-01-01', date_time)
+        FROM track_point
+        WHERE activity_id IN ({", ".join(["%s"] * len(activity_ids))})
+        ORDER BY activity_id, seq
+        """
+        self.cursor.execute(query, tuple(activity_ids))
+        # Converted to arrays a batch at a time, so all rows are never held as tuples at once
+        dtypes = [np.int64, np.float64, np.float64, np.int64]
+        chunks = [[] for _ in dtypes]
+        while True:
+            rows = self.cursor.fetchmany(self.batch_size)
+            if not rows:
+                break
+            for chunk, column, dtype in zip(chunks, zip(*rows), dtypes):
+                chunk.append(np.array(column, dtype=dtype))
+        fetched_ids, lats, lons, times = [np.concatenate(chunk) if chunk else np.empty(0, dtype=dtype)
+                                          for chunk, dtype in zip(chunks, dtypes)]
+
+        # The rows are sorted by activity, so each activity is a contiguous slice
+        for activity_id in activity_ids:
+            start, end = np.searchsorted(fetched_ids, [activity_id, activity_id + 1])
+            # Copied, so that the arrays of the whole query are freed once every activity is taken out
+            yield activity_id, (lats[start:end].copy(), lons[start:end].copy(), times[start:end].copy())
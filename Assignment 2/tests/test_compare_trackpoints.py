@@ -0,0 +1,115 @@
+"""
+Checks that the time-sorted sweep of Part2._compare_trackpoints gives the same result as the original
+comparison of the full distance matrix of two activities, with track points exactly at the distance and
+time window, and with the window split across several chunks.
+
+Run from the repository root:
+python -m unittest discover -s "Assignment 2/tests"
+"""
+import unittest
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from DbConnector import SqliteDbConnector
+from part2 import Part2
+from proximity import EARTH_RADIUS
+from haversine import Unit, haversine_vector
+import numpy as np
+
+DISTANCE = 50
+TIME_WINDOW = 30
+METERS_PER_DEGREE = EARTH_RADIUS * np.pi / 180
+
+
+def matrix_close(trackpoints1, trackpoints2, distance, time_window):
+    """The original comparison: every distance between the two activities, then the time of the close pairs
+
+    Returns:
+        bool: true if the activities have a pair of track points within the distance and time window
+    """
+    lats1, lons1, times1 = trackpoints1
+    lats2, lons2, times2 = trackpoints2
+    if len(lats1) == 0 or len(lats2) == 0:
+        return False
+    distances = haversine_vector(np.column_stack((lats1, lons1)), np.column_stack((lats2, lons2)), Unit.METERS,
+                                 comb=True)
+    # The rows are the track points of the second activity, the columns those of the first
+    rows, columns = np.where(distances <= distance)
+    return bool(np.any(np.abs(times1[columns] - times2[rows]) <= time_window))
+
+
+def trackpoints(lats, lons, times):
+    return np.array(lats, dtype=np.float64), np.array(lons, dtype=np.float64), np.array(times, dtype=np.int64)
+
+
+class CompareTrackpointsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.program = Part2(SqliteDbConnector(PATH=":memory:"))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.program.connection.close_connection()
+
+    def assert_same_as_matrix(self, trackpoints1, trackpoints2, distance=DISTANCE, time_window=TIME_WINDOW):
+        expected = matrix_close(trackpoints1, trackpoints2, distance, time_window)
+        # Down to a single distance per chunk, so that windows are split across chunks
+        for max_pairs in (100000, 3, 1):
+            self.assertEqual(self.program._compare_trackpoints(trackpoints1, trackpoints2, distance, time_window,
+                                                               max_pairs), expected)
+            self.assertEqual(self.program._compare_trackpoints(trackpoints2, trackpoints1, distance, time_window,
+                                                               max_pairs), expected)
+        return expected
+
+    def test_exactly_at_distance(self):
+        lat, lon = 39.9842, 116.3185
+        other_lat = lat + DISTANCE / METERS_PER_DEGREE
+        # The distance of the two points as computed by haversine, so that they are exactly at it
+        distance = haversine_vector([(lat, lon)], [(other_lat, lon)], Unit.METERS)[0]
+        first = trackpoints([lat], [lon], [1000])
+        second = trackpoints([other_lat], [lon], [1000])
+        self.assertTrue(self.assert_same_as_matrix(first, second, distance=distance))
+        self.assertFalse(self.assert_same_as_matrix(first, second, distance=np.nextafter(distance, 0)))
+
+    def test_exactly_at_time_window(self):
+        first = trackpoints([39.9842] * 2, [116.3185] * 2, [1000, 2000])
+        self.assertTrue(self.assert_same_as_matrix(first, trackpoints([39.9842], [116.3185], [1000 + TIME_WINDOW])))
+        self.assertTrue(self.assert_same_as_matrix(first, trackpoints([39.9842], [116.3185], [2000 - TIME_WINDOW])))
+        self.assertFalse(self.assert_same_as_matrix(first, trackpoints([39.9842], [116.3185],
+                                                                       [1000 + TIME_WINDOW + 1])))
+
+    def test_close_in_time_only_when_far(self):
+        # Close in space at a time just beyond the window, and in time only when far apart
+        first = trackpoints([39.9842, 39.9842], [116.3185, 116.3185], [1000, 1100])
+        second = trackpoints([39.9842, 39.99], [116.3185, 116.3185], [1000 + TIME_WINDOW + 1, 1100])
+        self.assertFalse(self.assert_same_as_matrix(first, second))
+
+    def test_unsorted_times(self):
+        # Recorded order is not always time order, the sweep sorts both activities first
+        first = trackpoints([39.98, 39.99, 39.9842], [116.3, 116.3, 116.3185], [1500, 1000, 1200])
+        second = trackpoints([39.9842, 39.97], [116.3185, 116.3], [1200 + TIME_WINDOW, 900])
+        self.assertTrue(self.assert_same_as_matrix(first, second))
+
+    def test_empty_activity(self):
+        self.assertFalse(self.assert_same_as_matrix(trackpoints([], [], []),
+                                                    trackpoints([39.9842], [116.3185], [1000])))
+
+    def test_random_activities(self):
+        random = np.random.default_rng(0)
+        results = []
+        for _ in range(50):
+            activities = []
+            for count in random.integers(1, 60, 2):
+                lats = 39.9842 + random.uniform(0, 10 * DISTANCE, count) / METERS_PER_DEGREE
+                lons = 116.3185 + random.uniform(0, 10 * DISTANCE, count) / METERS_PER_DEGREE
+                activities.append(trackpoints(lats, lons, random.integers(0, 20 * TIME_WINDOW, count)))
+            results.append(self.assert_same_as_matrix(*activities))
+        # Both outcomes are covered
+        self.assertTrue(any(results) and not all(results))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Checks that ProximityGrid finds the same close users as comparing every pair of track points, like the
+original task 8, with points on cell edges and exactly at the distance and time window.
+
+Run from the repository root:
+python -m unittest discover -s "Assignment 2/tests"
+"""
+import unittest
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from proximity import ProximityGrid, EARTH_RADIUS
+from haversine import Unit, haversine_vector
+import numpy as np
+
+DISTANCE = 50
+TIME_WINDOW = 30
+METERS_PER_DEGREE = EARTH_RADIUS * np.pi / 180
+
+
+def pairwise_close_user_pairs(users, lats, lons, timestamps, distance, time_window):
+    """
+    Returns:
+        set[tuple]: the pairs of users with a pair of points within the distance and time window,
+        found by comparing every pair of points
+    """
+    first, second = np.triu_indices(len(users), 1)
+    distances = haversine_vector(np.column_stack((lats[first], lons[first])),
+                                 np.column_stack((lats[second], lons[second])), Unit.METERS)
+    close = ((users[first] != users[second]) & (np.abs(timestamps[first] - timestamps[second]) <= time_window)
+             & (distances <= distance))
+    return {tuple(sorted(pair)) for pair in zip(users[first[close]].tolist(), users[second[close]].tolist())}
+
+
+class ProximityGridTest(unittest.TestCase):
+
+    def assert_same_as_pairwise(self, users, lats, lons, timestamps, distance=DISTANCE, time_window=TIME_WINDOW):
+        users, lats, lons, timestamps = np.array(users), np.array(lats), np.array(lons), np.array(timestamps)
+        expected = pairwise_close_user_pairs(users, lats, lons, timestamps, distance, time_window)
+        grid = ProximityGrid(distance, time_window)
+        self.assertEqual(grid.close_user_pairs(users, lats, lons, timestamps), expected)
+        return expected
+
+    def test_exactly_at_distance(self):
+        lat, lon = 39.9842, 116.3185
+        other_lat = lat + DISTANCE / METERS_PER_DEGREE
+        # The distance of the two points as computed by haversine, so that they are exactly at it
+        distance = haversine_vector([(lat, lon)], [(other_lat, lon)], Unit.METERS)[0]
+        points = (["a", "b"], [lat, other_lat], [lon, lon], [0, 0])
+        self.assertEqual(self.assert_same_as_pairwise(*points, distance=distance), {("a", "b")})
+        self.assertEqual(self.assert_same_as_pairwise(*points, distance=np.nextafter(distance, 0)), set())
+
+    def test_exactly_at_time_window(self):
+        self.assertEqual(self.assert_same_as_pairwise(["a", "b"], [39.9842] * 2, [116.3185] * 2,
+                                                      [1000, 1000 + TIME_WINDOW]), {("a", "b")})
+        self.assertEqual(self.assert_same_as_pairwise(["a", "b"], [39.9842] * 2, [116.3185] * 2,
+                                                      [1000, 1000 + TIME_WINDOW + 1]), set())
+
+    def test_cell_edges(self):
+        # The cell size of the grid for these points, see ProximityGrid._build_cells
+        lat_cell = DISTANCE * 1.001 / METERS_PER_DEGREE
+        edge_lat = np.floor(40.0 / lat_cell) * lat_cell
+        # The width of the cells depends on the largest latitude, which is edge_lat
+        lon_cell = DISTANCE * 1.001 / (METERS_PER_DEGREE * np.cos(np.radians(edge_lat)))
+        edge_lon = np.floor(116.3 / lon_cell) * lon_cell
+        edge_time = 1224730384 // TIME_WINDOW * TIME_WINDOW
+        # a and b are close, on both sides of a cell edge in latitude, longitude and time.
+        # c and d are on both sides of the same edges, but too far apart
+        lats = [edge_lat, edge_lat - 10 / METERS_PER_DEGREE, edge_lat, edge_lat - 60 / METERS_PER_DEGREE]
+        lons = [edge_lon, edge_lon - 10 / METERS_PER_DEGREE, edge_lon, edge_lon]
+        times = [edge_time, edge_time - 1, edge_time + 5000, edge_time + 5000 - 1]
+        self.assertEqual(self.assert_same_as_pairwise(["a", "b", "c", "d"], lats, lons, times), {("a", "b")})
+
+        # At the same place, on both sides of a cell edge in time, exactly at or just beyond the time window
+        times = [edge_time, edge_time - TIME_WINDOW, edge_time, edge_time - TIME_WINDOW - 1]
+        self.assertEqual(self.assert_same_as_pairwise(["a", "b", "c", "d"], [edge_lat] * 4, [edge_lon] * 4, times),
+                         {("a", "b"), ("a", "c"), ("b", "c"), ("b", "d")})
+
+    def test_random_points(self):
+        random = np.random.default_rng(0)
+        for _ in range(20):
+            count = 200
+            # Spread over a few cells in every direction, so that many pairs are near the distance,
+            # the time window and the cell edges
+            users = random.choice(["a", "b", "c", "d", "e"], count)
+            lats = 39.9842 + random.uniform(0, 4 * DISTANCE, count) / METERS_PER_DEGREE
+            lons = 116.3185 + random.uniform(0, 4 * DISTANCE, count) / METERS_PER_DEGREE
+            timestamps = 1224730384 + random.integers(0, 4 * TIME_WINDOW, count)
+            self.assert_same_as_pairwise(users, lats, lons, timestamps, distance=DISTANCE / 4)
+
+    def test_no_points(self):
+        self.assertEqual(ProximityGrid().close_user_pairs(np.array([]), np.array([]), np.array([]), np.array([])),
+                         set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+"""
+Checks the translation of the MySQL queries of Part1 and Part2 to SQLite by SqliteCursor, both the translated
+statements and running them on an in-memory database.
+
+Run from the repository root:
+python -m unittest discover -s "Assignment 2/tests"
+"""
+import unittest
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from DbConnector import SqliteDbConnector, _translate_query
+
+
+class TranslateQueryTest(unittest.TestCase):
+
+    def test_placeholders(self):
+        self.assertEqual(_translate_query("SELECT * FROM user WHERE id = %s AND has_labels = %s"),
+                         ["SELECT * FROM user WHERE id = ? AND has_labels = ?"])
+        self.assertEqual(_translate_query("SELECT * FROM activity WHERE user_id = %(user_id1)s;"),
+                         ["SELECT * FROM activity WHERE user_id = :user_id1"])
+
+    def test_on_duplicate_key_update(self):
+        query = """
+        INSERT INTO ingest_manifest (path, size) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE size = VALUES(size), activity_id = VALUES(activity_id)
+        """
+        self.assertEqual(_translate_query(query),
+                         ["INSERT INTO ingest_manifest (path, size) VALUES (?, ?)\n        "
+                          "ON CONFLICT DO UPDATE SET size = excluded.size, activity_id = excluded.activity_id"])
+
+    def test_create_table_with_indexes(self):
+        query = """
+        CREATE TABLE IF NOT EXISTS track_point (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            activity_id INT NOT NULL,
+            seq INT NOT NULL,
+            INDEX track_point_activity_seq (activity_id, seq),
+            INDEX track_point_activity_id (activity_id)
+        );
+        """
+        table, *indexes = _translate_query(query)
+        self.assertIn("id INTEGER PRIMARY KEY,", table)
+        self.assertNotIn("INDEX", table)
+        self.assertTrue(table.rstrip().endswith("seq INT NOT NULL\n        )"))
+        self.assertEqual(indexes, [
+            "CREATE INDEX IF NOT EXISTS track_point_activity_seq ON track_point (activity_id, seq)",
+            "CREATE INDEX IF NOT EXISTS track_point_activity_id ON track_point (activity_id)",
+        ])
+
+    def test_alter_table(self):
+        query = """
+        ALTER TABLE track_point
+        ADD INDEX track_point_activity_seq (activity_id, seq),
+        DROP INDEX track_point_activity_id,
+        ADD FOREIGN KEY (activity_id) REFERENCES activity(id) ON DELETE CASCADE
+        """
+        # SQLite cannot add a foreign key to an existing table
+        self.assertEqual(_translate_query(query), [
+            "CREATE INDEX IF NOT EXISTS track_point_activity_seq ON track_point (activity_id, seq)",
+            "DROP INDEX IF EXISTS track_point_activity_id",
+        ])
+        self.assertEqual(_translate_query("ALTER TABLE track_point ADD COLUMN seq INT NOT NULL DEFAULT 0 AFTER id"),
+                         ["ALTER TABLE track_point ADD COLUMN seq INT NOT NULL DEFAULT 0"])
+
+    def test_show_tables(self):
+        self.assertEqual(_translate_query("SHOW TABLES"),
+                         ["SELECT name AS Tables FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"])
+
+    def test_foreign_key_checks(self):
+        self.assertEqual(_translate_query("SET foreign_key_checks = 0"), ["PRAGMA foreign_keys = OFF"])
+        self.assertEqual(_translate_query("SET foreign_key_checks = 1"), ["PRAGMA foreign_keys = ON"])
+
+    def test_update_join(self):
+        query = """
+        UPDATE track_point
+        INNER JOIN numbered
+        ON track_point.id = numbered.id
+        SET track_point.seq = numbered.seq
+        """
+        with self.assertRaisesRegex(ValueError, "UPDATE ... JOIN"):
+            _translate_query(query)
+
+
+class SqliteCursorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = SqliteDbConnector(PATH=":memory:")
+        self.cursor = self.connection.cursor
+
+    def tearDown(self):
+        self.connection.close_connection()
+
+    def test_schema_and_upsert(self):
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_manifest (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            path VARCHAR(255) NOT NULL UNIQUE,
+            size INT NOT NULL,
+            INDEX ingest_manifest_size (size)
+        )
+        """)
+        upsert = """
+        INSERT INTO ingest_manifest (path, size) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE size = VALUES(size)
+        """
+        self.cursor.executemany(upsert, [("a.plt", 1), ("b.plt", 2)])
+        self.cursor.execute(upsert, ("a.plt", 3))
+        self.cursor.execute("SELECT id, path, size FROM ingest_manifest ORDER BY id")
+        self.assertEqual(self.cursor.fetchall(), [(1, "a.plt", 3), (2, "b.plt", 2)])
+
+        self.cursor.execute("SHOW TABLES")
+        self.assertEqual(self.cursor.fetchall(), [("ingest_manifest",)])
+        query = """
+        SELECT index_name
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE()
+        AND table_name = 'ingest_manifest'
+        AND index_name = 'ingest_manifest_size'
+        """
+        self.cursor.execute(query)
+        self.assertEqual(self.cursor.fetchall(), [("ingest_manifest_size",)])
+
+        self.cursor.execute("ALTER TABLE ingest_manifest DROP INDEX ingest_manifest_size")
+        self.cursor.execute(query)
+        self.assertEqual(self.cursor.fetchall(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
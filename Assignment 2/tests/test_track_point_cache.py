@@ -0,0 +1,116 @@
+"""
+Checks the LRU order, byte accounting and eviction of TrackPointCache, on an in-memory SQLite database.
+
+Run from the repository root:
+python -m unittest discover -s "Assignment 2/tests"
+"""
+from datetime import datetime, timedelta
+import unittest
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from DbConnector import SqliteDbConnector
+from track_point_cache import TrackPointCache
+import numpy as np
+
+POINTS_PER_ACTIVITY = 10
+# lat, lon and time of each track point, 8 bytes each
+ACTIVITY_BYTES = POINTS_PER_ACTIVITY * 3 * 8
+START = datetime(2008, 10, 23, 2, 53, 4)
+
+
+class TrackPointCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.connection = SqliteDbConnector(PATH=":memory:")
+        cls.connection.cursor.execute("""
+        CREATE TABLE track_point (
+            activity_id INT NOT NULL,
+            seq INT NOT NULL,
+            lat DOUBLE NOT NULL,
+            lon DOUBLE NOT NULL,
+            date_time DATETIME NOT NULL
+        )
+        """)
+        # Inserted in reverse, so that the cache has to order the track points by seq
+        rows = [(activity_id, seq, activity_id + seq / 100, 116.0, START + timedelta(seconds=5 * seq))
+                for activity_id in range(1, 6) for seq in reversed(range(POINTS_PER_ACTIVITY))]
+        cls.connection.cursor.executemany(
+            "INSERT INTO track_point (activity_id, seq, lat, lon, date_time) VALUES (%s, %s, %s, %s, %s)", rows)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.connection.close_connection()
+
+    def cache(self, activity_count, ids_per_query=1000):
+        """
+        Returns:
+            TrackPointCache: a cache with room for the track points of activity_count activities
+        """
+        return TrackPointCache(self.connection.cursor, max_bytes=activity_count * ACTIVITY_BYTES,
+                               ids_per_query=ids_per_query)
+
+    def test_track_points(self):
+        lats, lons, times = self.cache(1).get(3)
+        np.testing.assert_allclose(lats, 3 + np.arange(POINTS_PER_ACTIVITY) / 100)
+        np.testing.assert_allclose(lons, 116.0)
+        start = int((START - datetime(1970, 1, 1)).total_seconds())
+        np.testing.assert_array_equal(times, start + 5 * np.arange(POINTS_PER_ACTIVITY))
+
+    def test_lru_order(self):
+        cache = self.cache(2)
+        cache.get(1)
+        cache.get(2)
+        # Makes 1 the most recently used, so 2 is evicted for 3
+        cache.get(1)
+        cache.get(3)
+        self.assertEqual(list(cache.activities), [1, 3])
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_byte_accounting(self):
+        cache = self.cache(3)
+        cache.get_many([1, 2])
+        self.assertEqual(cache.bytes, 2 * ACTIVITY_BYTES)
+        cache.get_many([2, 3, 4])
+        self.assertEqual(cache.bytes, 3 * ACTIVITY_BYTES)
+        self.assertEqual(cache.bytes, sum(column.nbytes for columns in cache.activities.values()
+                                          for column in columns))
+        cache.clear()
+        self.assertEqual((cache.bytes, len(cache.activities)), (0, 0))
+
+    def test_evicted_while_fetching(self):
+        cache = self.cache(2, ids_per_query=1)
+        cached_bytes = []
+        store = cache._store
+
+        def record_store(activity_id, columns):
+            store(activity_id, columns)
+            cached_bytes.append(cache.bytes)
+
+        cache._store = record_store
+        cache.get_many([1, 2])
+        cache.get_many([3, 4])
+        self.assertEqual(list(cache.activities), [3, 4])
+        self.assertLessEqual(max(cached_bytes), cache.max_bytes)
+
+    def test_request_larger_than_budget(self):
+        cache = self.cache(2)
+        cache.get(5)
+        result = cache.get_many([1, 2, 3])
+        # All activities are returned, but only the first ones that fit are cached
+        self.assertEqual(sorted(result), [1, 2, 3])
+        np.testing.assert_allclose(result[3][0], 3 + np.arange(POINTS_PER_ACTIVITY) / 100)
+        self.assertEqual(list(cache.activities), [1, 2])
+        self.assertEqual(cache.bytes, 2 * ACTIVITY_BYTES)
+
+    def test_activity_larger_than_budget(self):
+        cache = TrackPointCache(self.connection.cursor, max_bytes=ACTIVITY_BYTES - 1)
+        self.assertEqual(len(cache.get(1)[0]), POINTS_PER_ACTIVITY)
+        self.assertEqual((cache.bytes, len(cache.activities)), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,17 +10,19 @@ class DbConnector:
     HOST = "tdt4225-00.idi.ntnu.no" // Your server IP address/domain name
     USER = "testuser" // This is the user you created and added privileges for
     PASSWORD = "test123" // The password you set for said user
+    EVENT_LISTENERS = [listener] // Optional, pymongo monitoring listeners of the client
     """
 
     def __init__(self,
                  DATABASE='database',
                  HOST="localhost:27017",
                  USER="TEST_USER",
-                 PASSWORD="test123"):
+                 PASSWORD="test123",
+                 EVENT_LISTENERS=None):
         uri = "mongodb://%s:%s@%s/%s" % (USER, PASSWORD, HOST, DATABASE)
         # Connect to the databases
         try:
-            self.client = MongoClient(uri)
+            self.client = MongoClient(uri, event_listeners=EVENT_LISTENERS or [])
             self.db = self.client[DATABASE]
         except Exception as e:
             print("ERROR: Failed to connect to db:", e)
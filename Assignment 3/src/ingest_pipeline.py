@@ -0,0 +1,185 @@
+from part1 import Part1
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import asyncio
+import time
+import os
+
+
+class IngestPipeline:
+    """
+    Inserts the GPS data like Part1.insert_gps_data, but as a pipeline of stages connected by bounded queues:
+
+    directory walk -> parse -> label match -> batch -> write
+
+    The files are read and parsed in a process pool while earlier batches are written, so the disk,
+    the CPU and the database are busy at the same time. A full queue makes the stage before it wait,
+    so a slow stage holds back the others instead of letting unwritten track points pile up in memory.
+    The stages are coordinated by asyncio, and the blocking database calls run in threads with pymongo,
+    which needs no separate asyncio driver. Each write has its own client
+    """
+
+    def __init__(self, program, parse_workers=None, in_flight_writes=2, queue_size=64):
+        """
+        Args:
+            program (Part1): finds the files to insert and collects the batches, with its batch_size
+                and bucket_size. The writing clients are set up the same way
+            parse_workers (int): number of processes reading files, by default one per CPU
+            in_flight_writes (int): number of batches written at once
+            queue_size (int): number of files waiting between two stages
+        """
+        self.program = program
+        self.parse_workers = parse_workers or os.cpu_count()
+        self.in_flight_writes = in_flight_writes
+        self.queue_size = queue_size
+
+    def run(self, user_ids=None):
+        """Inserts the users and their new or changed trajectory files
+
+        Args:
+            user_ids (list[string]): see Part1.insert_gps_data
+
+        Returns:
+            dict: the number of files and batches written, and the seconds each stage spent waiting
+            for the next one to take its output, which is large for the stages before the bottleneck
+        """
+        return asyncio.run(self._run(user_ids))
+
+    async def _run(self, user_ids):
+        await asyncio.to_thread(self.program._create_ingest_indexes)
+        users = await asyncio.to_thread(self.program._insert_users, user_ids)
+        tasks = self.program._trajectory_tasks(users)
+        files = asyncio.Queue(self.queue_size)
+        trajectories = asyncio.Queue(self.queue_size)
+        labeled = asyncio.Queue(self.queue_size)
+        batches = asyncio.Queue(self.in_flight_writes)
+        self.stats = {"files": 0, "batches": 0, "walk_wait": 0.0, "parse_wait": 0.0, "label_wait": 0.0,
+                      "batch_wait": 0.0}
+
+        writers = []
+        try:
+            for _ in range(self.in_flight_writes):
+                writers.append(await asyncio.to_thread(Part1, **self.program._options()))
+            # Spawned, as forking a process that already runs threads can deadlock the child
+            with ProcessPoolExecutor(self.parse_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                # Two files per process in flight, so that a process never waits for the next file
+                parsers = [self._parse(files, trajectories, executor) for _ in range(2 * self.parse_workers)]
+                await asyncio.gather(self._walk(tasks, files, len(parsers)),
+                                     *parsers,
+                                     self._label(trajectories, labeled, len(parsers)),
+                                     self._batch(labeled, batches),
+                                     *[self._write(batches, writer) for writer in writers])
+        finally:
+            for writer in writers:
+                writer.connection.close_connection()
+
+        return self.stats
+
+    async def _put(self, queue, item, stage):
+        """Puts an item on a queue, and counts the time spent waiting for space on it as waiting time of the stage
+        """
+        start_time = time.perf_counter()
+        await queue.put(item)
+        self.stats[f"{stage}_wait"] += time.perf_counter() - start_time
+
+    async def _walk(self, tasks, files, parser_count):
+        """Lists the trajectory files of each user, on the connection of the program,
+        as it fetches the ingest manifest
+        """
+        while True:
+            task = await asyncio.to_thread(next, tasks, None)
+            if task is None:
+                break
+            user_id, has_label, trajectory_files = task
+            for trajectory_file in trajectory_files:
+                await self._put(files, (user_id, has_label, trajectory_file), "walk")
+
+        for _ in range(parser_count):
+            await files.put(None)
+
+    async def _parse(self, files, trajectories, executor):
+        """Reads and parses files in the process pool, in any order, as the activity ids are generated later
+        """
+        loop = asyncio.get_running_loop()
+        while (item := await files.get()) is not None:
+            user_id, has_label, trajectory_file = item
+            file, _, _, previous = trajectory_file
+            trajectory = await loop.run_in_executor(executor, Part1._read_trajectory,
+                                                    f"./dataset/Data/{user_id}/Trajectory/{file}",
+                                                    previous[2] if previous else None)
+            await self._put(trajectories, (user_id, has_label, trajectory_file, trajectory), "parse")
+
+        await trajectories.put(None)
+
+    async def _label(self, trajectories, labeled, parser_count):
+        """Matches the parsed files with the labels of their users. The labels of a user are read
+        in a thread the first time one of its files arrives
+        """
+        labels = {}
+        while parser_count:
+            item = await trajectories.get()
+            if item is None:
+                parser_count -= 1
+                continue
+
+            user_id, has_label, trajectory_file, trajectory = item
+            if user_id not in labels:
+                labels[user_id] = await asyncio.to_thread(self.program._load_labels, user_id, has_label)
+            transportation_mode = self.program._transportation_mode(labels[user_id], trajectory[1])
+            await self._put(labeled, (user_id, transportation_mode, trajectory_file, trajectory), "label")
+
+        await labeled.put(None)
+
+    async def _batch(self, labeled, batches):
+        """Collects the labeled files into batches of the batch size of the program
+        """
+        while (item := await labeled.get()) is not None:
+            self.program._add_trajectory(*item)
+            self.stats["files"] += 1
+
+            if self.program._batch_full():
+                await self._put(batches, self.program._take_pending(), "batch")
+
+        await batches.put(self.program._take_pending())
+        for _ in range(self.in_flight_writes):
+            await batches.put(None)
+
+    async def _write(self, batches, writer):
+        """Writes batches with the client of the writer, one at a time
+        """
+        while (pending := await batches.get()) is not None:
+            if pending["manifest"]:
+                await asyncio.to_thread(writer._write_pending, pending)
+                self.stats["batches"] += 1
+                print(f"Wrote batch {self.stats['batches']}")
+
+
+def main():
+    start_time = time.perf_counter()
+    program = None
+    # The number of batches written at once, and of files waiting between two stages
+    in_flight_writes = 2
+    queue_size = 64
+    # Store the track points in buckets of parallel arrays instead of one document per track point
+    bucket_size = None
+    try:
+        program = Part1(bucket_size=bucket_size)
+        program.reset_database()
+        stats = IngestPipeline(program, in_flight_writes=in_flight_writes, queue_size=queue_size).run()
+        program.create_missing_activity_summaries()
+        program.create_location_index()
+        print(f"Inserted {stats['files']} trajectory files in {stats['batches']} batches")
+        print(f"Waiting for the next stage: walk {stats['walk_wait']:.1f} s, parse {stats['parse_wait']:.1f} s, "
+              f"label {stats['label_wait']:.1f} s, batch {stats['batch_wait']:.1f} s")
+    except Exception as e:
+        print("ERROR: Failed to use database:", e)
+    finally:
+        if program:
+            program.connection.close_connection()
+
+    end_time = time.perf_counter()
+    print(f"Program took {(end_time - start_time)/60} minutes to run")
+
+
+if __name__ == '__main__':
+    main()
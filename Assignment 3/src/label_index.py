@@ -0,0 +1,156 @@
+from datetime import datetime
+
+
+class LabelIndex:
+    """
+    The labels of a user, parsed once from labels.txt.
+    Labels matching an activity exactly are looked up in a dict keyed on (start, end),
+    while labels overlapping an activity are found with an interval tree.
+    """
+
+    def __init__(self, labels):
+        """
+        Args:
+            labels (list[tuple[datetime, datetime, string]]): start, end and transportation mode of each label
+        """
+        self.labels = labels
+        self.exact = {}
+        for start_date_time, end_date_time, transportation_mode in labels:
+            # The first label wins if the same interval is labeled more than once
+            self.exact.setdefault((start_date_time, end_date_time), transportation_mode)
+        # Only built if overlap matching is used
+        self.tree = None
+
+    @classmethod
+    def from_file(cls, file_path):
+        """Parses the labels.txt file
+
+        Args:
+            file_path (string): the path to the labels.txt file
+
+        Returns:
+            LabelIndex: the labels of the file
+        """
+        labels = []
+        with open(file_path, "r") as f:
+            # Skip the header line
+            for line in f.read().splitlines()[1:]:
+                start_date, start_time, end_date, end_time, transportation_mode = line.split()
+                labels.append((_parse_label_date_time(start_date, start_time),
+                               _parse_label_date_time(end_date, end_time),
+                               transportation_mode))
+
+        return cls(labels)
+
+    def get_transportation_mode(self, start_date_time, end_date_time, overlap=False):
+        """Fetches the transportation mode for an activity if it exists
+
+        Args:
+            start_date_time (datetime): the start date time of the activity
+            end_date_time (datetime): the end date time of the activity
+            overlap (bool): if no label matches the activity exactly, use the label
+                overlapping the activity the most
+
+        Returns:
+            string: transportation mode if it exists, else None
+        """
+        transportation_mode = self.exact.get((start_date_time, end_date_time))
+        if transportation_mode is not None or not overlap:
+            return transportation_mode
+
+        if self.tree is None:
+            self.tree = IntervalTree(self.labels)
+
+        best_overlap = None
+        for label_start, label_end, label_mode in self.tree.overlapping(start_date_time, end_date_time):
+            label_overlap = min(label_end, end_date_time) - max(label_start, start_date_time)
+            if best_overlap is None or label_overlap > best_overlap:
+                best_overlap = label_overlap
+                transportation_mode = label_mode
+
+        return transportation_mode
+
+
+class IntervalTree:
+    """
+    Static centered interval tree, finding the k intervals overlapping a query interval in O(log n + k)
+    """
+
+    def __init__(self, intervals):
+        """
+        Args:
+            intervals (list[tuple]): intervals as tuples starting with (start, end), where start <= end
+        """
+        self.root = self._build(list(intervals))
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+
+        # Center on the median start, so that each side holds at most half of the intervals
+        starts = sorted(interval[0] for interval in intervals)
+        center = starts[len(starts) // 2]
+        left = [interval for interval in intervals if interval[1] < center]
+        right = [interval for interval in intervals if interval[0] > center]
+        overlapping = [interval for interval in intervals if interval[0] <= center <= interval[1]]
+
+        return _IntervalNode(center,
+                             sorted(overlapping, key=lambda interval: interval[0]),
+                             sorted(overlapping, key=lambda interval: interval[1], reverse=True),
+                             self._build(left),
+                             self._build(right))
+
+    def overlapping(self, start, end):
+        """Finds the intervals overlapping [start, end]
+
+        Args:
+            start: start of the query interval
+            end: end of the query interval
+
+        Returns:
+            list[tuple]: the overlapping intervals
+        """
+        result = []
+        nodes = [self.root] if self.root else []
+        while nodes:
+            node = nodes.pop()
+            if end < node.center:
+                # Only intervals of the node starting before the query ends can overlap
+                for interval in node.by_start:
+                    if interval[0] > end:
+                        break
+                    result.append(interval)
+                if node.left:
+                    nodes.append(node.left)
+            elif start > node.center:
+                # Only intervals of the node ending after the query starts can overlap
+                for interval in node.by_end:
+                    if interval[1] < start:
+                        break
+                    result.append(interval)
+                if node.right:
+                    nodes.append(node.right)
+            else:
+                # The query contains the center, so every interval of the node overlaps
+                result.extend(node.by_start)
+                if node.left:
+                    nodes.append(node.left)
+                if node.right:
+                    nodes.append(node.right)
+
+        return result
+
+
+class _IntervalNode:
+
+    def __init__(self, center, by_start, by_end, left, right):
+        self.center = center
+        self.by_start = by_start
+        self.by_end = by_end
+        self.left = left
+        self.right = right
+
+
+def _parse_label_date_time(date, time):
+    # Dates are written as 2008/04/02 in labels.txt
+    return datetime.fromisoformat(f"{date.replace('/', '-')} {time.replace('/', ':')}")
@@ -1,144 +1,524 @@
 from DbConnector import DbConnector
+from label_index import LabelIndex
+from activity_summary import summarize_activity
+from track_point_buckets import make_buckets, find_track_points, multi_point, valid_coordinates
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
 from pprint import pprint 
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
+from itertools import islice
+import hashlib
+import io
 import os
-from datetime import datetime
+import numpy as np
+
+# Day zero of the date_days field in the plt files
+DATE_DAYS_EPOCH = np.datetime64("1899-12-30", "s")
 
 class Part1:
 
-    def __init__(self):
-        self.connection = DbConnector()
+    def __init__(self, batch_size=50000, label_overlap=False, bucket_size=None, host="localhost:27017"):
+        """
+        Args:
+            batch_size (int): number of track points written together during insertion
+            label_overlap (bool): label activities without an exactly matching label
+                with the label overlapping them the most
+            bucket_size (int): if given, store the track points of each activity in the track_point_bucket
+                collection, as buckets of at most this many track points, instead of one document per
+                track point in the track_point collection
+            host (string): the host and port of the MongoDB server
+        """
+        self.connection = DbConnector(HOST=host)
         self.client = self.connection.client
         self.db = self.connection.db
+        self.batch_size = batch_size
+        self.label_overlap = label_overlap
+        self.bucket_size = bucket_size
+        self.host = host
+        # Activities, their summaries and track points, and manifest entries that are not yet written,
+        # see _flush_pending
+        self.pending_deletes = []
+        self.pending_activities = []
+        self.pending_summaries = []
+        self.pending_track_points = []
+        self.pending_track_point_count = 0
+        self.pending_manifest = []
 
-    def insert_gps_data(self):
+    def reset_database(self):
         """
-        Inserts the GPS data into the database
+        Resets the database by dropping all collections
         """
-        user_ids = os.listdir("./dataset/Data")
-        
         # Ensures data is consistent if it's inserted again
         self.db["user"].drop()
         self.db["activity"].drop()
         self.db["track_point"].drop()
+        self.db["track_point_bucket"].drop()
+        self.db["activity_summary"].drop()
+        self.db["ingest_manifest"].drop()
+
+    def insert_gps_data(self, workers=1, user_ids=None):
+        """
+        Inserts the GPS data into the database. Trajectory files in the ingest manifest with the same
+        size and modification time are skipped, so a rerun only inserts files that are new, changed
+        or were not completely inserted because the previous run was interrupted
+
+        Args:
+            workers (int): number of processes that parse and insert users in parallel,
+                each with its own client. 1 inserts everything with this client.
+            user_ids (list[string]): only insert these users, by default all users of the dataset
+        """
+        self._create_ingest_indexes()
+        users = self._insert_users(user_ids)
+        tasks = list(self._trajectory_tasks(users))
         
-        user_collection = self.db["user"]
-        activity_collection = self.db["activity"]
-        track_point_collection = self.db["track_point"]
+        print(f"Inserting {sum(len(task[2]) for task in tasks)} new or changed trajectory files")
         
-        # Index is necessary, because otherwise, $lookup will take forever
-        track_point_collection.create_index("activity_id")
+        if workers > 1:
+            with Pool(workers, initializer=_init_worker, initargs=(self._options(),)) as pool:
+                # One user per task, as the number of trajectories per user varies a lot
+                for user_id in pool.imap(_insert_user_worker, tasks):
+                    print(f"Processed user {user_id}")
+                pool.close()
+                pool.join()
+        else:
+            for task in tasks:
+                print(f"Processing user {task[0]}")
+                self._insert_user_trajectories(*task)
+
+    def _create_ingest_indexes(self):
+        """Creates the indexes used while inserting and by the tasks
+        """
+        if self.bucket_size:
+            # The buckets of an activity are read in order
+            self.db["track_point_bucket"].create_index([("activity_id", 1), ("seq", 1)])
+        else:
+            # Index is necessary, because otherwise, $lookup will take forever
+            self.db["track_point"].create_index("activity_id")
+        # Equality fields first and the date range last, so that filters on a user, a mode and
+        # a date range (see Part2._activity_filter) are a single index range scan
+        activity_index = [("user_id", 1), ("transportation_mode", 1), ("start_date_time", 1)]
+        self.db["activity"].create_index(activity_index)
+        self.db["activity_summary"].create_index(activity_index)
+
+    def _insert_users(self, user_ids=None):
+        """Inserts the users, so that the activities inserted later can refer to them
+
+        Args:
+            user_ids (list[string]): the users, by default all users of the dataset
+
+        Returns:
+            list[tuple]: id and has_labels of the users, sorted by id
+        """
+        # Sorted so that users and activities are always inserted in the same order
+        user_ids = sorted(user_ids if user_ids is not None else os.listdir("./dataset/Data"))
         
         with open("./dataset/labeled_ids.txt", "r") as f:
-            user_labels = f.read().splitlines()
-            
-        for user_id in user_ids:
-            print(f"Processing user {user_id}")
-            user_root = f"./dataset/Data/{user_id}"
-            has_label = 1 if user_id in user_labels else 0
+            user_labels = set(f.read().splitlines())
+        users = [(user_id, 1 if user_id in user_labels else 0) for user_id in user_ids]
             
-            user = {"_id": user_id, "has_labels": has_label}
-            user_collection.insert_one(user)
-
-            for file in os.listdir(f"{user_root}/Trajectory"):
-                file_path = f"{user_root}/Trajectory/{file}"
-                
-                # Get trackpoints if length is sufficiently short
-                track_points = self._process_trajectory_file(file_path)
-                
-                if track_points:
-                    start_date_time = f"{track_points[0][5]} {track_points[0][6]}"
-                    end_date_time = f"{track_points[-1][5]} {track_points[-1][6]}"
-                    
-                    if has_label:
-                        labels_file_path = f"{user_root}/labels.txt"
-                        labels = self._process_labels_file(labels_file_path)
-                        
-                        transportation_mode = self._get_transportation_mode(start_date_time, end_date_time, labels)
-                    else:
-                        transportation_mode = None
-                    
-                    # Insert activity and get activity id
-                    
-                    activity = {"user_id": user_id,
-                                "transportation_mode": transportation_mode,
-                                "start_date_time": datetime.strptime(start_date_time, "%Y-%m-%d %H:%M:%S"),
-                                "end_date_time": datetime.strptime(end_date_time, "%Y-%m-%d %H:%M:%S")}
-                    
-                    activity_id = activity_collection.insert_one(activity).inserted_id
-                    
-                    # Convert track points to structured list of dictionaries
-                    track_points_structured = [{"activity_id": activity_id,
-                                                "lat": float(track_point[0]),
-                                                "lon": float(track_point[1]),
-                                                # Should in principle be int according to specification, but
-                                                # is sometimes float, so convert float to int
-                                                "altitude": int(float(track_point[3])),
-                                                "date_days": float(track_point[4]),
-                                                "date_time": datetime.strptime(f"{track_point[5]} {track_point[6]}", "%Y-%m-%d %H:%M:%S")}
-                                                for track_point in track_points]
-                    
-                    track_point_collection.insert_many(track_points_structured)
-
-    def _get_transportation_mode(self, start_date_time, end_date_time, labels):
-        """Fetches the transportation mode for an activity if it exists
+        # Upserted, as the users may exist from a previous run. A shard may have no users
+        if users:
+            self.db["user"].bulk_write([UpdateOne({"_id": user_id}, {"$set": {"has_labels": has_labels}}, upsert=True)
+                                        for user_id, has_labels in users])
+        return users
+
+    def _trajectory_tasks(self, users):
+        """Finds the trajectory files of each user that are not inserted yet, see insert_gps_data
 
         Args:
-            start_date_time (string): The start date time of the activity
-            labels (list[string]): Raw labels from the labels.txt file
+            users (list[tuple]): the users, see _insert_users
+
+        Yields:
+            tuple: user id, has_labels and the trajectory files of a user with any files to insert,
+            see _insert_user_trajectories
+        """
+        manifest = self._fetch_manifest()
+        
+        for user_id, has_labels in users:
+            trajectory_files = []
+            for file in sorted(os.listdir(f"./dataset/Data/{user_id}/Trajectory")):
+                stat = os.stat(f"./dataset/Data/{user_id}/Trajectory/{file}")
+                previous = manifest.get(f"Data/{user_id}/Trajectory/{file}")
+                # Unchanged since it was inserted
+                if previous and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                trajectory_files.append((file, stat.st_size, stat.st_mtime_ns, previous))
+            
+            if trajectory_files:
+                yield user_id, has_labels, trajectory_files
+
+    def _fetch_manifest(self):
+        """Fetches the ingest manifest. Entries still pending were written by a run that was interrupted
+        before their activities were completely inserted, so whatever was inserted of those activities
+        is deleted, and their files are inserted again
 
         Returns:
-            string: transportation mode if it exists, else None
-        """
-        for label in labels:
-            # Replace / with - in date
-            label_start_date_time = f"{label[0].replace('/', '-')} {label[1].replace('/', ':')}"
-            label_end_date_time = f"{label[2].replace('/', '-')} {label[3].replace('/', ':')}"            
-            # If the start date time of the label matches the start date time of the activity
-            # then we have found a labeled transportation mode for this activity
-            if label_start_date_time == start_date_time and label_end_date_time == end_date_time:
-                transportation_mode = label[4]
-                return transportation_mode
+            dict[string, tuple]: size, mtime_ns, content_hash and activity_id of each inserted file
+        """
+        manifest_collection = self.db["ingest_manifest"]
+        pending = list(manifest_collection.find({"status": "pending"}))
+        for entry in pending:
+            if entry["activity_id"] is not None:
+                self._delete_activity(entry["activity_id"])
+        manifest_collection.delete_many({"_id": {"$in": [entry["_id"] for entry in pending]}})
+        
+        return {entry["_id"]: (entry["size"], entry["mtime_ns"], entry["content_hash"], entry["activity_id"])
+                for entry in manifest_collection.find({})}
+
+    def _options(self):
+        """
+        Returns:
+            dict: the constructor arguments of this instance, used to set up worker processes the same way
+        """
+        return {"batch_size": self.batch_size,
+                "label_overlap": self.label_overlap,
+                "bucket_size": self.bucket_size,
+                "host": self.host}
+
+    def _insert_user_trajectories(self, user_id, has_label, trajectory_files):
+        """Inserts the activities and track points of the trajectories of a user
+
+        Args:
+            user_id (string): the user id
+            has_label (int): 1 if the user has labeled activities, else 0
+            trajectory_files (list[tuple]): file name, size, mtime_ns and the manifest entry
+                of the file if it was inserted before, else None
+        """
+        labels = self._load_labels(user_id, has_label)
+
+        for trajectory_file in trajectory_files:
+            file, _, _, previous = trajectory_file
+            trajectory = Part1._read_trajectory(f"./dataset/Data/{user_id}/Trajectory/{file}",
+                                                previous[2] if previous else None)
+            self._add_trajectory(user_id, self._transportation_mode(labels, trajectory[1]), trajectory_file, trajectory)
             
-        return None
-                
-    def _process_trajectory_file(self, file_path):
-        """Processes the plt file and returns the track points if the file is valid
+            if self._batch_full():
+                self._flush_pending()
+        
+        self._flush_pending()
+
+    def _load_labels(self, user_id, has_label):
+        """
+        Returns:
+            LabelIndex: the labels of the user, parsed once and looked up by the start and end
+            of each activity, or None if the user has no labels
+        """
+        return LabelIndex.from_file(f"./dataset/Data/{user_id}/labels.txt") if has_label else None
+
+    @staticmethod
+    def _read_trajectory(file_path, previous_hash=None):
+        """Reads a trajectory file. Uses no connection, so that files can be read in other processes
 
         Args:
             file_path (string): path to the plt file
+            previous_hash (string): content hash of the file when it was inserted before, else None
 
         Returns:
-            list[string]: the track points if the file is valid, else None
-        """
-        with open(file_path, "r") as f:
-            # We only want to read .plt files that contain at most 2506 lines (2500 + 6 header lines)
-            num_lines = sum(1 for _ in f)
-            if num_lines > 2506:
-                print(f"File {file_path} has more than 2500 track points: skipping! {num_lines}")
-                return None
+            tuple: the content hash, and the track point columns and the summary of the activity
+            if the file has changed and is valid, else None and None
+        """
+        # The file is read once, and the same content is hashed and parsed
+        with open(file_path, "rb") as f:
+            content = f.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash == previous_hash:
+            return content_hash, None, None
+        
+        # Get trackpoints if length is sufficiently short
+        track_points = Part1._process_trajectory_file(file_path, content)
+        if not track_points:
+            return content_hash, None, None
+        
+        summary = summarize_activity(track_points["lat"], track_points["lon"],
+                                     track_points["altitude"], track_points["date_time"])
+        return content_hash, track_points, summary
+
+    def _transportation_mode(self, labels, track_points):
+        """
+        Args:
+            labels (LabelIndex): the labels of the user, see _load_labels
+            track_points (dict[string, np.ndarray]): the track point columns of a read trajectory file,
+                see _read_trajectory
+
+        Returns:
+            string: the transportation mode of the label matching the activity, or None
+        """
+        if not labels or not track_points:
+            return None
+        date_times = track_points["date_time"]
+        # item() converts to datetime, which the label lookup expects
+        return labels.get_transportation_mode(date_times[0].item(), date_times[-1].item(), overlap=self.label_overlap)
+
+    def _add_trajectory(self, user_id, transportation_mode, trajectory_file, trajectory):
+        """Adds the documents of a read trajectory file to the pending writes
+
+        Args:
+            user_id (string): the user id
+            transportation_mode (string): the label of the activity, see _transportation_mode
+            trajectory_file (tuple): the file, see _insert_user_trajectories
+            trajectory (tuple): the read file, see _read_trajectory
+        """
+        file, size, mtime_ns, previous = trajectory_file
+        content_hash, track_points, activity_summary = trajectory
+        path = f"Data/{user_id}/Trajectory/{file}"
+        manifest_entry = {"_id": path,
+                          "user_id": user_id,
+                          "size": size,
+                          "mtime_ns": mtime_ns,
+                          "content_hash": content_hash,
+                          "activity_id": None}
+        
+        if previous:
+            _, _, previous_hash, previous_activity_id = previous
+            if content_hash == previous_hash:
+                # Only touched, so the inserted activity is still up to date
+                manifest_entry["activity_id"] = previous_activity_id
+                self.pending_manifest.append(manifest_entry)
+                return
+            if previous_activity_id is not None:
+                # Replaced by the new version of the file
+                self.pending_deletes.append(previous_activity_id)
+        
+        if track_points:
+            date_times = track_points["date_time"]
+            # item() converts to datetime, which pymongo expects
+            start_date_time = date_times[0].item()
+            end_date_time = date_times[-1].item()
+            
+            # The id is generated here, so the activity can be written in a batch
+            # without waiting for the server to assign it
+            activity_id = ObjectId()
+            activity = {"_id": activity_id,
+                        "user_id": user_id,
+                        "transportation_mode": transportation_mode,
+                        "start_date_time": start_date_time,
+                        "end_date_time": end_date_time}
+            self.pending_activities.append(activity)
+            # The user and transportation mode are copied into the summary, so the tasks
+            # reading it do not need a $lookup
+            summary = {"_id": activity_id,
+                       "user_id": user_id,
+                       "transportation_mode": transportation_mode}
+            summary.update(activity_summary)
+            self.pending_summaries.append(summary)
+            
+            if self.bucket_size:
+                self.pending_track_points.extend(make_buckets(activity_id, track_points, self.bucket_size))
             else:
-                f.seek(0)
-                # Skip first 6 header lines
-                track_points_lines = f.read().splitlines()[6:]
-                track_points = [line.strip().split(",") for line in track_points_lines]
-                
-                return track_points
+                # tolist() converts each column to Python floats, ints and datetimes in one go
+                columns = zip(track_points["lat"].tolist(),
+                              track_points["lon"].tolist(),
+                              track_points["altitude"].tolist(),
+                              track_points["date_days"].tolist(),
+                              date_times.tolist(),
+                              valid_coordinates(track_points["lat"], track_points["lon"]).tolist())
+                for lat, lon, altitude, date_days, date_time, valid in columns:
+                    track_point = {"activity_id": activity_id,
+                                   "lat": lat,
+                                   "lon": lon,
+                                   "altitude": altitude,
+                                   "date_days": date_days,
+                                   "date_time": date_time}
+                    # Track points without a location are left out of the 2dsphere index
+                    if valid:
+                        track_point["location"] = {"type": "Point", "coordinates": [lon, lat]}
+                    self.pending_track_points.append(track_point)
+            self.pending_track_point_count += len(date_times)
+            manifest_entry["activity_id"] = activity_id
+        
+        # Recorded even if the file is skipped, so that it is not read again
+        self.pending_manifest.append(manifest_entry)
+
+    def _batch_full(self):
+        """
+        Returns:
+            bool: True if enough track points are pending to be written together
+        """
+        return self.pending_track_point_count >= self.batch_size
+
+    def _take_pending(self):
+        """Takes the pending writes, so that they can be written by another instance with _write_pending
+
+        Returns:
+            dict: the pending writes
+        """
+        pending = {"deletes": self.pending_deletes,
+                   "activities": self.pending_activities,
+                   "summaries": self.pending_summaries,
+                   "track_points": self.pending_track_points,
+                   "track_point_count": self.pending_track_point_count,
+                   "manifest": self.pending_manifest}
+        self.pending_deletes = []
+        self.pending_activities = []
+        self.pending_summaries = []
+        self.pending_track_points = []
+        self.pending_track_point_count = 0
+        self.pending_manifest = []
+        return pending
+
+    def _write_pending(self, pending):
+        """Writes pending writes taken from another instance with _take_pending
+        """
+        self.pending_deletes = pending["deletes"]
+        self.pending_activities = pending["activities"]
+        self.pending_summaries = pending["summaries"]
+        self.pending_track_points = pending["track_points"]
+        self.pending_track_point_count = pending["track_point_count"]
+        self.pending_manifest = pending["manifest"]
+        self._flush_pending()
+
+    def _delete_activity(self, activity_id):
+        """Deletes an activity, its summary and its track points
+        """
+        self.db[self._track_point_collection_name()].delete_many({"activity_id": activity_id})
+        self.db["activity_summary"].delete_one({"_id": activity_id})
+        self.db["activity"].delete_one({"_id": activity_id})
+
+    def _track_point_collection_name(self):
+        """
+        Returns:
+            string: the collection holding the track points in the layout of this instance
+        """
+        return "track_point_bucket" if self.bucket_size else "track_point"
+
+    def _flush_pending(self):
+        """Writes the pending activities, their summaries and track points in bulk. There are no transactions on a single
+        server, so the manifest entries of their files are written as pending first, and only marked as
+        done once everything is inserted. See _fetch_manifest
+        """
+        # The replaced activities go first, like when they were deleted as soon as their files were read
+        for activity_id in self.pending_deletes:
+            self._delete_activity(activity_id)
+        self.pending_deletes = []
+        
+        manifest_collection = self.db["ingest_manifest"]
+        if self.pending_manifest:
+            for manifest_entry in self.pending_manifest:
+                manifest_entry["status"] = "pending"
+            manifest_collection.bulk_write([ReplaceOne({"_id": manifest_entry["_id"]}, manifest_entry, upsert=True)
+                                            for manifest_entry in self.pending_manifest], ordered=False)
+        
+        # Unordered, as the documents do not depend on each other within a batch
+        if self.pending_activities:
+            self.db["activity"].insert_many(self.pending_activities, ordered=False)
+            self.pending_activities = []
+        if self.pending_summaries:
+            self.db["activity_summary"].insert_many(self.pending_summaries, ordered=False)
+            self.pending_summaries = []
+        if self.pending_track_points:
+            self.db[self._track_point_collection_name()].insert_many(self.pending_track_points, ordered=False)
+            self.pending_track_points = []
+            self.pending_track_point_count = 0
             
-    def _process_labels_file(self, file_path):
-        """Processes the labels.txt file and returns the labels
+        if self.pending_manifest:
+            manifest_collection.update_many({"_id": {"$in": [manifest_entry["_id"] for manifest_entry in self.pending_manifest]}},
+                                            {"$set": {"status": "done"}})
+            self.pending_manifest = []
+
+    def create_missing_activity_summaries(self):
+        """
+        Computes the summaries of activities inserted before the activity_summary collection existed,
+        as the incremental insertion skips their unchanged files
+        """
+        summarized_ids = set(self.db["activity_summary"].distinct("_id"))
+        activities = [activity for activity in self.db["activity"].find({})
+                      if activity["_id"] not in summarized_ids]
+        print(f"Summarizing {len(activities)} activities without a summary")
+        
+        for activity in activities:
+            track_points = find_track_points(self.db, activity["_id"], bucketed=bool(self.bucket_size))
+            if not track_points["date_time"]:
+                continue
+            summary = {"_id": activity["_id"],
+                       "user_id": activity["user_id"],
+                       "transportation_mode": activity["transportation_mode"]}
+            summary.update(summarize_activity(track_points["lat"], track_points["lon"], track_points["altitude"],
+                                              np.array(track_points["date_time"], dtype="datetime64[s]")))
+            self.pending_summaries.append(summary)
+            if len(self.pending_summaries) >= self.batch_size:
+                self._flush_pending()
+        self._flush_pending()
+
+    def create_location_index(self):
+        """
+        Creates the 2dsphere index on the GeoJSON locations of the track points after the load, which is
+        faster than maintaining it for every inserted document. Track points inserted before the locations
+        were stored get them first
+        """
+        if self.bucket_size:
+            bucket_collection = self.db["track_point_bucket"]
+            updates = []
+            for bucket in bucket_collection.find({"locations": {"$exists": False}}, {"lat": 1, "lon": 1}):
+                locations = multi_point(np.array(bucket["lat"], dtype=np.float64),
+                                        np.array(bucket["lon"], dtype=np.float64))
+                if locations:
+                    updates.append(UpdateOne({"_id": bucket["_id"]}, {"$set": {"locations": locations}}))
+            if updates:
+                bucket_collection.bulk_write(updates, ordered=False)
+            bucket_collection.create_index([("locations", "2dsphere")])
+        else:
+            track_point_collection = self.db["track_point"]
+            # Computed by the server, with the same range check as valid_coordinates
+            track_point_collection.update_many({"location": {"$exists": False},
+                                                "lat": {"$gte": -90, "$lte": 90},
+                                                "lon": {"$gte": -180, "$lte": 180}},
+                                               [{"$set": {"location": {"type": "Point",
+                                                                       "coordinates": ["$lon", "$lat"]}}}])
+            track_point_collection.create_index([("location", "2dsphere")])
+
+    @staticmethod
+    def _process_trajectory_file(file_path, content, max_track_points=2500):
+        """Processes the plt file and returns the track points as columns if the file is valid.
+        All fields are converted in one vectorized call instead of once per track point
 
         Args:
-            file_path (string): the path to the labels.txt file
+            file_path (string): path to the plt file, for the message if it is skipped
+            content (bytes): the content of the plt file
+            max_track_points (int): the maximum number of track points of a valid file
 
         Returns:
-            list[string]: the raw labels
+            dict[string, np.ndarray]: lat, lon, altitude, date_days and date_time columns
+            if the file is valid, else None
         """
-        with open(file_path, "r") as f:
-            labels_lines = f.read().splitlines()[1:]
-            labels = [line.split() for line in labels_lines]
+        with io.StringIO(content.decode(), newline=None) as f:
+            # Skip first 6 header lines, and read at most one track point more than allowed,
+            # which is enough to tell if the file is too long
+            lines = list(islice(f, 6, 6 + max_track_points + 1))
             
-            return labels
+        if len(lines) > max_track_points:
+            print(f"File {file_path} has more than {max_track_points} track points: skipping!")
+            return None
+        if not lines:
+            return None
+        
+        # Columns: lat, lon, altitude and date_days. The date and time strings are
+        # left out, as they are given by date_days as well
+        values = np.loadtxt(lines, delimiter=",", usecols=(0, 1, 3, 4), ndmin=2)
+        date_days = values[:, 3]
         
+        return {"lat": values[:, 0],
+                "lon": values[:, 1],
+                # Should in principle be int according to specification, but
+                # is sometimes float, so convert float to int
+                "altitude": values[:, 2].astype(np.int64),
+                "date_days": date_days,
+                "date_time": Part1._date_days_to_datetime(date_days)}
+
+    @staticmethod
+    def _date_days_to_datetime(date_days):
+        """Converts a date_days column to datetimes, rounded to whole seconds like the date and time
+        fields of the plt file
+
+        Args:
+            date_days (np.ndarray): number of days since 1899-12-30, with fractional part
+
+        Returns:
+            np.ndarray: the datetimes as datetime64[s]
+        """
+        seconds = np.rint(date_days * 86400).astype("timedelta64[s]")
+        return DATE_DAYS_EPOCH + seconds
+            
     def print_collections_top10(self):
         """Prints the top 10 documents in each collection
         """
@@ -149,16 +529,43 @@ class Part1:
             print(f"{collection_name} Collection:")
             for doc in documents: 
                 pprint(doc)
+
+
+# Part1 instance owned by a worker process during parallel ingestion
+_worker_program = None
+
+
+def _init_worker(options):
+    """Opens a separate client for the current worker process, as MongoClient is not fork-safe
+    """
+    global _worker_program
+    _worker_program = Part1(**options)
+    # Close the client when the worker exits after pool.close()
+    Finalize(_worker_program, _worker_program.connection.close_connection, exitpriority=10)
+
+
+def _insert_user_worker(task):
+    _worker_program._insert_user_trajectories(*task)
+    return task[0]
         
                                 
 def main():
     program = None
     create = False
+    # Only insert new or changed trajectory files instead of reloading everything
+    incremental = False
+    workers = os.cpu_count()
+    # Store the track points in buckets of parallel arrays instead of one document per track point
+    bucket_size = None
     try:
-        program = Part1()
+        program = Part1(bucket_size=bucket_size)
         
         if create:
-            program.insert_gps_data()
+            if not incremental:
+                program.reset_database()
+            program.insert_gps_data(workers=workers)
+            program.create_missing_activity_summaries()
+            program.create_location_index()
         else:
             program.print_collections_top10()
     except Exception as e:
@@ -1,4 +1,5 @@
 from DbConnector import DbConnector
+from track_point_buckets import find_track_points
 from haversine import haversine, Unit, haversine_vector
 import time
 from pprint import pprint
@@ -7,23 +8,58 @@ import datetime
 
 class Part2:
 
-    def __init__(self):
-        self.connection = DbConnector()
+    def __init__(self, bucketed=False, connection=None):
+        """
+        Args:
+            bucketed (bool): read the track points from the track_point_bucket collection,
+                see Part1 with bucket_size
+            connection (DbConnector): the connection to use, by default a new one. The client
+                is thread-safe, so a connection can be shared by several instances
+        """
+        self.connection = connection or DbConnector()
         self.client = self.connection.client
         self.db = self.connection.db
+        self.bucketed = bucketed
 
     def task1(self):
-        user_count = self.db.user.count_documents({})
-        activity_count = self.db.activity.count_documents({})
-        track_point_count = self.db.track_point.count_documents({})
+        user_count, activity_count, track_point_count = self._task1_counts()
 
         print("Task 1:")
         print(f"Number of users: {user_count}")
         print(f"Number of activities: {activity_count}")
         print(f"Number of trackpoints: {track_point_count}")
 
+    def _task1_counts(self):
+        """
+        Returns:
+            tuple[int, int, int]: the number of users, activities and track points
+        """
+        user_count = self.db.user.count_documents({})
+        activity_count = self.db.activity.count_documents({})
+        if self.bucketed:
+            counts = list(self.db.track_point_bucket.aggregate([
+                {
+                    "$group": {"_id": None, "track_point_count": {"$sum": "$count"}}
+                }
+            ]))
+            track_point_count = counts[0]["track_point_count"] if counts else 0
+        else:
+            track_point_count = self.db.track_point.count_documents({})
+
+        return user_count, activity_count, track_point_count
+
     def task2(self):
-        count = self.db.activity.aggregate([
+        user_count, activity_count = self._task2_counts()
+        print("Task 2: Average activities per user")
+        print(f"{activity_count / user_count: .2f}")
+
+    def _task2_counts(self):
+        """
+        Returns:
+            tuple[int, int]: the number of users with activities and their number of activities,
+            which unlike an average can be added up across shards
+        """
+        counts = list(self.db.activity.aggregate([
             {
                 "$group": {
                     "_id": "$user_id",
@@ -33,15 +69,19 @@ class Part2:
             {
                 "$group": {
                     "_id": None,
-                    "average_activites": {"$avg": "$activity_count"}
+                    "user_count": {"$sum": 1},
+                    "activity_count": {"$sum": "$activity_count"}
                 }
             }
-        ])
-        print("Task 2: Average activities per user")
-        print(f"{list(count)[0].get('average_activites'): .2f}")
+        ]))
+        return (counts[0]["user_count"], counts[0]["activity_count"]) if counts else (0, 0)
 
     def task3(self):
-        users = self.db.activity.aggregate([
+        print("Task 3: Top 20 users with highest number of activities")
+        self._print_results(self._task3_users())
+
+    def _task3_users(self):
+        return list(self.db.activity.aggregate([
             {
                 "$group": {
                     "_id": "$user_id",
@@ -54,19 +94,21 @@ class Part2:
             {
                 "$limit": 20
             }
-        ])
-        print("Task 3: Top 20 users with highest number of activities")
-        self._print_results(users)
+        ]))
 
     def task4(self):
-        users_that_have_taken_taxi = self.db.activity.distinct(
-            "user_id", {"transportation_mode": "taxi"})
-
         print("Task 4: Users that have taken a taxi")
-        self._print_results(users_that_have_taken_taxi)
+        self._print_results(self._task4_users())
+
+    def _task4_users(self):
+        return self.db.activity.distinct("user_id", self._activity_filter(transportation_mode="taxi"))
 
     def task5(self):
-        transportation_counts = self.db.activity.aggregate([
+        print("Task 5: Activity count of each transportation mode")
+        self._print_results(self._task5_counts())
+
+    def _task5_counts(self):
+        return list(self.db.activity.aggregate([
             {
                 "$match": {"transportation_mode": {"$ne": None}}
             },
@@ -80,13 +122,20 @@ class Part2:
                 # Also sorting alphabetically to make it easier to read
                 "$sort": {"_id": 1}
             }
-        ])
-
-        print("Task 5: Activity count of each transportation mode")
-        self._print_results(transportation_counts)
+        ]))
 
     def task6a(self):
-        year_with_most_activities = self.db.activity.aggregate([
+        year_activity_counts = self._year_activity_counts()
+
+        print("Task 6a: The year with most activities")
+        self._print_results(sorted(year_activity_counts, key=lambda year: year["activity_count"], reverse=True)[:1])
+
+    def _year_activity_counts(self):
+        """
+        Returns:
+            list[dict]: the number of activities of each year
+        """
+        return list(self.db.activity.aggregate([
             {
                 "$project": {
                     "years": {
@@ -110,20 +159,21 @@ class Part2:
                     "_id": "$years",
                     "activity_count": {"$sum": 1}
                 }
-            },
-            {
-                "$sort": {"activity_count": -1}
-            },
-            {
-                "$limit": 1
             }
-        ])
-
-        print("Task 6a: The year with most activities")
-        self._print_results(year_with_most_activities)
+        ]))
 
     def task6b(self):
-        year_with_most_hours = self.db.activity.aggregate([
+        year_hours = self._year_hours()
+
+        print("Task 6b: Year with most hours")
+        self._print_results(sorted(year_hours, key=lambda year: year["total_hours"], reverse=True)[:1])
+
+    def _year_hours(self):
+        """
+        Returns:
+            list[dict]: the total hours of the activities starting in each year
+        """
+        return list(self.db.activity.aggregate([
             {
                 "$project": {
                     "start_year": {"$year": "$start_date_time"},
@@ -142,23 +192,27 @@ class Part2:
                     "_id": "$start_year",
                     "total_hours": {"$sum": "$duration"}
                 }
-            },
-            {
-                "$sort": {"total_hours": -1}
-            },
-            {
-                "$limit": 1
             }
-        ])
-
-        print("Task 6b: Year with most hours")
-        self._print_results(year_with_most_hours)
+        ]))
 
     def task6b2(self):
         """Different implementation of task 6b using python instead of mongoDB,
         does handle the edge case where start and end date are in different years
         but the hours as largely the same
         """
+        recorded_hours_per_year = self._recorded_hours_per_year()
+
+        print("Task 6b: Year with most hours")
+        # Print sorted dict
+        recorded_hours_per_year = dict(
+            sorted(recorded_hours_per_year.items(), key=lambda x: x[1], reverse=True)[:1])
+        print(recorded_hours_per_year)
+
+    def _recorded_hours_per_year(self):
+        """
+        Returns:
+            dict[int, float]: the recorded hours of each year
+        """
         year_with_most_hours = self.db.activity.find({})
 
         recorded_hours_per_year = {}
@@ -188,193 +242,229 @@ class Part2:
                 recorded_hours_per_year[activity["start_date_time"].year] = recorded_hours_per_year.get(
                     activity["start_date_time"].year, 0) + duration
 
-        print("Task 6b: Year with most hours")
-        # Print sorted dict
-        recorded_hours_per_year = dict(
-            sorted(recorded_hours_per_year.items(), key=lambda x: x[1], reverse=True)[:1])
-        print(recorded_hours_per_year)
+        return recorded_hours_per_year
 
     def task7(self):
-        activities = self.db.activity.aggregate([
-            {
-                "$addFields": {
-                    # Basically select * + start_year
-                    "start_year": {"$year": "$start_date_time"}
-                }
-            },
-            {
-                "$match": {
-                    "user_id": "112",
-                    "transportation_mode": "walk",
-                    "start_year": 2008
-                }
-            },
-            {
-                "$lookup": {
-                    "from": "track_point",
-                    "localField": "_id",
-                    "foreignField": "activity_id",
-                    "as": "track_points"
-                }
-            }
-        ])
+        distance_in_km = self._distance(user_id="112", transportation_mode="walk", year=2008)
+
+        print("Task 7: Total distance walked by user 112 in 2008")
+        print(f"{distance_in_km: .2f} km")
+
+    def _distance(self, user_id, transportation_mode, year):
+        """
+        Returns:
+            float: the total distance in km of the user with the transportation mode in the year
+        """
+        # The distance of each activity is kept in activity_summary, so only activities
+        # continuing into the next year need their track points
+        activities = self.db.activity_summary.find(self._activity_filter(user_id=user_id,
+                                                                         transportation_mode=transportation_mode,
+                                                                         year=year))
 
         distance_in_km = 0
 
         for activity in activities:
-            for i in range(1, len(activity["track_points"])):
-                trackpoint = activity["track_points"][i]
-                prev_trackpoint = activity["track_points"][i-1]
-                
-                if trackpoint["date_time"].year == 2008:
-                    # Only count distance if trackpoint is in 2008
-                    lat, lon = trackpoint["lat"], trackpoint["lon"]
-                    prev_lat, prev_lon = prev_trackpoint["lat"], prev_trackpoint["lon"]
+            if activity["end_date_time"].year == year:
+                distance_in_km += activity["total_distance"]
+                continue
+
+            track_points = find_track_points(self.db, activity["_id"], bucketed=self.bucketed)
+            for i in range(1, len(track_points["date_time"])):
+                if track_points["date_time"][i].year == year:
+                    # Only count distance if trackpoint is in the year
+                    lat, lon = track_points["lat"][i], track_points["lon"][i]
+                    prev_lat, prev_lon = track_points["lat"][i-1], track_points["lon"][i-1]
 
                     distance_in_km += haversine((lat, lon), (prev_lat, prev_lon))
 
-        print("Task 7: Total distance walked by user 112 in 2008")
-        print(f"{distance_in_km: .2f} km")
+        return distance_in_km
 
     def task8(self):
-        activities = self.db.activity.aggregate([
+        print("Task 8: Top 20 users with highest gained altitude")
+        for user in self._task8_users():
+            print(f"User {user['_id']}: {user['gained_altitude']: .2f} meters")
+
+    def _task8_users(self):
+        # The altitude gained per activity, ignoring altitudes of -777, is kept in activity_summary
+        return list(self.db.activity_summary.aggregate([
             {
-                "$lookup": {
-                    "from": "track_point",
-                    "localField": "_id",
-                    "foreignField": "activity_id",
-                    "as": "track_points"
+                "$group": {
+                    "_id": "$user_id",
+                    "gained_altitude": {"$sum": "$altitude_gain"}
                 }
             },
             {
-                "$project": {
-                    "user_id": 1,
-                    "track_points": {
-                        # Filter out track points with altitude -777
-                        "$filter": {
-                            "input": "$track_points",
-                            "as": "track_points",
-                            "cond": {"$ne": ["$$track_points.altitude", -777]}
-                        }
-                    }
-                }
-            }
-        ])
-
-        gained_altitudes = {}
-
-        for activity in activities:
-            for i in range(1, len(activity["track_points"])):
-                trackpoint = activity["track_points"][i]
-                prev_trackpoint = activity["track_points"][i-1]
-
-                if trackpoint["altitude"] > prev_trackpoint["altitude"]:
-                    gained_altitudes[activity["user_id"]] = gained_altitudes.get(
-                        activity["user_id"], 0) + (trackpoint["altitude"] - prev_trackpoint["altitude"]) * 0.3048
-
-        print("Task 8: Top 20 users with highest gained altitude")
-        # Get top 20 values from dict
-        top_20_users = dict(sorted(gained_altitudes.items(),
-                            key=lambda x: x[1], reverse=True)[:20])
-        for user_id, gained_altitude in top_20_users.items():
-            print(f"User {user_id}: {gained_altitude: .2f} meters")
-
-    def task9(self):
-        invalid_activity_count_users = {}
-
-        activities = self.db.activity.aggregate([
+                "$match": {"gained_altitude": {"$gt": 0}}
+            },
             {
-                "$lookup": {
-                    "from": "track_point",
-                    "localField": "_id",
-                    "foreignField": "activity_id",
-                    "as": "track_points"
-                }
+                "$sort": {"gained_altitude": -1}
+            },
+            {
+                "$limit": 20
             }
-        ])
+        ]))
 
-        for activity in activities:
-            if self._detect_invalid_activity(activity):
-                invalid_activity_count_users[activity["user_id"]] = invalid_activity_count_users.get(
-                    activity["user_id"], 0) + 1
+    def task9(self, use_summary=True):
+        """Counts the illegal activities of each user. An activity is illegal if the time difference
+        between two trackpoints is greater than 5 minutes
+
+        Args:
+            use_summary (bool): see activity_gap_counts
+        """
+        invalid_activity_count_users = self.activity_gap_counts(5 * 60, use_summary)
 
         print("Task 9: Users with illegal activities")
-        for user_id, invalid_activity_count in invalid_activity_count_users.items():
+        for user_id, invalid_activity_count in invalid_activity_count_users:
             print(f"User {user_id}: {invalid_activity_count} illegal activities")
 
-    def _detect_invalid_activity(self, activity):
-        """Helper function to determine if an activity is invalid.
-        An activity is invalid if the time difference between two trackpoints is greater than 5 minutes
+    def activity_gap_counts(self, max_gap, use_summary=True):
+        """Counts the activities of each user with a time difference greater than max_gap from a track point
+        to the next one, in the order they were recorded (see activity_summary.max_time_gap_of). Both paths
+        give the same counts. The activities are found by the server, so only the counts are returned
 
         Args:
-            activity: the activity
+            max_gap (int): the largest allowed time difference, in seconds
+            use_summary (bool): use the largest time gap per activity kept in activity_summary, instead of
+                comparing each track point with the previous one of its activity in a $setWindowFields stage
 
         Returns:
-            bool: true if activity is invalid, else false
+            list[tuple]: user id and number of activities with a larger time difference, sorted by user id
         """
-        for i in range(1, len(activity["track_points"])):
-            trackpoint = activity["track_points"][i]
-            prev_trackpoint = activity["track_points"][i-1]
-
-            time_diff = (
-                trackpoint["date_time"] - prev_trackpoint["date_time"]).total_seconds() / 60
+        if use_summary:
+            collection = self.db.activity_summary
+            pipeline = [
+                {
+                    "$match": {"max_time_gap": {"$gt": max_gap}}
+                }
+            ]
+        else:
+            collection = self.db["track_point_bucket" if self.bucketed else "track_point"]
+            pipeline = []
+            if self.bucketed:
+                # One document per track point, with only the fields needed. The buckets are numbered
+                # by seq and the track points by their index in the bucket, in recorded order
+                pipeline += [
+                    {
+                        "$project": {"activity_id": 1, "seq": 1, "date_time": 1}
+                    },
+                    {
+                        "$unwind": {"path": "$date_time", "includeArrayIndex": "index"}
+                    }
+                ]
+                recorded_order = {"seq": 1, "index": 1}
+            else:
+                # The track points were inserted in recorded order, with increasing ObjectIds
+                recorded_order = {"_id": 1}
+            pipeline += [
+                {
+                    "$setWindowFields": {
+                        "partitionBy": "$activity_id",
+                        "sortBy": recorded_order,
+                        "output": {
+                            "prev_date_time": {"$shift": {"output": "$date_time", "by": -1}}
+                        }
+                    }
+                },
+                {
+                    # The first track point of an activity has no previous date_time, which never matches
+                    "$match": {
+                        "$expr": {
+                            "$gt": [{"$dateDiff": {"startDate": "$prev_date_time",
+                                                   "endDate": "$date_time", "unit": "second"}},
+                                    max_gap]
+                        }
+                    }
+                },
+                {
+                    "$group": {"_id": "$activity_id"}
+                },
+                {
+                    "$lookup": {
+                        "from": "activity",
+                        "localField": "_id",
+                        "foreignField": "_id",
+                        "as": "activity"
+                    }
+                },
+                {
+                    "$project": {"user_id": {"$arrayElemAt": ["$activity.user_id", 0]}}
+                }
+            ]
 
-            if time_diff > 5:
-                return True
+        pipeline += [
+            {
+                "$group": {
+                    "_id": "$user_id",
+                    "activity_count": {"$sum": 1}
+                }
+            },
+            {
+                "$sort": {"_id": 1}
+            }
+        ]
+        # The window over all track points is sorted on disk if it does not fit in memory
+        counts = collection.aggregate(pipeline, allowDiskUse=True)
 
-        return False
+        return [(user["_id"], user["activity_count"]) for user in counts]
 
     def task10(self):
-        users = self.db.user.find({})
-        user_ids = [user["_id"] for user in users]
-        forbidden_city_users = []
-
-        for user_id in user_ids:
-            if self._user_within_forbidden_city(user_id):
-                print(f"User {user_id} has been in forbidden city at least once!")
-                forbidden_city_users.append(user_id)
+        forbidden_city_users = self.users_near(39.916, 116.397, 1)
 
         print("Task 10: Users that have been in the forbidden city of Beijing")
         for user_id in forbidden_city_users:
             print(f"User {user_id}")
 
-    def _user_within_forbidden_city(self, user_id):
-        """Helper function to determine if a user has been within a certain radius of a coordinate 
-        corresponding to the forbidden city of Beijing
+    def users_near(self, lat, lon, radius):
+        """Finds the users with at least one track point within a radius of a location, with a single
+        query on the 2dsphere index of the track point locations (see Part1.create_location_index)
 
         Args:
-            user_id (string): the user id
+            lat (float): latitude of the location
+            lon (float): longitude of the location
+            radius (float): radius in km
 
         Returns:
-            bool: true if user has been within the forbidden city, else false
+            list[string]: the users, sorted
         """
-        forbidden_city_loc = (39.916, 116.397)
-        radius = 1  # Radius in km
-        activities = self.db.activity.aggregate([
+        users = self.db["track_point_bucket" if self.bucketed else "track_point"].aggregate([
+            {
+                # A bucket is near if any of its points is, as the distance to a MultiPoint
+                # is the distance to its nearest point
+                "$geoNear": {
+                    "near": {"type": "Point", "coordinates": [lon, lat]},
+                    "key": "locations" if self.bucketed else "location",
+                    "distanceField": "distance",
+                    "maxDistance": radius * 1000,
+                    "spherical": True
+                }
+            },
             {
-                "$match": {"user_id": user_id}
+                "$group": {"_id": "$activity_id"}
             },
             {
                 "$lookup": {
-                    "from": "track_point",
+                    "from": "activity",
                     "localField": "_id",
-                    "foreignField": "activity_id",
-                    "as": "track_points"
+                    "foreignField": "_id",
+                    "as": "activity"
                 }
+            },
+            {
+                "$group": {"_id": {"$arrayElemAt": ["$activity.user_id", 0]}}
+            },
+            {
+                "$sort": {"_id": 1}
             }
         ])
 
-        for activity in activities:
-            for trackpoint in activity["track_points"]:
-                distance = haversine(
-                    (trackpoint["lat"], trackpoint["lon"]), forbidden_city_loc)
-
-                if distance <= radius:
-                    return True
-        return False
+        return [user["_id"] for user in users]
 
     def task11(self):
-        most_used_transportation_mode = self.db.activity.aggregate([
+        print("Task 11: Most used transportation mode for each user")
+        self._print_results(self._task11_users())
+
+    def _task11_users(self):
+        return list(self.db.activity.aggregate([
             {
                 "$match": {
                     "transportation_mode": {"$ne": None}
@@ -404,10 +494,43 @@ class Part2:
             {
                 "$sort": {"_id": 1}
             }
-        ])
+        ]))
 
-        print("Task 11: Most used transportation mode for each user")
-        self._print_results(most_used_transportation_mode)
+    def _activity_filter(self, user_id=None, transportation_mode=None, year=None, start=None, end=None):
+        """Builds a filter on activities (or their summaries) that can use the
+        (user_id, transportation_mode, start_date_time) index. Dates are compared to start_date_time as a range,
+        as computing the year of each activity, like with $year, cannot use the index
+
+        Args:
+            user_id (string): only activities of this user
+            transportation_mode (string): only activities with this transportation mode
+            year (int): only activities starting in this year
+            start (datetime): only activities starting at or after this
+            end (datetime): only activities starting before this
+
+        Returns:
+            dict: the filter
+        """
+        activity_filter = {}
+        if user_id is not None:
+            activity_filter["user_id"] = user_id
+        if transportation_mode is not None:
+            activity_filter["transportation_mode"] = transportation_mode
+
+        if year is not None:
+            year_start = datetime.datetime(year, 1, 1)
+            year_end = datetime.datetime(year + 1, 1, 1)
+            start = max(start, year_start) if start else year_start
+            end = min(end, year_end) if end else year_end
+        start_date_time = {}
+        if start is not None:
+            start_date_time["$gte"] = start
+        if end is not None:
+            start_date_time["$lt"] = end
+        if start_date_time:
+            activity_filter["start_date_time"] = start_date_time
+
+        return activity_filter
 
     def _print_results(self, results):
         """Pretty prints the results as obtained from queries
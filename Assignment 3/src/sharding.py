@@ -0,0 +1,247 @@
+from DbConnector import DbConnector
+from part1 import Part1
+from part2 import Part2
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process
+import hashlib
+import time
+import os
+
+
+def shard_of(user_id, shard_count):
+    """Assigns a user to a shard by a hash of the user id, which unlike the built-in hash of strings
+    is the same in every process and run
+
+    Args:
+        user_id (string): the user id
+        shard_count (int): the number of shards
+
+    Returns:
+        int: the index of the shard of the user
+    """
+    return int.from_bytes(hashlib.md5(user_id.encode()).digest()[:8], "big") % shard_count
+
+
+class ShardedPart1:
+    """
+    Inserts the dataset into several MongoDB servers, with each user and its activities and track points
+    in the shard given by shard_of. A shard is given by the Part1 arguments selecting its server,
+    like {"host": "localhost:27018"}. The other Part1 methods, like reset_database, are run on every
+    shard in turn
+    """
+
+    def __init__(self, shards, **options):
+        """
+        Args:
+            shards (list[dict]): the Part1 arguments selecting the server of each shard
+            options: the other Part1 arguments, the same for every shard
+        """
+        self.shards = shards
+        self.options = options
+        self.programs = [Part1(**options, **shard) for shard in shards]
+
+    def __getattr__(self, name):
+        # Raises AttributeError for anything that is not a Part1 method
+        getattr(Part1, name)
+
+        def run_on_shards(*args, **kwargs):
+            return [getattr(program, name)(*args, **kwargs) for program in self.programs]
+
+        return run_on_shards
+
+    def insert_gps_data(self, workers=1):
+        """Inserts the users of each shard into it, all shards at once. The activity ids are ObjectIds,
+        which are unique across the shards without any coordination
+
+        Args:
+            workers (int): number of processes inserting users in parallel per shard
+        """
+        shard_user_ids = [[] for _ in self.shards]
+        for user_id in os.listdir("./dataset/Data"):
+            shard_user_ids[shard_of(user_id, len(self.shards))].append(user_id)
+
+        # A process per shard, as the ingestion of a shard starts worker processes of its own
+        processes = [Process(target=_insert_shard, args=(self.options, shard, workers, user_ids))
+                     for shard, user_ids in zip(self.shards, shard_user_ids)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        failed = [index for index, process in enumerate(processes) if process.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"Inserting into shards {failed} failed")
+
+    def close_connection(self):
+        for program in self.programs:
+            program.connection.close_connection()
+
+
+def _insert_shard(options, shard, workers, user_ids):
+    program = Part1(**options, **shard)
+    try:
+        program.insert_gps_data(workers, user_ids)
+    finally:
+        program.connection.close_connection()
+
+
+class ShardConnections:
+    """
+    The connections to the shards of a ShardedPart2, closed together like a DbConnector
+    """
+
+    def __init__(self, shards):
+        """
+        Args:
+            shards (list[dict]): "host" of the MongoDB server of each shard
+        """
+        self.connections = [DbConnector(HOST=shard.get("host", "localhost:27017")) for shard in shards]
+
+    def close_connection(self):
+        for connection in self.connections:
+            connection.close_connection()
+
+
+class ShardedPart2(Part2):
+    """
+    Runs the Part2 tasks on the shards inserted by ShardedPart1 as scatter-gather: every shard computes
+    the partial result of a task at the same time, and the partial results are merged here.
+    A user is only in one shard, so results per user are merged by concatenating them, and the top 20
+    users are among the top 20 of each shard. Results per year or transportation mode are added up
+    """
+
+    def __init__(self, shards, bucketed=False):
+        """
+        Args:
+            shards (list[dict]): see ShardConnections
+            bucketed (bool): see Part2
+        """
+        self.connection = ShardConnections(shards)
+        self.shard_count = len(shards)
+        self.bucketed = bucketed
+        self.programs = [Part2(bucketed, connection) for connection in self.connection.connections]
+        self.executor = ThreadPoolExecutor(max_workers=len(self.programs))
+
+    def _scatter(self, method, *args):
+        """Runs a Part2 method on every shard at once, each with its own client
+
+        Returns:
+            list: the result of each shard
+        """
+        return list(self.executor.map(lambda program: getattr(program, method)(*args), self.programs))
+
+    def _concatenate(self, results):
+        """
+        Returns:
+            list: the documents or values of all shards, sorted by user id
+        """
+        return sorted((result for shard_results in results for result in shard_results),
+                      key=lambda result: result["_id"] if isinstance(result, dict) else result)
+
+    def _top(self, results, field, k=20):
+        """
+        Returns:
+            list[dict]: the k documents of all shards with the largest field
+        """
+        return sorted(self._concatenate(results), key=lambda document: document[field], reverse=True)[:k]
+
+    def _sum_by_id(self, results, field):
+        """
+        Returns:
+            list[dict]: the documents of all shards with the same _id as one document, with the sum of field
+        """
+        sums = {}
+        for shard_results in results:
+            for document in shard_results:
+                sums[document["_id"]] = sums.get(document["_id"], 0) + document[field]
+        return [{"_id": _id, field: total} for _id, total in sorted(sums.items())]
+
+    def _task1_counts(self):
+        return tuple(sum(counts) for counts in zip(*self._scatter("_task1_counts")))
+
+    def _task2_counts(self):
+        return tuple(sum(counts) for counts in zip(*self._scatter("_task2_counts")))
+
+    def _task3_users(self):
+        return self._top(self._scatter("_task3_users"), "activity_count")
+
+    def _task4_users(self):
+        return self._concatenate(self._scatter("_task4_users"))
+
+    def _task5_counts(self):
+        return self._sum_by_id(self._scatter("_task5_counts"), "activity_count")
+
+    def _year_activity_counts(self):
+        return self._sum_by_id(self._scatter("_year_activity_counts"), "activity_count")
+
+    def _year_hours(self):
+        return self._sum_by_id(self._scatter("_year_hours"), "total_hours")
+
+    def _recorded_hours_per_year(self):
+        recorded_hours_per_year = {}
+        for shard_hours in self._scatter("_recorded_hours_per_year"):
+            for year, hours in shard_hours.items():
+                recorded_hours_per_year[year] = recorded_hours_per_year.get(year, 0) + hours
+        return recorded_hours_per_year
+
+    def _distance(self, user_id, transportation_mode, year):
+        # All activities of the user are in its shard
+        return self.programs[shard_of(user_id, self.shard_count)]._distance(user_id, transportation_mode, year)
+
+    def _task8_users(self):
+        return self._top(self._scatter("_task8_users"), "gained_altitude")
+
+    def activity_gap_counts(self, max_gap, use_summary=True):
+        return self._concatenate(self._scatter("activity_gap_counts", max_gap, use_summary))
+
+    def users_near(self, lat, lon, radius):
+        return self._concatenate(self._scatter("users_near", lat, lon, radius))
+
+    def _task11_users(self):
+        return self._concatenate(self._scatter("_task11_users"))
+
+    def close_connection(self):
+        self.executor.shutdown()
+        self.connection.close_connection()
+
+
+def main():
+    start_time = time.perf_counter()
+    # The server of each shard, like local MongoDB servers on different ports
+    shards = [{"host": "localhost:27017"}, {"host": "localhost:27018"}]
+    insert = False
+    program = None
+    try:
+        if insert:
+            program = ShardedPart1(shards)
+            program.reset_database()
+            program.insert_gps_data(workers=max(os.cpu_count() // len(shards), 1))
+            program.create_missing_activity_summaries()
+            program.create_location_index()
+        else:
+            program = ShardedPart2(shards)
+            program.task1()
+            program.task2()
+            program.task3()
+            program.task4()
+            program.task5()
+            program.task6a()
+            program.task6b()
+            program.task6b2()
+            program.task7()
+            program.task8()
+            program.task9()
+            program.task10()
+            program.task11()
+    except Exception as e:
+        print("ERROR: Failed to use database:", e)
+    finally:
+        if program:
+            program.close_connection()
+
+    end_time = time.perf_counter()
+    print(f"Program took {(end_time - start_time)/60} minutes to run")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+from DbConnector import DbConnector
+from part2 import Part2
+from pymongo import monitoring
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import threading
+import json
+import time
+import sys
+import io
+import re
+
+
+class TaskMonitor(monitoring.CommandListener):
+    """
+    Counts the documents the server replies with, per task. pymongo publishes the events in the thread
+    running the command, so each task is tracked by the thread it runs in. The reply size in bytes is not
+    counted, as pymongo does not pass it on and encoding every reply again would slow down the tasks
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def start(self):
+        """Starts counting for the task running in the current thread
+        """
+        self.local.documents = 0
+
+    def documents(self):
+        """
+        Returns:
+            int: the documents received by the task running in the current thread
+        """
+        return self.local.documents
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        if not hasattr(self.local, "documents"):
+            return
+        reply = event.reply
+        cursor = reply.get("cursor", {})
+        # find, aggregate and getMore return batches of documents, distinct returns a list of values
+        self.local.documents += len(cursor.get("firstBatch", cursor.get("nextBatch", reply.get("values", []))))
+
+    def failed(self, event):
+        pass
+
+
+class ThreadOutput(io.TextIOBase):
+    """
+    Replaces sys.stdout while tasks run concurrently, so that the output of each task is collected
+    separately and printed in one piece when the task is done
+    """
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def capture(self):
+        """Starts collecting the output of the current thread
+        """
+        self.local.buffer = io.StringIO()
+
+    def release(self):
+        """Stops collecting the output of the current thread
+
+        Returns:
+            string: the collected output
+        """
+        output = self.local.buffer.getvalue()
+        self.local.buffer = None
+        return output
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            return self.stdout.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        self.stdout.flush()
+
+
+def task_names():
+    """
+    Returns:
+        list[string]: the tasks of Part2, in numerical order (task10 after task9)
+    """
+    names = [name for name in dir(Part2) if re.fullmatch(r"task\d+\w*", name)]
+    return sorted(names, key=lambda name: (int(re.search(r"\d+", name).group()), name))
+
+
+def run_task(connection, monitor, output, name, bucketed):
+    """Runs a task on the shared connection
+
+    Args:
+        connection (DbConnector): the connection, whose client pools the connections to the server
+        monitor (TaskMonitor): counts the documents received by the task
+        output (ThreadOutput): collects the output of the task
+        name (string): the task
+        bucketed (bool): see Part2
+
+    Returns:
+        dict: the report of the task
+    """
+    report = {"task": name}
+    output.capture()
+    monitor.start()
+    try:
+        start_time = time.perf_counter()
+        getattr(Part2(bucketed, connection), name)()
+        report["seconds"] = time.perf_counter() - start_time
+        report["documents"] = monitor.documents()
+    except Exception as e:
+        print("ERROR: Failed to use database:", e)
+        report["error"] = str(e)
+    finally:
+        report["output"] = output.release()
+
+    return report
+
+
+def run_tasks(names, workers=4, bucketed=False):
+    """Runs the tasks concurrently over one client, which gives each running task its own
+    connection from its pool. The output of each task is printed when it is done
+
+    Args:
+        names (list[string]): the tasks
+        workers (int): the number of tasks running at once
+        bucketed (bool): see Part2
+
+    Returns:
+        dict: the total wall time, and the wall time and documents received of each task,
+        in the given order
+    """
+    monitor = TaskMonitor()
+    connection = DbConnector(EVENT_LISTENERS=[monitor])
+    output = ThreadOutput(sys.stdout)
+    sys.stdout = output
+    start_time = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run_task, connection, monitor, output, name, bucketed) for name in names]
+            reports = []
+            for future in futures:
+                report = future.result()
+                output.stdout.write(report.pop("output"))
+                reports.append(report)
+    finally:
+        sys.stdout = output.stdout
+        connection.close_connection()
+
+    return {"seconds": time.perf_counter() - start_time, "tasks": reports}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs the tasks of part 2 concurrently")
+    parser.add_argument("tasks", nargs="*", help=f"the tasks to run, all by default: {' '.join(task_names())}")
+    parser.add_argument("--workers", type=int, default=4, help="number of tasks running at once")
+    parser.add_argument("--bucketed", action="store_true", help="read the track points from buckets")
+    parser.add_argument("--report", help="write the timing report as JSON to this file")
+    args = parser.parse_args()
+
+    names = args.tasks or task_names()
+    unknown = set(names) - set(task_names())
+    if unknown:
+        parser.error(f"unknown tasks: {' '.join(sorted(unknown))}")
+
+    report = run_tasks(names, args.workers, args.bucketed)
+    for task_report in report["tasks"]:
+        if "error" in task_report:
+            print(f"{task_report['task']}: failed: {task_report['error']}")
+        else:
+            print(f"{task_report['task']}: {task_report['seconds']:.2f} s, {task_report['documents']} documents")
+    print(f"All tasks took {report['seconds']:.2f} s")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
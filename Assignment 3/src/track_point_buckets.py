@@ -0,0 +1,107 @@
+import numpy as np
+
+# Number of track points per bucket document. No valid activity has more than 2500 track points,
+# so an activity is stored in at most 3 buckets
+BUCKET_SIZE = 1000
+
+
+def make_buckets(activity_id, track_points, bucket_size=BUCKET_SIZE):
+    """Packs the track points of an activity into bucket documents of parallel arrays.
+    Each bucket also holds the time span and bounding box of its track points, so that
+    queries can skip buckets without reading their arrays
+
+    Args:
+        activity_id (ObjectId): the activity id
+        track_points (dict[string, np.ndarray]): lat, lon, altitude, date_days and date_time columns
+        bucket_size (int): maximum number of track points per bucket
+
+    Returns:
+        list[dict]: the bucket documents, numbered by seq in recorded order
+    """
+    buckets = []
+    for seq, start in enumerate(range(0, len(track_points["lat"]), bucket_size)):
+        end = start + bucket_size
+        lats = track_points["lat"][start:end]
+        lons = track_points["lon"][start:end]
+        date_times = track_points["date_time"][start:end]
+        bucket = {"activity_id": activity_id,
+                  "seq": seq,
+                  "count": len(lats),
+                  "min_date_time": date_times.min().item(),
+                  "max_date_time": date_times.max().item(),
+                  "min_lat": float(lats.min()),
+                  "max_lat": float(lats.max()),
+                  "min_lon": float(lons.min()),
+                  "max_lon": float(lons.max()),
+                  # tolist() converts each column to Python floats, ints and datetimes in one go
+                  "lat": lats.tolist(),
+                  "lon": lons.tolist(),
+                  "altitude": track_points["altitude"][start:end].tolist(),
+                  "date_days": track_points["date_days"][start:end].tolist(),
+                  "date_time": date_times.tolist()}
+        locations = multi_point(lats, lons)
+        if locations:
+            bucket["locations"] = locations
+        buckets.append(bucket)
+
+    return buckets
+
+
+def valid_coordinates(lats, lons):
+    """
+    Args:
+        lats (np.ndarray): latitudes
+        lons (np.ndarray): longitudes
+
+    Returns:
+        np.ndarray: mask of the coordinates that can be stored as GeoJSON, which the 2dsphere index
+        rejects if they are out of range
+    """
+    return (np.abs(lats) <= 90) & (np.abs(lons) <= 180)
+
+
+def multi_point(lats, lons):
+    """
+    Args:
+        lats (np.ndarray): latitudes of track points
+        lons (np.ndarray): longitudes of track points
+
+    Returns:
+        dict: the valid coordinates as a GeoJSON MultiPoint, or None if there are none
+    """
+    valid = valid_coordinates(lats, lons)
+    if not valid.any():
+        return None
+    # GeoJSON puts the longitude first
+    return {"type": "MultiPoint", "coordinates": np.column_stack((lons[valid], lats[valid])).tolist()}
+
+
+def find_track_points(db, activity_id, bucketed=False):
+    """Reads the track points of an activity in recorded order, from either layout
+
+    Args:
+        db: the database
+        activity_id (ObjectId): the activity id
+        bucketed (bool): read from the track_point_bucket collection instead of the track_point collection
+
+    Returns:
+        dict[string, list]: lat, lon, altitude and date_time of the track points
+    """
+    fields = ["lat", "lon", "altitude", "date_time"]
+    columns = {field: [] for field in fields}
+    if bucketed:
+        buckets = db["track_point_bucket"].find({"activity_id": activity_id},
+                                                {field: 1 for field in fields}).sort("seq", 1)
+        for bucket in buckets:
+            for field in fields:
+                columns[field].extend(bucket[field])
+    else:
+        # Sorted by _id, which is the order the track points were inserted in
+        track_points = db["track_point"].find({"activity_id": activity_id},
+                                              {field: 1 for field in fields}).sort("_id", 1)
+        for track_point in track_points:
+            for field in fields:
+                columns[field].append(track_point[field])
+
+    return columns
+
@@ -0,0 +1,114 @@
+"""
+Checks that Part2.activity_gap_counts gives the same counts from activity_summary as from the track points,
+with the definition of the original task 9: the time difference from a track point to the next one in
+recorded order. The comparison of both paths needs a MongoDB server, given by MONGODB_URI, and is skipped
+without one.
+
+Run from the repository root:
+python -m unittest discover -s "Assignment 3/tests"
+"""
+from types import SimpleNamespace
+import unittest
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from activity_summary import summarize_activity, max_time_gap_of
+from track_point_buckets import make_buckets
+from part2 import Part2
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from bson import ObjectId
+import numpy as np
+
+MAX_GAP = 5 * 60
+# Seconds after the start of each activity of each user, in recorded order
+ACTIVITIES = {
+    "u1": [
+        # Goes back in time: only the recorded order has a gap of more than 5 minutes
+        [0, 400, 100],
+        # Goes back 400 seconds, which is not a gap, and never forward by more than 5 minutes
+        [1000, 1200, 800, 1000],
+    ],
+    "u2": [
+        [0, 301],
+        # Exactly 5 minutes is not more than 5 minutes
+        [0, 300],
+    ],
+}
+EXPECTED_COUNTS = [("u1", 1), ("u2", 1)]
+
+
+def track_point_columns(offsets):
+    date_times = np.datetime64("2008-10-23T02:53:04", "s") + np.array(offsets, dtype="timedelta64[s]")
+    return {"lat": np.full(len(offsets), 39.98),
+            "lon": np.full(len(offsets), 116.32),
+            "altitude": np.full(len(offsets), 100, dtype=np.int64),
+            "date_days": np.zeros(len(offsets)),
+            "date_time": date_times}
+
+
+class MaxTimeGapTest(unittest.TestCase):
+
+    def test_recorded_order(self):
+        self.assertEqual(max_time_gap_of(np.array([0, 400, 100])), 400)
+        self.assertEqual(max_time_gap_of(np.array([1000, 1200, 800, 1000])), 200)
+        self.assertEqual(max_time_gap_of(np.array([300, 200, 100])), 0)
+        self.assertEqual(max_time_gap_of(np.array([0])), 0)
+
+    def test_summary(self):
+        columns = track_point_columns([1000, 1200, 800, 1000])
+        summary = summarize_activity(columns["lat"], columns["lon"], columns["altitude"], columns["date_time"])
+        self.assertEqual(summary["max_time_gap"], 200)
+
+
+class ActivityGapCountsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = MongoClient(os.environ.get("MONGODB_URI", "mongodb://localhost:27017"),
+                                 serverSelectionTimeoutMS=2000)
+        try:
+            cls.client.admin.command("ping")
+        except PyMongoError as e:
+            cls.client.close()
+            raise unittest.SkipTest(f"no MongoDB server: {e}")
+        cls.db = cls.client["test_activity_gap_counts"]
+        cls.client.drop_database(cls.db.name)
+
+        for user_id, activities in ACTIVITIES.items():
+            for offsets in activities:
+                activity_id = ObjectId()
+                columns = track_point_columns(offsets)
+                cls.db.activity.insert_one({"_id": activity_id, "user_id": user_id})
+                summary = {"_id": activity_id, "user_id": user_id}
+                summary.update(summarize_activity(columns["lat"], columns["lon"], columns["altitude"],
+                                                  columns["date_time"]))
+                cls.db.activity_summary.insert_one(summary)
+                # In recorded order, like Part1 inserts them
+                cls.db.track_point.insert_many([{"activity_id": activity_id, "date_time": date_time}
+                                                for date_time in columns["date_time"].tolist()])
+                # Two track points per bucket, so that the activities span several buckets
+                cls.db.track_point_bucket.insert_many(make_buckets(activity_id, columns, bucket_size=2))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.drop_database(cls.db.name)
+        cls.client.close()
+
+    def gap_counts(self, bucketed, use_summary):
+        connection = SimpleNamespace(client=self.client, db=self.db)
+        return Part2(bucketed, connection).activity_gap_counts(MAX_GAP, use_summary)
+
+    def test_summary_and_track_points_agree(self):
+        self.assertEqual(self.gap_counts(bucketed=False, use_summary=True), EXPECTED_COUNTS)
+        self.assertEqual(self.gap_counts(bucketed=False, use_summary=False), EXPECTED_COUNTS)
+
+    def test_summary_and_buckets_agree(self):
+        self.assertEqual(self.gap_counts(bucketed=True, use_summary=True), EXPECTED_COUNTS)
+        self.assertEqual(self.gap_counts(bucketed=True, use_summary=False), EXPECTED_COUNTS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+"""
+Times the ingestion and every Part2 task of the MySQL (Assignment 2) and MongoDB (Assignment 3) programs
+on a generated dataset, using the servers and credentials configured in their DbConnector. The sqlite backend
+runs the MySQL program on an embedded SQLite database in the dataset directory, and needs no server.
+
+Example:
+python benchmark/benchmark.py --users 20 --output results.json --baseline baseline.json
+
+Each step runs in its own process, so that its peak memory use can be measured, and as the modules
+of the two programs have the same names.
+"""
+from generate import generate
+import argparse
+import tempfile
+import subprocess
+import json
+import time
+import sys
+import os
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIRECTORIES = {"mysql": os.path.join(REPOSITORY_ROOT, "Assignment 2", "src"),
+                      "sqlite": os.path.join(REPOSITORY_ROOT, "Assignment 2", "src"),
+                      "mongodb": os.path.join(REPOSITORY_ROOT, "Assignment 3", "src")}
+SQLITE_FILE = "benchmark.sqlite"
+
+
+def run_step(backend, step, data_root, workers, pipeline=False):
+    """Runs a step in a child process
+
+    Args:
+        backend (string): mysql, sqlite or mongodb
+        step (string): ingest, or the name of a Part2 task
+        data_root (string): the directory with the generated dataset
+        workers (int): number of ingestion processes
+        pipeline (bool): ingest with the IngestPipeline instead of Part1.insert_gps_data
+
+    Returns:
+        dict: the wall time in seconds and peak memory use in bytes of the step, or the error if it failed
+    """
+    with tempfile.NamedTemporaryFile("r", suffix=".json") as result_file:
+        command = [sys.executable, os.path.abspath(__file__), "--step", step, "--backend", backend,
+                   "--data-root", data_root, "--workers", str(workers), "--result", result_file.name]
+        if pipeline:
+            command.append("--pipeline")
+        # The output of the programs is left out, only the result file is read
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        # wait4 gives the resource usage of this child alone. The peak memory use includes
+        # the ingestion workers, as they are forked from it
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        result = json.loads(result_file.read() or "{}")
+        if process.returncode != 0 and "error" not in result:
+            result["error"] = f"exited with {process.returncode}"
+        # Kilobytes on Linux
+        result["peak_rss"] = usage.ru_maxrss * 1024
+        return result
+
+
+def child_step(backend, step, data_root, workers, result_path, pipeline=False):
+    """Runs a step in the current process, and writes its wall time to result_path
+    """
+    sys.path.insert(0, SOURCE_DIRECTORIES[backend])
+    # The programs read the dataset from ./dataset
+    os.chdir(data_root)
+    result = {}
+    try:
+        if step == "ingest":
+            from part1 import Part1
+            from ingest_pipeline import IngestPipeline
+            program = Part1(sqlite_path=SQLITE_FILE) if backend == "sqlite" else Part1()
+            start_time = time.perf_counter()
+            if backend in ("mysql", "sqlite"):
+                program.reset_database()
+                program.create_table_user()
+                program.create_table_activity()
+                program.create_table_activity_summary()
+                program.create_table_track_point(indexes=False)
+                program.create_table_ingest_manifest()
+            else:
+                program.reset_database()
+            if pipeline:
+                IngestPipeline(program, parse_workers=workers).run()
+            else:
+                program.insert_gps_data(workers=workers)
+            if backend in ("mysql", "sqlite"):
+                program.create_track_point_indexes()
+            else:
+                program.create_location_index()
+            result["seconds"] = time.perf_counter() - start_time
+        else:
+            from part2 import Part2
+            if backend == "sqlite":
+                from DbConnector import SqliteDbConnector
+                program = Part2(SqliteDbConnector(PATH=SQLITE_FILE))
+            else:
+                program = Part2()
+            start_time = time.perf_counter()
+            getattr(program, step)()
+            result["seconds"] = time.perf_counter() - start_time
+        program.connection.close_connection()
+    except Exception as e:
+        result["error"] = str(e)
+
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+
+
+def task_names(backend):
+    """
+    Returns:
+        list[string]: the Part2 tasks of the backend, listed by its task runner
+    """
+    command = [sys.executable, "-c", "from task_runner import task_names; print(' '.join(task_names()))"]
+    output = subprocess.run(command, cwd=SOURCE_DIRECTORIES[backend], capture_output=True, text=True, check=True)
+    return output.stdout.split()
+
+
+def compare(results, baseline, tolerance):
+    """Compares the wall times with those of a baseline
+
+    Args:
+        results (dict): the benchmark results
+        baseline (dict): earlier benchmark results
+        tolerance (float): how much slower a step may be before it counts as a regression, 0.2 is 20%
+
+    Returns:
+        list[string]: the regressions
+    """
+    regressions = []
+    for backend, steps in results["backends"].items():
+        for step, result in steps.items():
+            baseline_result = baseline.get("backends", {}).get(backend, {}).get(step)
+            if not baseline_result or "seconds" not in baseline_result or "seconds" not in result:
+                continue
+            change = result["seconds"] / max(baseline_result["seconds"], 1e-9) - 1
+            result["change"] = change
+            if change > tolerance:
+                regressions.append(f"{backend} {step}: {baseline_result['seconds']:.3f} s -> "
+                                   f"{result['seconds']:.3f} s ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the ingestion and tasks on a generated dataset")
+    parser.add_argument("--backends", nargs="+", choices=sorted(SOURCE_DIRECTORIES), default=sorted(SOURCE_DIRECTORIES))
+    parser.add_argument("--tasks", nargs="*", help="the tasks to time, all by default")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--trajectories", type=int, default=20, help="number of trajectories per user")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of ingestion processes")
+    parser.add_argument("--pipeline", action="store_true", help="ingest with the pipelined ingestion")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare the wall times with the results in this file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown relative to the baseline")
+    # Used by the child processes running a single step
+    parser.add_argument("--step", help=argparse.SUPPRESS)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    parser.add_argument("--data-root", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.step:
+        child_step(args.backend, args.step, args.data_root, args.workers, args.result, args.pipeline)
+        return
+
+    with tempfile.TemporaryDirectory() as data_root:
+        dataset = generate(data_root, users=args.users, trajectories=args.trajectories, seed=args.seed)
+        print(f"Generated {dataset['trajectory_files']} trajectory files with {dataset['track_points']} track points")
+        results = {"dataset": {**dataset, "seed": args.seed}, "backends": {}}
+
+        for backend in args.backends:
+            steps = {}
+            results["backends"][backend] = steps
+            steps["ingest"] = run_step(backend, "ingest", data_root, args.workers, args.pipeline)
+            if "seconds" in steps["ingest"]:
+                steps["ingest"]["points_per_second"] = dataset["valid_track_points"] / steps["ingest"]["seconds"]
+            for task in args.tasks or task_names(backend):
+                steps[task] = run_step(backend, task, data_root, args.workers)
+
+    for backend, steps in results["backends"].items():
+        for step, result in steps.items():
+            if "error" in result:
+                print(f"{backend} {step}: failed: {result['error']}")
+            else:
+                print(f"{backend} {step}: {result['seconds']:.3f} s, peak RSS {result['peak_rss'] / 2 ** 20:.0f} MiB")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        print(f"{len(regressions)} regressions compared to {args.baseline}")
+        for regression in regressions:
+            print(regression)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
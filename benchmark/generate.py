@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+import argparse
+import random
+import math
+import os
+
+# Start of the Geolife recordings, and day zero of the date_days field in the plt files
+START_DATE_TIME = datetime(2007, 4, 1)
+DATE_DAYS_EPOCH = datetime(1899, 12, 30)
+# Beijing, where most of the Geolife track points are
+CENTER = (39.95, 116.35)
+TRANSPORTATION_MODES = ["walk", "bike", "bus", "car", "taxi", "subway", "train", "airplane", "boat", "run"]
+# Roughly the speed in m/s of each transportation mode
+SPEEDS = {"walk": 1.4, "bike": 4.5, "bus": 8, "car": 12, "taxi": 12, "subway": 15, "train": 25,
+          "airplane": 200, "boat": 6, "run": 3}
+PLT_HEADER = "Geolife trajectory\nWGS 84\nAltitude is in Feet\nReserved 3\n0,2,255,My Track,0,0,2,8421376\n0\n"
+
+
+def generate(root, users=10, trajectories=20, max_track_points=3000, labeled_fraction=0.5, seed=0):
+    """Generates a dataset with the layout and file formats of Geolife, in root/dataset.
+    Trajectories are random walks around Beijing, and about every tenth trajectory has more
+    than 2500 track points, so that it is skipped by the ingestion like in Geolife
+
+    Args:
+        root (string): the directory to generate the dataset in
+        users (int): number of users
+        trajectories (int): number of trajectories per user
+        max_track_points (int): maximum number of track points per trajectory
+        labeled_fraction (float): fraction of the users with labels
+        seed (int): seed of the random generator, the same seed always gives the same dataset
+
+    Returns:
+        dict: the number of users, trajectory files, track points, and track points in files
+        that are short enough to be inserted
+    """
+    rng = random.Random(seed)
+    user_ids = [f"{user:03d}" for user in range(users)]
+    labeled_ids = sorted(rng.sample(user_ids, round(users * labeled_fraction)))
+    stats = {"users": users, "trajectory_files": 0, "track_points": 0, "valid_track_points": 0}
+
+    os.makedirs(f"{root}/dataset/Data", exist_ok=True)
+    with open(f"{root}/dataset/labeled_ids.txt", "w") as f:
+        f.writelines(f"{user_id}\n" for user_id in labeled_ids)
+
+    for user_id in user_ids:
+        os.makedirs(f"{root}/dataset/Data/{user_id}/Trajectory", exist_ok=True)
+        labels = []
+        date_time = START_DATE_TIME + timedelta(days=rng.uniform(0, 365))
+
+        for _ in range(trajectories):
+            date_time += timedelta(hours=rng.uniform(1, 72))
+            if rng.random() < 0.1:
+                track_point_count = rng.randint(2501, max(max_track_points, 2501))
+            else:
+                track_point_count = rng.randint(10, min(max_track_points, 2500))
+            transportation_mode = rng.choice(TRANSPORTATION_MODES)
+            track_points = _random_walk(rng, date_time, track_point_count, SPEEDS[transportation_mode])
+
+            with open(f"{root}/dataset/Data/{user_id}/Trajectory/{date_time:%Y%m%d%H%M%S}.plt", "w") as f:
+                f.write(PLT_HEADER)
+                for lat, lon, altitude, track_point_date_time in track_points:
+                    date_days = (track_point_date_time - DATE_DAYS_EPOCH) / timedelta(days=1)
+                    f.write(f"{lat:.6f},{lon:.6f},0,{altitude},{date_days:.10f},"
+                            f"{track_point_date_time:%Y-%m-%d},{track_point_date_time:%H:%M:%S}\n")
+
+            stats["trajectory_files"] += 1
+            stats["track_points"] += track_point_count
+            if track_point_count <= 2500:
+                stats["valid_track_points"] += track_point_count
+
+            # Most labels match a trajectory exactly, some only overlap it
+            start_date_time, end_date_time = track_points[0][3], track_points[-1][3]
+            if rng.random() < 0.2:
+                start_date_time += timedelta(seconds=rng.randint(1, 60))
+            labels.append((start_date_time, end_date_time, transportation_mode))
+            date_time = end_date_time
+
+        if user_id in labeled_ids:
+            with open(f"{root}/dataset/Data/{user_id}/labels.txt", "w") as f:
+                f.write("Start Time\tEnd Time\tTransportation Mode\n")
+                for start_date_time, end_date_time, transportation_mode in labels:
+                    f.write(f"{start_date_time:%Y/%m/%d %H:%M:%S}\t{end_date_time:%Y/%m/%d %H:%M:%S}\t"
+                            f"{transportation_mode}\n")
+
+    return stats
+
+
+def _random_walk(rng, date_time, track_point_count, speed):
+    """
+    Returns:
+        list[tuple]: lat, lon, altitude (in feet, -777 if invalid) and date_time of each track point
+    """
+    # Starting close to the center, so that the walks of different users cross
+    lat = CENTER[0] + rng.gauss(0, 0.05)
+    lon = CENTER[1] + rng.gauss(0, 0.05)
+    altitude = rng.randint(0, 500)
+    heading = rng.uniform(0, 2 * math.pi)
+    track_points = []
+    for _ in range(track_point_count):
+        track_points.append((lat, lon, altitude if rng.random() > 0.02 else -777, date_time))
+        # Mostly every few seconds, with an occasional gap of more than 5 minutes
+        seconds = rng.randint(1, 10) if rng.random() > 0.001 else rng.randint(301, 3600)
+        heading += rng.gauss(0, 0.3)
+        meters = speed * seconds * rng.uniform(0.5, 1.5)
+        lat += meters * math.cos(heading) / 111000
+        lon += meters * math.sin(heading) / (111000 * math.cos(math.radians(lat)))
+        altitude += rng.randint(-5, 5)
+        date_time += timedelta(seconds=seconds)
+
+    return track_points
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a dataset in the Geolife format")
+    parser.add_argument("root", help="the directory to generate the dataset in")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--trajectories", type=int, default=20, help="number of trajectories per user")
+    parser.add_argument("--max-track-points", type=int, default=3000)
+    parser.add_argument("--labeled-fraction", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    stats = generate(args.root, args.users, args.trajectories, args.max_track_points, args.labeled_fraction,
+                     args.seed)
+    print(f"Generated {stats['trajectory_files']} trajectory files with {stats['track_points']} track points "
+          f"for {stats['users']} users")
+
+
+if __name__ == '__main__':
+    main()